@@ -31,14 +31,30 @@ def create_app() -> Flask:
 		SQLALCHEMY_TRACK_MODIFICATIONS=False,
 		SCHEDULER_API_ENABLED=False,
 		PERMANENT_SESSION_LIFETIME=timedelta(days=7),
+		# Raise instead of warn when a view exceeds its query budget
+		QUERY_BUDGET_STRICT=os.getenv("QUERY_BUDGET_STRICT", "0") == "1",
 	)
 
 	db.init_app(app)
 	csrf.init_app(app)
 
+	from .signatures import SignatureVerifier
+
+	# Keyed once per process; without a secret, webhook signatures are not checked
+	webhook_secret = os.getenv("PAYADVANTAGE_WEBHOOK_SECRET")
+	app.extensions["payadvantage_webhook_verifier"] = (
+		SignatureVerifier(webhook_secret.encode()) if webhook_secret else None
+	)
+	app.config["PAYADVANTAGE_WEBHOOK_SIGNATURE_HEADER"] = os.getenv(
+		"PAYADVANTAGE_WEBHOOK_SIGNATURE_HEADER", "X-PayAdvantage-Signature"
+	)
+
 	with app.app_context():
 		from . import models  # noqa: F401
-		db.create_all()
+		from .migrations import run_migrations
+		from .query_budget import init_query_counter
+		run_migrations()
+		init_query_counter(db.engine)
 
 	from .routes import main_bp
 	from .admin import admin_bp
@@ -47,14 +63,22 @@ def create_app() -> Flask:
 	app.register_blueprint(main_bp)
 	app.register_blueprint(admin_bp, url_prefix="/admin")
 	app.register_blueprint(webhooks_bp, url_prefix="/webhooks")
+	# Provider callbacks cannot carry a CSRF token
+	csrf.exempt(webhooks_bp)
+
+	from .cli import register_commands
 
-	from .scheduler import schedule_jobs
+	register_commands(app)
+
+	# "embedded" runs the jobs inside every app process (leases keep each job to
+	# one process per tick); "external" leaves them to `flask scheduler`
+	app.config["SCHEDULER_MODE"] = os.getenv("SCHEDULER_MODE", "embedded")
+
+	from .scheduler import start_scheduler
 
 	global _scheduler
-	if _scheduler is None:
-		_scheduler = BackgroundScheduler(timezone="UTC")
-		schedule_jobs(_scheduler, app)
-		_scheduler.start()
+	if _scheduler is None and app.config["SCHEDULER_MODE"] == "embedded":
+		_scheduler = start_scheduler(app, BackgroundScheduler(timezone="UTC"))
 
 	# Ensure basic logging is configured
 	if not app.logger.handlers:
@@ -62,3 +86,10 @@ def create_app() -> Flask:
 		logging.basicConfig(level=getattr(logging, level, logging.INFO))
 
 	return app
+
+
+def stop_embedded_scheduler() -> None:
+	global _scheduler
+	if _scheduler is not None:
+		_scheduler.shutdown(wait=False)
+		_scheduler = None
\ No newline at end of file
@@ -1,14 +1,21 @@
 from datetime import date, timedelta, datetime
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from typing import Optional
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, abort
 import os
+import json
 import uuid
+import base64
 import requests
-from sqlalchemy import func
-from . import db
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import joinedload
+from . import db, outbox, resilience, rollups
+from .expansion import expand_schedules
 from .forms import PaymentScheduleForm
-from .models import Booking, PaymentSchedule, Payment, XeroAuth
-from .pay_advantage import PayAdvantageClient
-from .xero_client import XeroClient
+from .models import Booking, PaymentSchedule, Payment, XeroAuth, OutboxMessage, JobRun
+from .xero_client import reset_token_cache
+from .query_budget import query_budget
+from .search import search_bookings
+from .transport import get_session, get_timeout, transport_stats
 
 admin_bp = Blueprint("admin", __name__)
 
@@ -17,12 +24,104 @@ def _to_cents(amount_decimal) -> int:
 	return int(round(float(amount_decimal) * 100))
 
 
+def _encode_cursor(booking: Booking) -> str:
+	raw = f"{booking.created_at.isoformat()}|{booking.id}"
+	return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, int]:
+	try:
+		padded = cursor + "=" * (-len(cursor) % 4)
+		created_at, booking_id = base64.urlsafe_b64decode(padded).decode().split("|")
+		return datetime.fromisoformat(created_at), int(booking_id)
+	except ValueError:
+		abort(400, "Invalid cursor")
+
+
+def _parse_date_arg(name: str) -> Optional[date]:
+	value = request.args.get(name)
+	if not value:
+		return None
+	try:
+		return date.fromisoformat(value)
+	except ValueError:
+		abort(400, f"Invalid {name}")
+
+
 @admin_bp.route("/")
 @admin_bp.route("/bookings")
+@query_budget(3)
 def bookings_list():
-	bookings = Booking.query.filter_by(status="active").order_by(Booking.created_at.desc()).all()
+	max_page_size = int(os.getenv("BOOKINGS_MAX_PAGE_SIZE", "200"))
+	limit = min(max(request.args.get("limit", 50, type=int), 1), max_page_size)
+	filters = {
+		"schedule": request.args.get("schedule", ""),  # "", "set" or "unset"
+		"frequency": request.args.get("frequency", ""),
+		"created_from": request.args.get("created_from", ""),
+		"created_to": request.args.get("created_to", ""),
+	}
+	created_from = _parse_date_arg("created_from")
+	created_to = _parse_date_arg("created_to")
+
+	query = Booking.query.options(joinedload(Booking.payment_schedule)).filter(Booking.status == "active")
+	if filters["schedule"] == "unset":
+		query = query.outerjoin(PaymentSchedule).filter(PaymentSchedule.id.is_(None))
+	elif filters["schedule"] == "set" or filters["frequency"]:
+		query = query.join(PaymentSchedule)
+		if filters["frequency"]:
+			query = query.filter(PaymentSchedule.frequency == filters["frequency"])
+	if created_from:
+		query = query.filter(Booking.created_at >= datetime.combine(created_from, datetime.min.time()))
+	if created_to:
+		query = query.filter(Booking.created_at < datetime.combine(created_to + timedelta(days=1), datetime.min.time()))
+
+	cursor = request.args.get("cursor")
+	if cursor:
+		# Keyset pagination on (created_at, id): the page cost doesn't grow with the offset
+		cursor_created_at, cursor_id = _decode_cursor(cursor)
+		query = query.filter(
+			or_(
+				Booking.created_at < cursor_created_at,
+				and_(Booking.created_at == cursor_created_at, Booking.id < cursor_id),
+			)
+		)
+
+	# Fetch one extra row to learn whether there is a next page
+	bookings = query.order_by(Booking.created_at.desc(), Booking.id.desc()).limit(limit + 1).all()
+	next_cursor = None
+	if len(bookings) > limit:
+		bookings = bookings[:limit]
+		next_cursor = _encode_cursor(bookings[-1])
+
+	xero_auth = XeroAuth.query.first()
+	return render_template(
+		"admin/bookings_list.html",
+		bookings=bookings,
+		xero_auth=xero_auth,
+		filters={key: value for key, value in filters.items() if value},
+		limit=limit,
+		next_cursor=next_cursor,
+		paginated=bool(cursor),
+	)
+
+
+@admin_bp.route("/bookings/search")
+@query_budget(3)
+def bookings_search():
+	search_query = request.args.get("q", "").strip()
+	limit = min(max(request.args.get("limit", 50, type=int), 1), int(os.getenv("BOOKINGS_MAX_PAGE_SIZE", "200")))
+	bookings = search_bookings(search_query, limit=limit) if search_query else []
 	xero_auth = XeroAuth.query.first()
-	return render_template("admin/bookings_list.html", bookings=bookings, xero_auth=xero_auth)
+	return render_template(
+		"admin/bookings_list.html",
+		bookings=bookings,
+		xero_auth=xero_auth,
+		filters={},
+		limit=limit,
+		next_cursor=None,
+		paginated=False,
+		search_query=search_query,
+	)
 
 
 @admin_bp.route("/xero/connect")
@@ -41,7 +140,7 @@ def xero_connect():
 	state = uuid.uuid4().hex
 	session["xero_oauth_state"] = state
 	authorize_url = (
-		"https://login.xero.com/identity/connect/authorize"
+		os.getenv("XERO_AUTHORIZE_URL", "https://login.xero.com/identity/connect/authorize")
 		+ "?response_type=code"
 		+ f"&client_id={client_id}"
 		+ f"&redirect_uri={redirect_uri}"
@@ -67,20 +166,27 @@ def xero_callback():
 	client_secret = os.getenv("XERO_CLIENT_SECRET")
 	redirect_uri = os.getenv("XERO_REDIRECT_URI", "http://localhost:5000/admin/xero/callback")
 
+	http = get_session("xero")
+	timeout = get_timeout("xero")
 	try:
 		# Exchange code for tokens
-		token_resp = requests.post(
-			"https://identity.xero.com/connect/token",
-			data={
-				"grant_type": "authorization_code",
-				"code": code,
-				"redirect_uri": redirect_uri,
-				"client_id": client_id,
-				"client_secret": client_secret,
-			},
-			timeout=30,
-		)
-		token_resp.raise_for_status()
+		def exchange_code():
+			resp = http.post(
+				os.getenv("XERO_IDENTITY_URL", "https://identity.xero.com/connect/token"),
+				data={
+					"grant_type": "authorization_code",
+					"code": code,
+					"redirect_uri": redirect_uri,
+					"client_id": client_id,
+					"client_secret": client_secret,
+				},
+				timeout=timeout,
+			)
+			resp.raise_for_status()
+			return resp
+
+		# Codes are single use: not idempotent
+		token_resp = resilience.call("xero", exchange_code)
 		payload = token_resp.json()
 		access_token = payload.get("access_token")
 		refresh_token = payload.get("refresh_token")
@@ -90,12 +196,16 @@ def xero_callback():
 			raise RuntimeError("Missing tokens in Xero response")
 
 		# Get tenant (connection)
-		conn_resp = requests.get(
-			"https://api.xero.com/connections",
-			headers={"Authorization": f"Bearer {access_token}"},
-			timeout=30,
-		)
-		conn_resp.raise_for_status()
+		def get_connections():
+			resp = http.get(
+				os.getenv("XERO_CONNECTIONS_URL", "https://api.xero.com/connections"),
+				headers={"Authorization": f"Bearer {access_token}"},
+				timeout=timeout,
+			)
+			resp.raise_for_status()
+			return resp
+
+		conn_resp = resilience.call("xero", get_connections, idempotent=True)
 		connections = conn_resp.json() or []
 		if not connections:
 			raise RuntimeError("No Xero tenants authorized for this connection")
@@ -114,6 +224,7 @@ def xero_callback():
 		xero_auth.access_token_expires_at = expires_at
 		xero_auth.scope = scope
 		db.session.commit()
+		reset_token_cache()
 		flash("Xero connected successfully.", "success")
 	except Exception as exc:
 		flash(f"Failed to connect Xero: {exc}", "danger")
@@ -121,101 +232,136 @@ def xero_callback():
 	return redirect(url_for("admin.bookings_list"))
 
 
+@admin_bp.route("/metrics")
+def metrics():
+	return jsonify({"transport": transport_stats(), "breakers": resilience.breaker_states()})
+
+
+@admin_bp.route("/jobs")
+def jobs():
+	runs = JobRun.query.order_by(JobRun.started_at.desc()).limit(100).all()
+	# Per-job duration trend over each job's own most recent runs, so the
+	# polling jobs cannot push the daily ones out of view
+	per_job = int(os.getenv("JOB_STATS_RUNS", "30"))
+	job_ids = db.session.execute(select(JobRun.job_id).distinct()).scalars().all()
+	stats = {}
+	for job_id in sorted(job_ids):
+		recent = (
+			JobRun.query.filter(JobRun.job_id == job_id)
+			.order_by(JobRun.started_at.desc())
+			.limit(per_job)
+			.all()
+		)
+		for run in recent:
+			if run.duration_ms is None:
+				continue
+			job = stats.setdefault(job_id, {"runs": 0, "total_ms": 0, "max_ms": 0, "last": run})
+			job["runs"] += 1
+			job["total_ms"] += run.duration_ms
+			job["max_ms"] = max(job["max_ms"], run.duration_ms)
+	return render_template("admin/jobs.html", runs=runs, stats=stats)
+
+
 @admin_bp.route("/report")
 def report():
-	total_active = Booking.query.filter_by(status="active").count()
-	payments_summary = db.session.query(
-		Payment.status,
-		func.count(Payment.id),
-		func.coalesce(func.sum(Payment.scheduled_amount_cents), 0),
-		func.coalesce(func.sum(Payment.paid_amount_cents), 0),
-	).group_by(Payment.status).all()
-	# Transform into dict for template ease
-	summary = {row[0]: {"count": row[1], "scheduled_sum": row[2], "paid_sum": row[3]} for row in payments_summary}
+	# Read from the incrementally maintained rollups rather than scanning
+	# bookings and payments
+	total_active = rollups.active_bookings()
+	summary = rollups.summary_by_status()
 	return render_template("admin/report.html", total_active=total_active, summary=summary)
 
 
+def _upfront_payments(booking_id: int) -> list[Payment]:
+	# Upfront payments are the ones edit_booking queued an invoice message for
+	messages = OutboxMessage.query.filter_by(kind="xero.create_invoice", booking_id=booking_id).all()
+	payment_ids = [json.loads(message.payload)["payment_id"] for message in messages]
+	if not payment_ids:
+		return []
+	return Payment.query.filter(Payment.id.in_(payment_ids)).all()
+
+
 @admin_bp.route("/bookings/<int:booking_id>/edit", methods=["GET", "POST"])
 def edit_booking(booking_id: int):
 	booking = Booking.query.get_or_404(booking_id)
 	form = PaymentScheduleForm()
-	client = PayAdvantageClient()
-	xero = XeroClient()
 
 	if form.validate_on_submit():
 		upfront_cents = _to_cents(form.upfront_amount.data)
 		recurring_cents = _to_cents(form.recurring_amount.data)
 		frequency = form.frequency.data
 
-		# Create payment schedule with Pay Advantage v3
-		try:
-			schedule_resp = client.create_direct_debit_schedule(
-				customer_name=booking.customer_name,
-				email=booking.email,
-				phone=booking.phone,
-				recurring_amount_cents=recurring_cents,
-				frequency=frequency,
-				description=form.description.data,
-				recurring_date_start=form.recurring_date_start.data,
-				reminder_days=form.reminder_days.data,
-				upfront_amount_cents=upfront_cents,
-			)
-		except requests.HTTPError as exc:
-			provider_msg = None
-			if getattr(exc, "response", None) is not None:
-				try:
-					provider_msg = exc.response.json()
-				except Exception:
-					provider_msg = exc.response.text
-			flash(f"PayAdvantage error: {exc} | Details: {provider_msg}", "danger")
-			return render_template("admin/edit_booking.html", booking=booking, form=form)
-		provider_schedule_id = schedule_resp.get("schedule_id")
-
-		# Store schedule
+		recurring_start = form.recurring_date_start.data
+
+		# Store schedule; the PayAdvantage schedule is created by the outbox worker
 		schedule = booking.payment_schedule or PaymentSchedule(booking_id=booking.id)
+		upfront_payments = _upfront_payments(booking.id)
+		if schedule.id:
+			# Replacing a schedule: drop every recurring payment of the old one
+			# that hasn't been invoiced yet, whatever its date; the new schedule
+			# re-materializes its own
+			for payment in booking.payments:
+				if payment in upfront_payments:
+					continue
+				if payment.status == "pending" and not payment.invoice_id:
+					db.session.delete(payment)
 		schedule.upfront_amount_cents = upfront_cents
 		schedule.recurring_amount_cents = recurring_cents
 		schedule.frequency = frequency
-		schedule.provider_schedule_id = provider_schedule_id
-		# For demonstration, set next debit in 7/14/30 days
-		if frequency == "weekly":
-			schedule.next_debit_date = date.today() + timedelta(days=7)
-		elif frequency == "fortnightly":
-			schedule.next_debit_date = date.today() + timedelta(days=14)
-		else:
-			schedule.next_debit_date = date.today() + timedelta(days=30)
+		schedule.provider_schedule_id = None
+		schedule.recurring_start_date = recurring_start
+		schedule.next_debit_date = recurring_start
 		db.session.add(schedule)
-		db.session.commit()
+		db.session.flush()
+		# An earlier edit still waiting in the outbox is replaced by this one
+		outbox.supersede("payadvantage.create_schedule", booking.id)
+		outbox.enqueue(
+			"payadvantage.create_schedule",
+			{
+				"schedule_id": schedule.id,
+				"recurring_amount_cents": recurring_cents,
+				"frequency": frequency,
+				"upfront_amount_cents": upfront_cents,
+				"description": form.description.data,
+				"recurring_date_start": recurring_start.isoformat(),
+				"reminder_days": form.reminder_days.data,
+			},
+			booking_id=booking.id,
+		)
 
-		# Create upfront invoice via Xero (stub)
-		if upfront_cents > 0:
-			invoice = xero.create_invoice(
-				contact_name=booking.customer_name,
-				email=booking.email,
-				amount_cents=upfront_cents,
-				due_date=date.today(),
-				description=f"Upfront payment for booking #{booking.id}",
-			)
+		# Upfront invoice is created in Xero by the outbox worker. A resubmit with
+		# the same upfront terms reuses the payment already queued (and so its
+		# invoice key); changed terms replace it while it is still un-invoiced
+		queued = None
+		for payment in upfront_payments:
+			if payment.scheduled_amount_cents == upfront_cents and payment.scheduled_date == date.today():
+				queued = payment
+			elif payment.status == "pending" and not payment.invoice_id:
+				db.session.delete(payment)
+		if upfront_cents > 0 and queued is None:
 			upfront_payment = Payment(
 				booking_id=booking.id,
 				scheduled_date=date.today(),
 				scheduled_amount_cents=upfront_cents,
 				status="pending",
-				invoice_id=invoice.get("invoice_id"),
 			)
 			db.session.add(upfront_payment)
+			db.session.flush()
+			outbox.enqueue(
+				"xero.create_invoice",
+				{
+					"payment_id": upfront_payment.id,
+					"description": f"Upfront payment for booking #{booking.id}",
+				},
+				booking_id=booking.id,
+			)
 
-		# Seed the first recurring payment row (subsequent ones could be added by webhook or scheduler)
-		first_recurring = Payment(
-			booking_id=booking.id,
-			scheduled_date=schedule.next_debit_date,
-			scheduled_amount_cents=recurring_cents,
-			status="pending",
-		)
-		db.session.add(first_recurring)
+		# Schedule, payments and outbox messages commit atomically
 		db.session.commit()
+		# Materialize the recurring payments inside the horizon now; the daily
+		# expansion job keeps extending them
+		expand_schedules(schedule_ids=[schedule.id])
 
-		flash("Direct debit schedule set and upfront invoice created.", "success")
+		flash("Direct debit schedule saved. PayAdvantage and Xero requests are queued.", "success")
 		return redirect(url_for("admin.bookings_list"))
 
 	# Pre-fill if schedule exists
@@ -223,13 +369,32 @@ def edit_booking(booking_id: int):
 		form.upfront_amount.data = booking.payment_schedule.upfront_amount_cents / 100.0
 		form.recurring_amount.data = booking.payment_schedule.recurring_amount_cents / 100.0
 		form.frequency.data = booking.payment_schedule.frequency
-		if booking.payment_schedule.next_debit_date:
-			form.recurring_date_start.data = booking.payment_schedule.next_debit_date
+		if booking.payment_schedule.recurring_start_date:
+			form.recurring_date_start.data = booking.payment_schedule.recurring_start_date
 
-	return render_template("admin/edit_booking.html", booking=booking, form=form)
+	outbox_messages = (
+		OutboxMessage.query.filter(
+			OutboxMessage.booking_id == booking.id,
+			OutboxMessage.status.in_(("pending", "processing", "failed")),
+		)
+		.order_by(OutboxMessage.id.asc())
+		.all()
+	)
+	next_payment = next(
+		(p for p in booking.payments if p.status == "pending" and p.scheduled_date >= date.today()),
+		None,
+	)
+	return render_template(
+		"admin/edit_booking.html",
+		booking=booking,
+		form=form,
+		outbox_messages=outbox_messages,
+		next_payment=next_payment,
+	)
 
 
 @admin_bp.route("/bookings/<int:booking_id>/payments")
+@query_budget(2)
 def view_payments(booking_id: int):
 	booking = Booking.query.get_or_404(booking_id)
 	payments = booking.payments
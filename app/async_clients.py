@@ -0,0 +1,190 @@
+import os
+import asyncio
+from datetime import date
+from typing import Optional
+import httpx
+from . import idempotency, resilience
+from .dispatch import async_throttle
+from .job_runs import note_api_call
+from .pay_advantage import PayAdvantageSettings, direct_debit_payload
+from .transport import get_timeout
+from .xero_client import (
+	XeroClient,
+	_payload_args,
+	api_headers,
+	batch_idempotency_key,
+	batch_results,
+	invoice_payload,
+	single_invoice_result,
+	split_cached,
+)
+
+# asyncio counterparts of PayAdvantageClient and XeroClient for fanning out
+# hundreds of provider calls from one thread. They build the same payloads,
+# share the providers' circuit breakers, and keep database work (idempotency
+# records, Xero token refresh) on worker threads so the event loop never
+# blocks on it. A client belongs to the event loop it was first used on.
+
+
+def _concurrency(provider: str) -> int:
+	return int(os.getenv(f"{provider.upper()}_ASYNC_CONCURRENCY") or os.getenv("ASYNC_PROVIDER_CONCURRENCY", "100"))
+
+
+async def _count_api_call(response) -> None:
+	note_api_call()
+
+
+def _http_client(provider: str, concurrency: int) -> httpx.AsyncClient:
+	connect, read = get_timeout(provider)
+	return httpx.AsyncClient(
+		timeout=httpx.Timeout(read, connect=connect),
+		limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+		event_hooks={"response": [_count_api_call]},
+	)
+
+
+class AsyncPayAdvantageClient(PayAdvantageSettings):
+	def __init__(self, concurrency: Optional[int] = None):
+		super().__init__()
+		self.concurrency = concurrency or _concurrency("payadvantage")
+		self.client = _http_client("payadvantage", self.concurrency)
+		self._slots = asyncio.Semaphore(self.concurrency)
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, *exc_info):
+		await self.aclose()
+
+	async def aclose(self) -> None:
+		await self.client.aclose()
+
+	async def create_direct_debit_schedule(
+		self,
+		customer_name: str,
+		email: str,
+		phone: str,
+		recurring_amount_cents: int,
+		frequency: str,
+		description: str,
+		recurring_date_start: date,
+		reminder_days: int,
+		upfront_amount_cents: int = 0,
+		idempotency_key: Optional[str] = None,
+	) -> dict:
+		if idempotency_key:
+			stored = await asyncio.to_thread(idempotency.lookup, idempotency_key)
+			if stored:
+				return stored
+
+		headers, auth = self._request_parts(idempotency_key)
+		payload = direct_debit_payload(
+			customer_name, email, phone, recurring_amount_cents, frequency,
+			description, recurring_date_start, reminder_days, upfront_amount_cents,
+		)
+
+		async def send():
+			async with self._slots:
+				response = await self.client.post(
+					f"{self.base_url}/v3/direct_debits",
+					headers=headers,
+					auth=auth,
+					json=payload,
+				)
+			if not response.is_success:
+				raise httpx.HTTPStatusError(self._log_error(response), request=response.request, response=response)
+			return response
+
+		result = (await resilience.call_async("payadvantage", send)).json()
+		if idempotency_key:
+			await asyncio.to_thread(idempotency.store, "payadvantage", "create_direct_debit_schedule", idempotency_key, result)
+		return result
+
+
+class AsyncXeroClient:
+	def __init__(self, concurrency: Optional[int] = None):
+		# Tokens come from the sync client: same process-wide cache and
+		# single-flight refresh, run on a worker thread
+		self.tokens = XeroClient()
+		self.api_base = self.tokens.api_base
+		self.sales_account_code = self.tokens.sales_account_code
+		self.batch_size = self.tokens.batch_size
+		self.concurrency = concurrency or _concurrency("xero")
+		self.client = _http_client("xero", self.concurrency)
+		# Xero's own per-minute and concurrent-call limits still apply
+		self.throttle = async_throttle("xero")
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, *exc_info):
+		await self.aclose()
+
+	async def aclose(self) -> None:
+		await self.client.aclose()
+
+	async def _access_token(self) -> tuple[str, str]:
+		token = self.tokens._cached_token()
+		if token:
+			return token
+		return await asyncio.to_thread(self.tokens._ensure_access_token)
+
+	async def _post(self, url: str, idempotent: bool = False, **kwargs) -> httpx.Response:
+		async def send():
+			async with self.throttle.slot():
+				response = await self.client.post(url, **kwargs)
+			response.raise_for_status()
+			return response
+		return await resilience.call_async("xero", send, idempotent=idempotent)
+
+	async def create_invoice(
+		self,
+		contact_name: str,
+		email: str,
+		amount_cents: int,
+		due_date,
+		description: str,
+		idempotency_key: Optional[str] = None,
+	) -> dict:
+		if idempotency_key:
+			stored = await asyncio.to_thread(idempotency.lookup, idempotency_key)
+			if stored:
+				return stored
+		access_token, tenant_id = await self._access_token()
+		resp = await self._post(
+			f"{self.api_base}/Invoices",
+			idempotent=bool(idempotency_key),
+			headers=api_headers(access_token, tenant_id, idempotency_key),
+			json={"Invoices": [invoice_payload(contact_name, email, amount_cents, due_date, description, self.sales_account_code)]},
+		)
+		result = single_invoice_result(resp.json(), contact_name, email, amount_cents, due_date, description)
+		if idempotency_key:
+			await asyncio.to_thread(idempotency.store, "xero", "create_invoice", idempotency_key, result)
+		return result
+
+	async def create_invoices_batch(self, invoices: list[dict]) -> list[dict]:
+		# Same contract as XeroClient.create_invoices_batch; the chunks of one
+		# call are sent concurrently
+		results, to_send = await asyncio.to_thread(split_cached, invoices)
+
+		async def send_chunk(indexes: list[int]) -> None:
+			chunk = [invoices[index] for index in indexes]
+			access_token, tenant_id = await self._access_token()
+			batch_key = batch_idempotency_key(chunk)
+			resp = await self._post(
+				f"{self.api_base}/Invoices",
+				idempotent=bool(batch_key),
+				params={"summarizeErrors": "false"},
+				headers=api_headers(access_token, tenant_id, batch_key),
+				json={"Invoices": [invoice_payload(**_payload_args(item), account_code=self.sales_account_code) for item in chunk]},
+			)
+			chunk_results, created = batch_results(chunk, resp.json())
+			for index, result in zip(indexes, chunk_results):
+				results[index] = result
+			await asyncio.to_thread(idempotency.store_many, "xero", "create_invoice", created)
+
+		await asyncio.gather(*(
+			send_chunk(to_send[start:start + self.batch_size])
+			for start in range(0, len(to_send), self.batch_size)
+		))
+		return results
\ No newline at end of file
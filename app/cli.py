@@ -0,0 +1,72 @@
+import click
+from flask import Flask
+
+
+def register_commands(app: Flask) -> None:
+	@app.cli.command("check-query-plans")
+	def check_query_plans_command():
+		"""Fail if any hot query regresses to a full table scan."""
+		from .migrations import check_query_plans
+
+		regressions = 0
+		for result in check_query_plans():
+			marker = "SCAN" if result["full_scan"] else "ok"
+			click.echo(f"[{marker}] {result['query']}")
+			for line in result["plan"]:
+				click.echo(f"    {line}")
+			if result["full_scan"]:
+				regressions += 1
+		if regressions:
+			raise click.ClickException(f"{regressions} hot query(ies) use a full table scan")
+
+	@app.cli.command("scheduler")
+	def scheduler_command():
+		"""Run the scheduled jobs in the foreground (use with SCHEDULER_MODE=external)."""
+		from apscheduler.schedulers.blocking import BlockingScheduler
+		from . import stop_embedded_scheduler
+		from .scheduler import start_scheduler
+
+		# Loading the app may have started the embedded scheduler in this process
+		stop_embedded_scheduler()
+		click.echo("Starting scheduler (Ctrl+C to stop)")
+		try:
+			start_scheduler(app, BlockingScheduler(timezone="UTC"))
+		except (KeyboardInterrupt, SystemExit):
+			pass
+
+	@app.cli.command("replay-webhooks")
+	@click.option("--since", type=click.DateTime(), help="Only events received at or after this UTC time.")
+	@click.option("--until", type=click.DateTime(), help="Only events received at or before this UTC time.")
+	@click.option("--batch-size", default=5000, show_default=True, help="Events applied per transaction.")
+	@click.option("--log-dir", type=click.Path(file_okay=False), help="Defaults to WEBHOOK_LOG_DIR.")
+	@click.option("--force", is_flag=True, help="Apply events even where the payment state machine would drop them.")
+	def replay_webhooks_command(since, until, batch_size, log_dir, force):
+		"""Rebuild payment state by re-applying logged PayAdvantage webhook events."""
+		from datetime import timezone
+		from pathlib import Path
+		from .event_log import log_dir as default_log_dir, replay
+
+		directory = Path(log_dir) if log_dir else default_log_dir()
+		if directory is None or not directory.is_dir():
+			raise click.ClickException(f"No webhook log directory at {directory}")
+		last_report = [0.0]
+
+		def progress(counts, elapsed):
+			if elapsed - last_report[0] >= 5:
+				last_report[0] = elapsed
+				click.echo(f"  {counts['read']} events read, {counts['read'] / elapsed:.0f}/s")
+
+		counts = replay(
+			directory,
+			since=since.replace(tzinfo=timezone.utc).timestamp() if since else None,
+			until=until.replace(tzinfo=timezone.utc).timestamp() if until else None,
+			batch_size=batch_size,
+			force=force,
+			progress=progress,
+		)
+		rate = counts["read"] / counts["seconds"] if counts["seconds"] else 0
+		click.echo(
+			f"Replayed {counts['read']} events in {counts['seconds']:.1f}s ({rate:.0f}/s): "
+			f"{counts['applied']} applied, {counts['skipped']} skipped, {counts['invalid']} invalid "
+			f"({counts['segments']} segments read, {counts['segments_skipped']} outside the window)"
+		)
\ No newline at end of file
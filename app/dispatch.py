@@ -0,0 +1,163 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import copy_context
+from typing import Awaitable, Callable, Iterable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class TokenBucket:
+	# Allows `rate_per_minute` calls per minute on average, with bursts of up to
+	# `capacity`; acquire() blocks until a token is available
+	def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+		self.rate = rate_per_minute / 60.0
+		self.capacity = capacity if capacity is not None else max(rate_per_minute / 60.0, 1.0)
+		self.tokens = self.capacity
+		self.updated = time.monotonic()
+		self._lock = threading.Lock()
+
+	def _refill(self, now: float) -> None:
+		self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	def acquire(self) -> None:
+		while True:
+			with self._lock:
+				self._refill(time.monotonic())
+				if self.tokens >= 1:
+					self.tokens -= 1
+					return
+				wait = (1 - self.tokens) / self.rate
+			time.sleep(wait)
+
+
+class AsyncTokenBucket(TokenBucket):
+	# Same bucket for coroutines on one event loop: waits without blocking the loop
+	async def acquire_async(self) -> None:
+		while True:
+			with self._lock:
+				self._refill(time.monotonic())
+				if self.tokens >= 1:
+					self.tokens -= 1
+					return
+				wait = (1 - self.tokens) / self.rate
+			await asyncio.sleep(wait)
+
+
+class AsyncThrottle:
+	# Per-event-loop counterpart of ProviderThrottle for the async clients
+	def __init__(self, calls_per_minute: float, max_concurrent: int):
+		self.bucket = AsyncTokenBucket(calls_per_minute)
+		self.concurrency = asyncio.Semaphore(max_concurrent)
+
+	@asynccontextmanager
+	async def slot(self):
+		async with self.concurrency:
+			await self.bucket.acquire_async()
+			yield
+
+
+class ProviderThrottle:
+	def __init__(self, calls_per_minute: float, max_concurrent: int):
+		self.bucket = TokenBucket(calls_per_minute)
+		self.concurrency = threading.BoundedSemaphore(max_concurrent)
+
+	@contextmanager
+	def slot(self):
+		with self.concurrency:
+			self.bucket.acquire()
+			yield
+
+
+# Process-wide so every client and dispatch worker shares the provider's limits
+_throttles: dict[str, ProviderThrottle] = {}
+_throttles_lock = threading.Lock()
+
+# Xero: 60 calls per minute and 5 concurrent calls per tenant
+_DEFAULT_LIMITS = {"xero": (60, 5), "payadvantage": (600, 10)}
+
+
+def _limits(provider: str) -> tuple[float, int]:
+	per_minute, concurrent = _DEFAULT_LIMITS.get(provider, (60, 5))
+	return (
+		float(os.getenv(f"{provider.upper()}_CALLS_PER_MINUTE", per_minute)),
+		int(os.getenv(f"{provider.upper()}_MAX_CONCURRENT_CALLS", concurrent)),
+	)
+
+
+def async_throttle(provider: str) -> AsyncThrottle:
+	# A new throttle per async client; asyncio primitives belong to one loop
+	return AsyncThrottle(*_limits(provider))
+
+
+def get_throttle(provider: str) -> ProviderThrottle:
+	throttle = _throttles.get(provider)
+	if throttle is not None:
+		return throttle
+	with _throttles_lock:
+		throttle = _throttles.get(provider)
+		if throttle is None:
+			throttle = ProviderThrottle(*_limits(provider))
+			_throttles[provider] = throttle
+	return throttle
+
+
+def _ordered(items: Iterable[T], submit: Callable[[T], Future], window: int) -> Iterator[tuple[T, R]]:
+	in_flight = deque()
+	for item in items:
+		in_flight.append((item, submit(item)))
+		if len(in_flight) >= window:
+			done_item, future = in_flight.popleft()
+			yield done_item, future.result()
+	while in_flight:
+		done_item, future = in_flight.popleft()
+		yield done_item, future.result()
+
+
+def run_ordered(items: Iterable[T], func: Callable[[T], R], workers: int) -> Iterator[tuple[T, R]]:
+	# Runs func over items on a bounded thread pool and yields (item, result)
+	# in input order. At most 2 * workers items are in flight, so a lazy
+	# `items` iterator is consumed at the pace results are handled. Each task
+	# runs in a copy of the caller's context (job run stats etc.).
+	with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dispatch") as executor:
+		yield from _ordered(items, lambda item: executor.submit(copy_context().run, func, item), workers * 2)
+
+
+async def _shutdown(loop, finalize) -> None:
+	# Cancels calls still in flight if the consumer stopped early
+	tasks = [task for task in asyncio.all_tasks(loop) if task is not asyncio.current_task()]
+	for task in tasks:
+		task.cancel()
+	await asyncio.gather(*tasks, return_exceptions=True)
+	if finalize is not None:
+		await finalize()
+	await loop.shutdown_default_executor()
+
+
+def run_ordered_async(
+	items: Iterable[T],
+	func: Callable[[T], Awaitable[R]],
+	concurrency: int,
+	finalize: Optional[Callable[[], Awaitable[None]]] = None,
+) -> Iterator[tuple[T, R]]:
+	# run_ordered for coroutine functions: an event loop on a helper thread
+	# keeps up to `concurrency` calls in flight while the caller's thread
+	# consumes results in order. The loop runs in a copy of the caller's
+	# context, so tasks see the same app context and job run stats.
+	# finalize (e.g. closing an async client) runs on the loop before it stops.
+	loop = asyncio.new_event_loop()
+	thread = threading.Thread(target=copy_context().run, args=(loop.run_forever,), name="dispatch-loop", daemon=True)
+	thread.start()
+	try:
+		yield from _ordered(items, lambda item: asyncio.run_coroutine_threadsafe(func(item), loop), concurrency)
+	finally:
+		asyncio.run_coroutine_threadsafe(_shutdown(loop, finalize), loop).result()
+		loop.call_soon_threadsafe(loop.stop)
+		thread.join()
+		loop.close()
\ No newline at end of file
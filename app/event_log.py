@@ -0,0 +1,253 @@
+import os
+import json
+import atexit
+import gzip
+import time
+import heapq
+import logging
+import threading
+from datetime import datetime, timezone
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+from . import db
+from .payment_events import apply_events_bulk, parse_event
+
+logger = logging.getLogger(__name__)
+
+# Append-only log of every accepted webhook body, for rebuilding payment state
+# after a restore. Each process writes its own gzip segments
+# (<provider>-<start>-<pid>.ndjson.gz, one {"ts", "provider", "body"} record
+# per line) and rotates them by size and age, so writers never interleave.
+# A closed segment is renamed to <provider>-<start>-<pid>.<end>.ndjson.gz,
+# <end> being its last record's ts, so windowed replays can skip it unread.
+
+_SUFFIX = ".ndjson.gz"
+_STAMP = "%Y%m%dT%H%M%S%fZ"
+
+
+def _format_stamp(ts: float) -> str:
+	return datetime.fromtimestamp(ts, timezone.utc).strftime(_STAMP)
+
+
+def _parse_stamp(stamp: str) -> float:
+	return datetime.strptime(stamp, _STAMP).replace(tzinfo=timezone.utc).timestamp()
+
+
+def log_dir() -> Optional[Path]:
+	if os.getenv("WEBHOOK_LOG_ENABLED", "1") != "1":
+		return None
+	configured = os.getenv("WEBHOOK_LOG_DIR")
+	return Path(configured) if configured else Path(__file__).resolve().parent.parent / "webhook_log"
+
+
+class SegmentWriter:
+	def __init__(self, directory: Path, provider: str, max_bytes: int, max_age: float):
+		self.directory = directory
+		self.provider = provider
+		self.max_bytes = max_bytes
+		self.max_age = max_age
+		self._file = None
+		self._path = None
+		self._pid = None
+		self._opened_at = 0.0
+		self._last_ts = 0.0
+		self._written = 0
+		self._lock = threading.Lock()
+
+	def _finish(self) -> None:
+		# A forked worker leaves its parent's segment alone
+		if self._file is None or self._pid != os.getpid():
+			return
+		self._file.close()
+		stem = self._path.name[: -len(_SUFFIX)]
+		try:
+			self._path.rename(self._path.with_name(f"{stem}.{_format_stamp(self._last_ts)}{_SUFFIX}"))
+		except FileNotFoundError:
+			# The log directory was removed under us; nothing left to mark
+			logger.warning("Webhook log segment %s disappeared before it was closed", self._path.name)
+
+	def _rotate(self, now: float) -> None:
+		self._finish()
+		self.directory.mkdir(parents=True, exist_ok=True)
+		self._pid = os.getpid()
+		self._path = self.directory / f"{self.provider}-{_format_stamp(now)}-{self._pid}{_SUFFIX}"
+		self._file = gzip.open(self._path, "ab")
+		self._opened_at = now
+		self._written = 0
+
+	def append(self, bodies: Iterable[str]) -> None:
+		with self._lock:
+			now = time.time()
+			# A forked worker must not write through its parent's file object
+			if (
+				self._file is None
+				or self._pid != os.getpid()
+				or self._written >= self.max_bytes
+				or now - self._opened_at >= self.max_age
+			):
+				self._rotate(now)
+			data = "".join(
+				json.dumps({"ts": now, "provider": self.provider, "body": body}) + "\n" for body in bodies
+			).encode()
+			self._file.write(data)
+			# Sync flush: everything written so far survives a crash, and a
+			# truncated segment still decompresses up to the last record
+			self._file.flush()
+			self._written += len(data)
+			self._last_ts = now
+
+	def close(self) -> None:
+		with self._lock:
+			self._finish()
+			self._file = None
+
+
+_writers: dict[str, SegmentWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def append(provider: str, bodies: Iterable[str]) -> None:
+	directory = log_dir()
+	if directory is None:
+		return
+	writer = _writers.get(provider)
+	if writer is None:
+		with _writers_lock:
+			writer = _writers.get(provider)
+			if writer is None:
+				writer = SegmentWriter(
+					directory,
+					provider,
+					max_bytes=int(os.getenv("WEBHOOK_LOG_SEGMENT_BYTES", str(64 * 1024 * 1024))),
+					max_age=float(os.getenv("WEBHOOK_LOG_SEGMENT_SECONDS", "3600")),
+				)
+				_writers[provider] = writer
+	writer.append(bodies)
+
+
+@atexit.register
+def close_all() -> None:
+	# Closed segments carry their end ts in the name
+	for writer in list(_writers.values()):
+		writer.close()
+
+
+def _segment_start(path: Path) -> float:
+	return _parse_stamp(path.name[: -len(_SUFFIX)].split("-")[-2])
+
+
+def _segment_writer(path: Path) -> tuple[str, Optional[float]]:
+	# The writer's pid, and the segment's last ts if it was closed cleanly
+	pid, _, end = path.name[: -len(_SUFFIX)].split("-")[-1].partition(".")
+	return pid, _parse_stamp(end) if end else None
+
+
+def segment_ends(starts: list[tuple[float, Path]]) -> dict[Path, Optional[float]]:
+	# Latest possible ts per segment: the one in its name, else (a writer that
+	# crashed) the start of the same pid's next segment, which was opened after
+	# its last record. None when neither is known.
+	ends = {}
+	following: dict[str, float] = {}
+	for start, path in reversed(starts):
+		pid, end = _segment_writer(path)
+		ends[path] = end if end is not None else following.get(pid)
+		following[pid] = start
+	return ends
+
+
+def segments(directory: Path, provider: str) -> list[tuple[float, Path]]:
+	found = [(_segment_start(path), path) for path in directory.glob(f"{provider}-*{_SUFFIX}")]
+	return sorted(found)
+
+
+def read_segment(path: Path) -> Iterator[dict]:
+	with gzip.open(path, "rt") as lines:
+		try:
+			for line in lines:
+				if line.endswith("\n"):
+					yield json.loads(line)
+		except (EOFError, gzip.BadGzipFile, json.JSONDecodeError):
+			# The tail of a segment whose writer crashed; records before it are intact
+			logger.warning("Stopped reading truncated webhook log segment %s", path.name)
+
+
+def merged(starts: list[tuple[float, Path]]) -> Iterator[dict]:
+	# Merges per-process segments into one stream ordered by ts. Each segment
+	# is ordered and starts no earlier than its name says, so a segment is only
+	# opened once the merge reaches its start: open files stay bounded by the
+	# number of writers, not the length of the history.
+	heap = []
+	pending = iter(starts)
+	upcoming = next(pending, None)
+	counter = 0
+	while heap or upcoming:
+		while upcoming and (not heap or upcoming[0] <= heap[0][0]):
+			records = read_segment(upcoming[1])
+			first = next(records, None)
+			if first is not None:
+				heapq.heappush(heap, (first["ts"], counter, first, records))
+				counter += 1
+			upcoming = next(pending, None)
+		ts, order, record, records = heapq.heappop(heap)
+		yield record
+		following = next(records, None)
+		if following is not None:
+			heapq.heappush(heap, (following["ts"], order, following, records))
+
+
+def _batches(items: Iterator, size: int) -> Iterator[list]:
+	while True:
+		batch = list(islice(items, size))
+		if not batch:
+			return
+		yield batch
+
+
+def replay(
+	directory: Path,
+	provider: str = "payadvantage",
+	since: Optional[float] = None,
+	until: Optional[float] = None,
+	batch_size: int = 5000,
+	force: bool = False,
+	progress=None,
+) -> dict:
+	# Applies logged events in ts order, one transaction per batch. Bypasses the
+	# inbox and dedup; the payment state machine still drops stale events
+	# unless force is set. Segments wholly outside [since, until] are not
+	# opened, and "read" counts only the events inside the window.
+	counts = {"read": 0, "invalid": 0, "applied": 0, "skipped": 0, "segments": 0, "segments_skipped": 0}
+	started = time.monotonic()
+	starts = segments(directory, provider)
+	ends = segment_ends(starts)
+	selected = [
+		(start, path) for start, path in starts
+		if (until is None or start <= until) and (since is None or ends[path] is None or ends[path] >= since)
+	]
+	counts["segments"] = len(selected)
+	counts["segments_skipped"] = len(starts) - len(selected)
+
+	def in_window(records):
+		for record in records:
+			if (since is None or record["ts"] >= since) and (until is None or record["ts"] <= until):
+				counts["read"] += 1
+				yield record["body"]
+
+	def parsed(bodies):
+		for body in bodies:
+			try:
+				yield parse_event(body)
+			except ValueError:
+				counts["invalid"] += 1
+
+	for batch in _batches(parsed(in_window(merged(selected))), batch_size):
+		outcomes = apply_events_bulk(batch, force=force)
+		db.session.commit()
+		applied = sum(1 for outcome in outcomes if outcome == "applied")
+		counts["applied"] += applied
+		counts["skipped"] += len(outcomes) - applied
+		if progress:
+			progress(counts, time.monotonic() - started)
+	counts["seconds"] = round(time.monotonic() - started, 3)
+	return counts
\ No newline at end of file
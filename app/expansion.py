@@ -0,0 +1,156 @@
+import os
+import logging
+from calendar import monthrange
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional
+from sqlalchemy import bindparam, insert, select, update
+from . import db, rollups
+from .models import Booking, Payment, PaymentSchedule
+
+logger = logging.getLogger(__name__)
+
+FREQUENCY_DAYS = {"weekly": 7, "fortnightly": 14}
+
+
+def _add_months(anchor: date, months: int) -> date:
+	# Keeps the anchor's day of month, clamped to shorter months (31 Jan -> 28 Feb -> 31 Mar)
+	years, month_index = divmod(anchor.month - 1 + months, 12)
+	year = anchor.year + years
+	month = month_index + 1
+	return date(year, month, min(anchor.day, monthrange(year, month)[1]))
+
+
+def _nth_debit(frequency: str, anchor: date, n: int) -> date:
+	if frequency == "monthly":
+		return _add_months(anchor, n)
+	return anchor + timedelta(days=FREQUENCY_DAYS[frequency] * n)
+
+
+def _first_index_on_or_after(frequency: str, anchor: date, day: date) -> int:
+	if day <= anchor:
+		return 0
+	if frequency == "monthly":
+		n = (day.year - anchor.year) * 12 + day.month - anchor.month
+		return n if _add_months(anchor, n) >= day else n + 1
+	step = FREQUENCY_DAYS[frequency]
+	return -(-(day - anchor).days // step)
+
+
+def debit_dates(frequency: str, anchor: date, start: date, until: date) -> tuple[list[date], date]:
+	# Debit dates of the schedule anchored at `anchor` within [start, until],
+	# plus the first date after `until` (the next one still to materialize)
+	n = _first_index_on_or_after(frequency, anchor, start)
+	dates = []
+	debit = _nth_debit(frequency, anchor, n)
+	while debit <= until:
+		dates.append(debit)
+		n += 1
+		debit = _nth_debit(frequency, anchor, n)
+	return dates, debit
+
+
+def expand_schedules(
+	today: Optional[date] = None,
+	horizon_days: Optional[int] = None,
+	schedule_ids: Optional[Iterable[int]] = None,
+	batch_size: Optional[int] = None,
+) -> int:
+	# Materializes pending Payment rows for every active schedule up to
+	# today + horizon. PaymentSchedule.next_debit_date is the cursor: the first
+	# debit not yet materialized. Rows and the cursor advance commit together,
+	# so reruns never duplicate payments.
+	today = today or date.today()
+	horizon_days = horizon_days if horizon_days is not None else int(os.getenv("SCHEDULE_HORIZON_DAYS", "35"))
+	batch_size = batch_size or int(os.getenv("SCHEDULE_EXPANSION_BATCH_SIZE", "500"))
+	horizon_end = today + timedelta(days=horizon_days)
+
+	query = (
+		select(
+			PaymentSchedule.id,
+			PaymentSchedule.booking_id,
+			PaymentSchedule.recurring_amount_cents,
+			PaymentSchedule.frequency,
+			PaymentSchedule.next_debit_date,
+			PaymentSchedule.recurring_start_date,
+			Booking.end_date,
+		)
+		.join(Booking, Booking.id == PaymentSchedule.booking_id)
+		.where(
+			PaymentSchedule.status == "active",
+			Booking.status == "active",
+			PaymentSchedule.next_debit_date.isnot(None),
+			PaymentSchedule.next_debit_date <= horizon_end,
+			PaymentSchedule.next_debit_date <= Booking.end_date,
+		)
+		.order_by(PaymentSchedule.id.asc())
+		.limit(batch_size)
+	)
+	if schedule_ids is not None:
+		query = query.where(PaymentSchedule.id.in_(list(schedule_ids)))
+
+	advance = (
+		update(PaymentSchedule.__table__)
+		.where(
+			PaymentSchedule.__table__.c.id == bindparam("schedule_id"),
+			# Guards against another run having advanced the cursor meanwhile
+			PaymentSchedule.__table__.c.next_debit_date == bindparam("seen_next_debit_date"),
+		)
+		.values(next_debit_date=bindparam("new_next_debit_date"))
+	)
+
+	created = 0
+	last_id = 0
+	while True:
+		schedules = db.session.execute(query.where(PaymentSchedule.id > last_id)).all()
+		if not schedules:
+			break
+		last_id = schedules[-1].id
+		now = datetime.utcnow()
+		rows = []
+		cursors = []
+		for schedule in schedules:
+			if schedule.frequency not in FREQUENCY_DAYS and schedule.frequency != "monthly":
+				logger.warning("Schedule %s has unknown frequency %r", schedule.id, schedule.frequency)
+				continue
+			anchor = schedule.recurring_start_date or schedule.next_debit_date
+			# A cursor left in the past (a back-dated start, an upgraded database)
+			# skips the missed debits rather than creating already-overdue rows
+			dates, next_debit = debit_dates(
+				schedule.frequency,
+				anchor,
+				max(schedule.next_debit_date, today),
+				min(horizon_end, schedule.end_date),
+			)
+			rows.extend(
+				{
+					"booking_id": schedule.booking_id,
+					"scheduled_date": debit,
+					"scheduled_amount_cents": schedule.recurring_amount_cents,
+					"status": "pending",
+					"created_at": now,
+				}
+				for debit in dates
+			)
+			cursors.append({
+				"schedule_id": schedule.id,
+				"seen_next_debit_date": schedule.next_debit_date,
+				"new_next_debit_date": next_debit,
+			})
+		if cursors:
+			result = db.session.connection().execute(advance, cursors)
+			if result.rowcount != len(cursors):
+				# Some cursor moved under us; retry this chunk on the next run
+				db.session.rollback()
+				logger.warning("Schedule cursors changed concurrently; skipped %s schedules", len(cursors))
+				if len(schedules) < batch_size:
+					break
+				continue
+		if rows:
+			db.session.execute(insert(Payment), rows)
+			rollups.record_inserts(db.session.connection(), rows)
+		db.session.commit()
+		created += len(rows)
+		if len(schedules) < batch_size:
+			break
+	logger.info("Materialized %s scheduled payments through %s", created, horizon_end.isoformat())
+	return created
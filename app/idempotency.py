@@ -0,0 +1,54 @@
+import json
+import hashlib
+from typing import Iterable, Optional
+from sqlalchemy import select
+from . import db
+from .models import IdempotencyRecord
+from .upserts import insert_ignore
+
+# Results of provider create calls, keyed by a deterministic idempotency key.
+# The key is also sent to the provider, so a repeat that slips past the local
+# record (e.g. a crash before it was stored) is still deduplicated remotely.
+# Records are written on their own engine transaction straight after the
+# provider answers, so they survive a rollback of the caller's session.
+
+HEADER = "Idempotency-Key"
+
+
+def make_key(operation: str, *parts) -> str:
+	digest = hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest()[:40]
+	return f"{operation}:{digest}"
+
+
+def invoice_key(payment_id: int) -> str:
+	# One invoice per payment, whichever path (outbox or scheduler) creates it
+	return make_key("xero-invoice", "payment", payment_id)
+
+
+def lookup(key: str) -> Optional[dict]:
+	return lookup_many([key]).get(key)
+
+
+def lookup_many(keys: Iterable[str]) -> dict[str, dict]:
+	keys = list(keys)
+	if not keys:
+		return {}
+	table = IdempotencyRecord.__table__
+	with db.engine.connect() as conn:
+		rows = conn.execute(select(table.c.key, table.c.result).where(table.c.key.in_(keys))).all()
+	return {key: json.loads(result) for key, result in rows}
+
+
+def store_many(provider: str, operation: str, results: dict[str, dict]) -> None:
+	if not results:
+		return
+	rows = [
+		{"key": key, "provider": provider, "operation": operation, "result": json.dumps(result)}
+		for key, result in results.items()
+	]
+	with db.engine.begin() as conn:
+		insert_ignore(conn, IdempotencyRecord.__table__, rows, ["key"])
+
+
+def store(provider: str, operation: str, key: str, result: dict) -> None:
+	store_many(provider, operation, {key: result})
\ No newline at end of file
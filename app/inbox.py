@@ -0,0 +1,133 @@
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+from sqlalchemy import delete, select, update
+from . import db
+from .models import WebhookEvent
+from .payment_events import apply_events, parse_event
+from .upserts import insert_ignore
+
+logger = logging.getLogger(__name__)
+
+
+def append(provider: str, event_id: str, body: str) -> Optional[int]:
+	# Inserts in the caller's transaction and returns the new row id, or None
+	# when (provider, event_id) is already in the inbox
+	return insert_ignore(
+		db.session.connection(),
+		WebhookEvent.__table__,
+		{"provider": provider, "event_id": event_id, "body": body},
+		["provider", "event_id"],
+	)
+
+
+def existing_event_ids(provider: str, event_ids: Iterable[str], chunk_size: int = 5000) -> set[str]:
+	# Which of event_ids the inbox has already seen, via the unique (provider, event_id) index
+	event_ids = list(event_ids)
+	found = set()
+	for start in range(0, len(event_ids), chunk_size):
+		found.update(db.session.execute(
+			select(WebhookEvent.event_id).where(
+				WebhookEvent.provider == provider,
+				WebhookEvent.event_id.in_(event_ids[start:start + chunk_size]),
+			)
+		).scalars())
+	return found
+
+
+def record_processed(provider: str, events: list[tuple[str, str, str]]) -> None:
+	# Stores events applied outside the inbox as already processed rows, in the
+	# caller's transaction, so later deliveries are deduplicated against them.
+	# events: (event_id, body, outcome)
+	if not events:
+		return
+	now = datetime.utcnow()
+	rows = []
+	for event_id, body, outcome in events:
+		status, error = _status_for(outcome)
+		rows.append({
+			"provider": provider,
+			"event_id": event_id,
+			"body": body,
+			"status": status,
+			"error": error,
+			"received_at": now,
+			"processed_at": now,
+		})
+	insert_ignore(db.session.connection(), WebhookEvent.__table__, rows, ["provider", "event_id"])
+
+
+def evict_processed(ttl: Optional[timedelta] = None, batch_size: int = 5000) -> int:
+	# Processed events back the dedup check only until they age out; after
+	# that the payment state machine rejects any stale redelivery
+	ttl = ttl or timedelta(days=int(os.getenv("WEBHOOK_DEDUP_TTL_DAYS", "7")))
+	cutoff = datetime.utcnow() - ttl
+	total = 0
+	while True:
+		ids = db.session.execute(
+			select(WebhookEvent.id)
+			.where(WebhookEvent.received_at < cutoff, WebhookEvent.status != "pending")
+			.limit(batch_size)
+		).scalars().all()
+		if not ids:
+			break
+		db.session.execute(delete(WebhookEvent).where(WebhookEvent.id.in_(ids)))
+		db.session.commit()
+		total += len(ids)
+		if len(ids) < batch_size:
+			break
+	return total
+
+
+def drain_inbox(batch_size: Optional[int] = None) -> dict:
+	# Applies pending events in arrival order, one transaction per batch: the
+	# payment updates and the events' own statuses commit together, so a crash
+	# mid-batch leaves the whole batch pending for the next run
+	batch_size = batch_size or int(os.getenv("WEBHOOK_BATCH_SIZE", "500"))
+	counts = {"applied": 0, "skipped": 0, "ignored": 0}
+	while True:
+		rows = db.session.execute(
+			select(WebhookEvent.id, WebhookEvent.body)
+			.where(WebhookEvent.status == "pending")
+			.order_by(WebhookEvent.id.asc())
+			.limit(batch_size)
+		).all()
+		if not rows:
+			break
+		outcomes: dict[int, tuple[str, Optional[str]]] = {}
+		parsed = []
+		for event_id, body in rows:
+			try:
+				parsed.append((event_id, parse_event(body)))
+			except ValueError as exc:
+				outcomes[event_id] = ("ignored", str(exc))
+		results = apply_events([event for _, event in parsed])
+		for (event_id, _), result in zip(parsed, results):
+			outcomes[event_id] = _status_for(result)
+
+		now = datetime.utcnow()
+		db.session.execute(
+			update(WebhookEvent),
+			[
+				{"id": event_id, "status": status, "error": error, "processed_at": now}
+				for event_id, (status, error) in outcomes.items()
+			],
+		)
+		db.session.commit()
+		for event_id, (status, error) in outcomes.items():
+			counts[status] += 1
+			if status == "ignored":
+				logger.warning("Ignored webhook event %s: %s", event_id, error)
+		if len(rows) < batch_size:
+			break
+	return counts
+
+
+def _status_for(outcome: str) -> tuple[str, Optional[str]]:
+	if outcome == "applied":
+		return "applied", None
+	# Redeliveries and reordered deliveries the payment already reflects
+	if outcome in ("no change", "out of order"):
+		return "skipped", outcome
+	return "ignored", outcome
\ No newline at end of file
@@ -0,0 +1,111 @@
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import delete, select, update
+from . import db
+from .leader import owner_id
+from .models import JobRun
+
+
+class RunStats:
+	def __init__(self):
+		self.rows_processed = 0
+		self.api_calls = 0
+		self.error_count = 0
+		# Dispatch workers update the same stats from several threads
+		self._lock = threading.Lock()
+
+	def set_result(self, result) -> None:
+		self.rows_processed = _rows_from(result)
+
+	def add(self, api_calls: int = 0, errors: int = 0) -> None:
+		with self._lock:
+			self.api_calls += api_calls
+			self.error_count += errors
+
+
+_current: ContextVar[Optional[RunStats]] = ContextVar("job_run_stats", default=None)
+
+
+def current_stats() -> Optional[RunStats]:
+	return _current.get()
+
+
+def note_api_call() -> None:
+	stats = _current.get()
+	if stats is not None:
+		stats.add(api_calls=1)
+
+
+def note_errors(count: int = 1) -> None:
+	stats = _current.get()
+	if stats is not None and count:
+		stats.add(errors=count)
+
+
+def _rows_from(result) -> int:
+	# Jobs return a row count, a dict of counts, or a flag
+	if isinstance(result, dict):
+		return sum(value for value in result.values() if isinstance(value, int))
+	if isinstance(result, (bool, int)):
+		return int(result)
+	return 0
+
+
+@contextmanager
+def track_run(job_id: str):
+	# Records a job_runs row for the duration of the block; the block reports
+	# its result through stats.set_result(). Requires an app context.
+	stats = RunStats()
+	token = _current.set(stats)
+	table = JobRun.__table__
+	started_at = datetime.utcnow()
+	with db.engine.begin() as conn:
+		run_id = conn.execute(
+			table.insert().values(job_id=job_id, owner=owner_id(), started_at=started_at, status="running")
+		).inserted_primary_key[0]
+	error = None
+	try:
+		yield stats
+	except Exception as exc:
+		error = exc
+		stats.add(errors=1)
+		raise
+	finally:
+		_current.reset(token)
+		finished_at = datetime.utcnow()
+		with db.engine.begin() as conn:
+			conn.execute(
+				update(table)
+				.where(table.c.id == run_id)
+				.values(
+					finished_at=finished_at,
+					duration_ms=int((finished_at - started_at).total_seconds() * 1000),
+					status="error" if error else "success",
+					rows_processed=stats.rows_processed,
+					api_calls=stats.api_calls,
+					error_count=stats.error_count,
+					error=str(error)[:2000] if error else None,
+				)
+			)
+
+
+def prune(ttl: Optional[timedelta] = None, batch_size: int = 5000) -> int:
+	# The polling jobs add a row every few seconds; keep only recent history
+	ttl = ttl or timedelta(days=int(os.getenv("JOB_RUNS_RETENTION_DAYS", "14")))
+	cutoff = datetime.utcnow() - ttl
+	table = JobRun.__table__
+	total = 0
+	while True:
+		with db.engine.begin() as conn:
+			ids = conn.execute(
+				select(table.c.id).where(table.c.started_at < cutoff).limit(batch_size)
+			).scalars().all()
+			if ids:
+				conn.execute(delete(table).where(table.c.id.in_(ids)))
+		total += len(ids)
+		if len(ids) < batch_size:
+			return total
\ No newline at end of file
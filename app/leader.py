@@ -0,0 +1,62 @@
+import os
+import socket
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import update
+from sqlalchemy.exc import OperationalError
+from . import db
+from .models import JobLease
+from .upserts import insert_ignore
+
+logger = logging.getLogger(__name__)
+
+# Lease row per job. A process may run a job only if it flips the row with a
+# conditional UPDATE: no live lease held by anyone else, and the previous run
+# started at least `min_gap` ago. Both SQLite (database write lock) and
+# Postgres (row lock) apply that UPDATE atomically, so exactly one process
+# wins each tick across gunicorn workers and hosts.
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def owner_id() -> str:
+	# Evaluated per call: gunicorn forks workers after import
+	return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _ensure_row(conn, name: str) -> None:
+	insert_ignore(conn, JobLease.__table__, {"name": name, "last_started_at": _EPOCH, "expires_at": _EPOCH}, ["name"])
+
+
+def try_acquire(name: str, min_gap: timedelta, ttl: Optional[timedelta] = None) -> bool:
+	ttl = ttl or timedelta(seconds=int(os.getenv("SCHEDULER_LEASE_SECONDS", "3600")))
+	table = JobLease.__table__
+	now = datetime.utcnow()
+	try:
+		with db.engine.begin() as conn:
+			_ensure_row(conn, name)
+			result = conn.execute(
+				update(table)
+				.where(
+					table.c.name == name,
+					table.c.expires_at <= now,
+					table.c.last_started_at <= now - min_gap,
+				)
+				.values(owner=owner_id(), last_started_at=now, expires_at=now + ttl)
+			)
+			return result.rowcount == 1
+	except OperationalError as exc:
+		# e.g. SQLite busy: another process is mid-acquire, let it have this tick
+		logger.info("Could not take lease for %s: %s", name, exc)
+		return False
+
+
+def release(name: str) -> None:
+	table = JobLease.__table__
+	with db.engine.begin() as conn:
+		conn.execute(
+			update(table)
+			.where(table.c.name == name, table.c.owner == owner_id())
+			.values(expires_at=datetime.utcnow())
+		)
@@ -0,0 +1,294 @@
+import logging
+from datetime import date, datetime, timedelta
+from typing import Callable
+from sqlalchemy import and_, func, inspect, or_, select, text, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import IntegrityError
+from . import db
+from .expansion import FREQUENCY_DAYS, _first_index_on_or_after, _nth_debit
+from .models import Booking, BookingRollup, IdempotencyRecord, JobCheckpoint, JobLease, JobRun, OutboxMessage, Payment, PaymentRollup, PaymentSchedule, SchemaMigration, WebhookEvent
+from .rollups import reconcile, reconcile_bookings
+from .search import install_search_index
+
+logger = logging.getLogger(__name__)
+
+
+def _create_baseline(conn: Connection) -> None:
+	# Fresh databases get every table (and its indexes) straight from the models;
+	# existing databases only get whatever tables are missing.
+	db.metadata.create_all(conn)
+
+
+def _create_missing_indexes(conn: Connection, *models) -> None:
+	for model in models:
+		for index in model.__table__.indexes:
+			index.create(conn, checkfirst=True)
+
+
+def _check_unique_provider_payment_ids(conn: Connection) -> None:
+	# The unique index would fail part-way through the series on duplicates;
+	# which payment is the real one is for an operator to decide
+	duplicates = conn.execute(
+		select(Payment.provider_payment_id, func.count(Payment.id))
+		.where(Payment.provider_payment_id.isnot(None))
+		.group_by(Payment.provider_payment_id)
+		.having(func.count(Payment.id) > 1)
+		.limit(10)
+	).all()
+	if duplicates:
+		examples = ", ".join(f"{value!r} ({count} rows)" for value, count in duplicates)
+		raise RuntimeError(
+			"Cannot add the unique index on payments.provider_payment_id: these values "
+			f"are shared by several payments: {examples}. Clear or correct the "
+			"duplicates, then restart to finish the migrations."
+		)
+
+
+def _add_hot_query_indexes(conn: Connection) -> None:
+	_check_unique_provider_payment_ids(conn)
+	_create_missing_indexes(conn, Booking, Payment)
+
+
+def _create_tables(conn: Connection, *models) -> None:
+	for model in models:
+		model.__table__.create(conn, checkfirst=True)
+	_create_missing_indexes(conn, *models)
+
+
+def _add_outbox(conn: Connection) -> None:
+	_create_tables(conn, OutboxMessage)
+
+
+def _add_bookings_keyset_index(conn: Connection) -> None:
+	# Replaces ix_bookings_status_created_at with a (status, created_at, id) index
+	conn.execute(text("DROP INDEX IF EXISTS ix_bookings_status_created_at"))
+	_create_missing_indexes(conn, Booking)
+
+
+def _add_booking_search(conn: Connection) -> None:
+	install_search_index(conn)
+
+
+def _add_payment_rollups(conn: Connection) -> None:
+	_create_tables(conn, PaymentRollup)
+	# Seed from existing payments
+	reconcile(conn)
+
+
+def _add_column(conn: Connection, model, column_name: str) -> None:
+	# Fresh databases already have the column from the baseline create_all
+	table = model.__table__
+	existing = {column["name"] for column in inspect(conn).get_columns(table.name)}
+	if column_name in existing:
+		return
+	column = table.c[column_name]
+	column_type = column.type.compile(dialect=conn.dialect)
+	conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column_name} {column_type}"))
+
+
+def _add_schedule_start_date(conn: Connection) -> None:
+	_add_column(conn, PaymentSchedule, "recurring_start_date")
+	# Existing schedules are anchored on their next debit date
+	conn.execute(
+		update(PaymentSchedule.__table__)
+		.where(PaymentSchedule.__table__.c.recurring_start_date.is_(None))
+		.values(recurring_start_date=PaymentSchedule.__table__.c.next_debit_date)
+	)
+	# Before expansion, next_debit_date was never advanced past the payment row
+	# created for it. It is now the first debit not yet materialized, so move it
+	# past each schedule's latest existing recurring payment.
+	schedules = PaymentSchedule.__table__
+	payments = Payment.__table__
+	rows = conn.execute(
+		select(schedules.c.id, schedules.c.frequency, schedules.c.recurring_start_date, func.max(payments.c.scheduled_date))
+		.join(payments, and_(
+			payments.c.booking_id == schedules.c.booking_id,
+			payments.c.scheduled_date >= schedules.c.recurring_start_date,
+		))
+		.where(schedules.c.recurring_start_date.isnot(None))
+		.group_by(schedules.c.id, schedules.c.frequency, schedules.c.recurring_start_date)
+	).all()
+	for schedule_id, frequency, anchor, latest in rows:
+		if frequency not in FREQUENCY_DAYS and frequency != "monthly":
+			continue
+		next_debit = _nth_debit(frequency, anchor, _first_index_on_or_after(frequency, anchor, latest + timedelta(days=1)))
+		conn.execute(update(schedules).where(schedules.c.id == schedule_id).values(next_debit_date=next_debit))
+
+
+def _add_job_checkpoints(conn: Connection) -> None:
+	_create_tables(conn, JobCheckpoint)
+
+
+def _add_job_leases(conn: Connection) -> None:
+	_create_tables(conn, JobLease)
+
+
+def _add_job_runs(conn: Connection) -> None:
+	_create_tables(conn, JobRun)
+
+
+def _add_webhook_inbox(conn: Connection) -> None:
+	_create_tables(conn, WebhookEvent)
+
+
+def _add_webhook_dedup(conn: Connection) -> None:
+	_add_column(conn, WebhookEvent, "event_id")
+	_add_column(conn, Payment, "last_event_sequence")
+	_create_missing_indexes(conn, WebhookEvent)
+
+
+def _add_idempotency_records(conn: Connection) -> None:
+	_create_tables(conn, IdempotencyRecord)
+
+
+def _add_booking_rollups(conn: Connection) -> None:
+	_create_tables(conn, BookingRollup)
+	# Seed from existing bookings
+	reconcile_bookings(conn)
+
+
+# Ordered, append-only. Never edit or reorder an entry once it has shipped.
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = [
+	(1, "baseline schema", _create_baseline),
+	(2, "payments and bookings hot query indexes", _add_hot_query_indexes),
+	(3, "transactional outbox", _add_outbox),
+	(4, "bookings keyset pagination index", _add_bookings_keyset_index),
+	(5, "booking customer search index", _add_booking_search),
+	(6, "payment report rollups", _add_payment_rollups),
+	(7, "payment schedule recurring start date", _add_schedule_start_date),
+	(8, "scheduler job checkpoints", _add_job_checkpoints),
+	(9, "scheduler job leases", _add_job_leases),
+	(10, "scheduler job run history", _add_job_runs),
+	(11, "webhook event inbox", _add_webhook_inbox),
+	(12, "webhook event dedup and sequencing", _add_webhook_dedup),
+	(13, "provider idempotency records", _add_idempotency_records),
+	(14, "booking status rollups", _add_booking_rollups),
+]
+
+
+def run_migrations() -> list[int]:
+	engine = db.engine
+	with engine.begin() as conn:
+		SchemaMigration.__table__.create(conn, checkfirst=True)
+		applied = set(conn.execute(select(SchemaMigration.version)).scalars())
+
+	newly_applied = []
+	for version, name, migrate in MIGRATIONS:
+		if version in applied:
+			continue
+		try:
+			with engine.begin() as conn:
+				migrate(conn)
+				conn.execute(SchemaMigration.__table__.insert().values(version=version, name=name))
+		except IntegrityError:
+			# Only a conflicting schema_migrations row means another process
+			# applied this version concurrently; anything else is a real failure
+			with engine.connect() as conn:
+				recorded = conn.execute(
+					select(SchemaMigration.version).where(SchemaMigration.version == version)
+				).first()
+			if not recorded:
+				raise
+			logger.info("Migration %s already applied by another process", version)
+			continue
+		logger.info("Applied migration %s: %s", version, name)
+		newly_applied.append(version)
+	return newly_applied
+
+
+def _hot_queries() -> list[tuple[str, object]]:
+	today = date.today()
+	return [
+		(
+			"overdue sweep",
+			select(Payment.id).where(Payment.status == "pending", Payment.scheduled_date < today),
+		),
+		(
+			"uninvoiced upcoming payments",
+			select(Payment.id).where(
+				Payment.status == "pending",
+				Payment.scheduled_date == today,
+				Payment.invoice_id.is_(None),
+			),
+		),
+		(
+			"invoice catch-up window",
+			select(Payment.id)
+			.where(
+				# Same shape as a later page of scheduler._uninvoiced_chunks: the
+				# lookback and horizon plus a (scheduled_date, id) keyset cursor
+				Payment.status == "pending",
+				Payment.scheduled_date >= today - timedelta(days=7),
+				Payment.scheduled_date <= today + timedelta(days=2),
+				Payment.invoice_id.is_(None),
+				or_(
+					Payment.scheduled_date > today,
+					and_(Payment.scheduled_date == today, Payment.id > 100),
+				),
+			)
+			.order_by(Payment.scheduled_date.asc(), Payment.id.asc())
+			.limit(50),
+		),
+		(
+			"webhook payment lookup",
+			select(Payment.id).where(Payment.provider_payment_id == "pmt_123"),
+		),
+		(
+			"webhook inbox batch",
+			select(WebhookEvent.id)
+			.where(WebhookEvent.status == "pending")
+			.order_by(WebhookEvent.id.asc())
+			.limit(500),
+		),
+		(
+			"payments for booking",
+			select(Payment.id).where(Payment.booking_id == 1).order_by(Payment.scheduled_date.asc()),
+		),
+		(
+			"active bookings page",
+			select(Booking.id)
+			.where(
+				Booking.status == "active",
+				or_(
+					Booking.created_at < datetime(2030, 1, 1),
+					and_(Booking.created_at == datetime(2030, 1, 1), Booking.id < 100),
+				),
+			)
+			.order_by(Booking.created_at.desc(), Booking.id.desc())
+			.limit(50),
+		),
+	]
+
+
+def _sqlite_plan(conn: Connection, sql: str) -> tuple[list[str], bool]:
+	rows = [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+	# "SCAN payments" is a full table scan; "SCAN payments USING INDEX ..." is an index walk
+	scans = [detail for detail in rows if detail.startswith("SCAN ") and " USING " not in detail]
+	return rows, bool(scans)
+
+
+def _postgres_plan(conn: Connection, sql: str) -> tuple[list[str], bool]:
+	# Small tables always favour a seq scan; disable it so the check reflects index availability
+	conn.execute(text("SET LOCAL enable_seqscan = off"))
+	rows = [row[0] for row in conn.execute(text(f"EXPLAIN {sql}"))]
+	return rows, any("Seq Scan" in line for line in rows)
+
+
+# Runs EXPLAIN over the hot queries and reports any that fall back to a full table scan
+def check_query_plans() -> list[dict]:
+	engine = db.engine
+	dialect = engine.dialect.name
+	if dialect == "sqlite":
+		explain = _sqlite_plan
+	elif dialect == "postgresql":
+		explain = _postgres_plan
+	else:
+		raise RuntimeError(f"Query plan check is not supported for {dialect}")
+
+	results = []
+	for name, stmt in _hot_queries():
+		sql = str(stmt.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+		with engine.begin() as conn:
+			plan, full_scan = explain(conn, sql)
+		results.append({"query": name, "plan": plan, "full_scan": full_scan})
+	return results
@@ -18,6 +18,11 @@ class Booking(db.Model):
 	payment_schedule = db.relationship("PaymentSchedule", backref="booking", uselist=False, cascade="all, delete-orphan")
 	payments = db.relationship("Payment", backref="booking", cascade="all, delete-orphan", order_by="Payment.scheduled_date.asc()")
 
+	__table_args__ = (
+		# Admin list: keyset pagination over active bookings
+		db.Index("ix_bookings_status_created_at_id", "status", "created_at", "id"),
+	)
+
 	def __repr__(self) -> str:
 		return f"<Booking id={self.id} name={self.customer_name}>"
 
@@ -31,6 +36,9 @@ class PaymentSchedule(db.Model):
 	recurring_amount_cents = db.Column(db.Integer, nullable=False, default=0)
 	frequency = db.Column(db.String(20), nullable=False)
 	provider_schedule_id = db.Column(db.String(100), nullable=True)
+	# Anchor for the debit sequence (weekly/fortnightly steps, monthly day of month)
+	recurring_start_date = db.Column(db.Date, nullable=True)
+	# First debit date not yet materialized as a Payment row (see app/expansion.py)
 	next_debit_date = db.Column(db.Date, nullable=True)
 	status = db.Column(db.String(20), nullable=False, default="active")
 	created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
@@ -54,9 +62,34 @@ class Payment(db.Model):
 
 	provider_payment_id = db.Column(db.String(100), nullable=True)
 	invoice_id = db.Column(db.String(100), nullable=True)
+	# Highest provider event sequence applied, to drop reordered webhook deliveries
+	last_event_sequence = db.Column(db.BigInteger, nullable=True)
 
 	created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
+	__table_args__ = (
+		# Scheduler: overdue sweep and invoice selection
+		db.Index("ix_payments_status_scheduled_date", "status", "scheduled_date"),
+		# Partial index covering only payments still waiting for an invoice
+		db.Index(
+			"ix_payments_uninvoiced_status_scheduled_date",
+			"status",
+			"scheduled_date",
+			sqlite_where=db.text("invoice_id IS NULL"),
+			postgresql_where=db.text("invoice_id IS NULL"),
+		),
+		# Webhook lookups
+		db.Index("ix_payments_provider_payment_id", "provider_payment_id", unique=True),
+		db.Index("ix_payments_booking_id_scheduled_date", "booking_id", "scheduled_date"),
+	)
+
+	# Allowed status changes; complete is terminal
+	STATUS_TRANSITIONS = {
+		"pending": {"complete", "overdue"},
+		"overdue": {"complete"},
+		"complete": set(),
+	}
+
 	def __repr__(self) -> str:
 		return f"<Payment id={self.id} booking_id={self.booking_id} status={self.status}>"
 
@@ -75,4 +108,158 @@ class XeroAuth(db.Model):
 	updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 	def __repr__(self) -> str:
-		return f"<XeroAuth tenant_id={self.tenant_id}>"
\ No newline at end of file
+		return f"<XeroAuth tenant_id={self.tenant_id}>"
+
+
+class PaymentRollup(db.Model):
+	__tablename__ = "payment_rollups"
+
+	# Per (status, scheduled day) totals over payments, maintained incrementally
+	# by app/rollups.py and re-verified by the reconciliation job
+	id = db.Column(db.Integer, primary_key=True)
+	status = db.Column(db.String(20), nullable=False)
+	day = db.Column(db.Date, nullable=False)
+	payment_count = db.Column(db.Integer, nullable=False, default=0)
+	scheduled_amount_cents = db.Column(db.BigInteger, nullable=False, default=0)
+	paid_amount_cents = db.Column(db.BigInteger, nullable=False, default=0)
+
+	__table_args__ = (
+		db.Index("ix_payment_rollups_status_day", "status", "day", unique=True),
+	)
+
+	def __repr__(self) -> str:
+		return f"<PaymentRollup status={self.status} day={self.day} count={self.payment_count}>"
+
+
+class BookingRollup(db.Model):
+	__tablename__ = "booking_rollups"
+
+	# Booking count per status, maintained and re-verified alongside the
+	# payment rollups
+	status = db.Column(db.String(20), primary_key=True)
+	booking_count = db.Column(db.Integer, nullable=False, default=0)
+
+	def __repr__(self) -> str:
+		return f"<BookingRollup status={self.status} count={self.booking_count}>"
+
+
+class OutboxMessage(db.Model):
+	__tablename__ = "outbox_messages"
+
+	id = db.Column(db.Integer, primary_key=True)
+	# Handler name, e.g. "payadvantage.create_schedule"
+	kind = db.Column(db.String(50), nullable=False)
+	payload = db.Column(db.Text, nullable=False)  # JSON
+	booking_id = db.Column(db.Integer, db.ForeignKey("bookings.id"), nullable=True)
+	status = db.Column(db.String(20), nullable=False, default="pending")  # pending, processing, done, failed, superseded
+	attempts = db.Column(db.Integer, nullable=False, default=0)
+	# When pending: earliest retry time. When processing: lease expiry for the claiming worker.
+	next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+	last_error = db.Column(db.Text, nullable=True)
+	created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+	processed_at = db.Column(db.DateTime, nullable=True)
+
+	__table_args__ = (
+		db.Index("ix_outbox_messages_status_next_attempt_at", "status", "next_attempt_at"),
+		db.Index("ix_outbox_messages_booking_id", "booking_id"),
+	)
+
+	def __repr__(self) -> str:
+		return f"<OutboxMessage id={self.id} kind={self.kind} status={self.status}>"
+
+
+class JobCheckpoint(db.Model):
+	__tablename__ = "job_checkpoints"
+
+	# High-water marks for scheduler jobs, keyed by job id
+	name = db.Column(db.String(100), primary_key=True)
+	value = db.Column(db.Text, nullable=False)  # JSON
+	updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+	def __repr__(self) -> str:
+		return f"<JobCheckpoint name={self.name}>"
+
+
+class JobLease(db.Model):
+	__tablename__ = "job_leases"
+
+	# One row per scheduler job; see app/leader.py
+	name = db.Column(db.String(100), primary_key=True)
+	owner = db.Column(db.String(200), nullable=True)  # host:pid of the last runner
+	last_started_at = db.Column(db.DateTime, nullable=False)
+	expires_at = db.Column(db.DateTime, nullable=False)
+
+	def __repr__(self) -> str:
+		return f"<JobLease name={self.name} owner={self.owner}>"
+
+
+class JobRun(db.Model):
+	__tablename__ = "job_runs"
+
+	id = db.Column(db.Integer, primary_key=True)
+	job_id = db.Column(db.String(100), nullable=False)
+	owner = db.Column(db.String(200), nullable=True)  # host:pid that ran it
+	started_at = db.Column(db.DateTime, nullable=False)
+	finished_at = db.Column(db.DateTime, nullable=True)
+	duration_ms = db.Column(db.Integer, nullable=True)
+	status = db.Column(db.String(20), nullable=False, default="running")  # running, success, error
+	rows_processed = db.Column(db.Integer, nullable=False, default=0)
+	api_calls = db.Column(db.Integer, nullable=False, default=0)
+	error_count = db.Column(db.Integer, nullable=False, default=0)
+	error = db.Column(db.Text, nullable=True)
+
+	__table_args__ = (
+		db.Index("ix_job_runs_job_id_started_at", "job_id", "started_at"),
+		db.Index("ix_job_runs_started_at", "started_at"),
+	)
+
+	def __repr__(self) -> str:
+		return f"<JobRun id={self.id} job_id={self.job_id} status={self.status}>"
+
+
+class WebhookEvent(db.Model):
+	__tablename__ = "webhook_events"
+
+	id = db.Column(db.Integer, primary_key=True)
+	provider = db.Column(db.String(50), nullable=False)
+	# Provider event id, or a hash of the body when the provider sends none
+	event_id = db.Column(db.String(100), nullable=True)
+	body = db.Column(db.Text, nullable=False)  # raw request body
+	status = db.Column(db.String(20), nullable=False, default="pending")  # pending, applied, skipped, ignored
+	error = db.Column(db.Text, nullable=True)
+	received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+	processed_at = db.Column(db.DateTime, nullable=True)
+
+	__table_args__ = (
+		db.Index("ix_webhook_events_status_id", "status", "id"),
+		db.Index("ix_webhook_events_provider_event_id", "provider", "event_id", unique=True),
+		db.Index("ix_webhook_events_received_at", "received_at"),
+	)
+
+	def __repr__(self) -> str:
+		return f"<WebhookEvent id={self.id} provider={self.provider} status={self.status}>"
+
+
+class IdempotencyRecord(db.Model):
+	__tablename__ = "idempotency_records"
+
+	# Deterministic key sent as the provider's Idempotency-Key header
+	key = db.Column(db.String(200), primary_key=True)
+	provider = db.Column(db.String(50), nullable=False)
+	operation = db.Column(db.String(50), nullable=False)
+	result = db.Column(db.Text, nullable=False)  # JSON of the client's return value
+	created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+	def __repr__(self) -> str:
+		return f"<IdempotencyRecord key={self.key} operation={self.operation}>"
+
+
+class SchemaMigration(db.Model):
+	__tablename__ = "schema_migrations"
+
+	version = db.Column(db.Integer, primary_key=True)
+	name = db.Column(db.String(200), nullable=False)
+	applied_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+	def __repr__(self) -> str:
+		return f"<SchemaMigration version={self.version} name={self.name}>"
\ No newline at end of file
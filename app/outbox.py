@@ -0,0 +1,168 @@
+import os
+import json
+import logging
+from datetime import date, datetime, timedelta
+from typing import Callable, Optional
+from sqlalchemy import or_, select, update
+from . import db, idempotency
+from .models import OutboxMessage, Payment, PaymentSchedule
+from .pay_advantage import PayAdvantageClient
+from .xero_client import XeroClient
+
+logger = logging.getLogger(__name__)
+
+_handlers: dict[str, Callable[[dict], None]] = {}
+
+
+def handler(kind: str):
+	def register(func: Callable[[dict], None]):
+		_handlers[kind] = func
+		return func
+	return register
+
+
+def enqueue(kind: str, payload: dict, booking_id: Optional[int] = None) -> OutboxMessage:
+	# Only adds to the session: the message commits (or rolls back) together
+	# with the caller's own changes
+	if kind not in _handlers:
+		raise ValueError(f"Unknown outbox message kind: {kind}")
+	message = OutboxMessage(kind=kind, payload=json.dumps(payload), booking_id=booking_id)
+	db.session.add(message)
+	return message
+
+
+def supersede(kind: str, booking_id: int) -> int:
+	# Marks the booking's not-yet-claimed messages of this kind as superseded,
+	# in the caller's transaction, so only the newest one is sent
+	result = db.session.execute(
+		update(OutboxMessage)
+		.where(
+			OutboxMessage.kind == kind,
+			OutboxMessage.booking_id == booking_id,
+			OutboxMessage.status == "pending",
+		)
+		.values(status="superseded", processed_at=datetime.utcnow())
+		.execution_options(synchronize_session=False)
+	)
+	return result.rowcount
+
+
+def _backoff(attempts: int) -> timedelta:
+	return timedelta(seconds=min(30 * 2 ** (attempts - 1), 3600))
+
+
+def _claim(message_id: int, seen_next_attempt_at: datetime, lease: timedelta) -> bool:
+	# Compare-and-set so concurrent workers never process the same message
+	result = db.session.execute(
+		update(OutboxMessage)
+		.where(
+			OutboxMessage.id == message_id,
+			OutboxMessage.status.in_(("pending", "processing")),
+			OutboxMessage.next_attempt_at == seen_next_attempt_at,
+		)
+		.values(
+			status="processing",
+			attempts=OutboxMessage.attempts + 1,
+			next_attempt_at=datetime.utcnow() + lease,
+		)
+		.execution_options(synchronize_session=False)
+	)
+	db.session.commit()
+	return result.rowcount == 1
+
+
+def drain_outbox(batch_size: Optional[int] = None) -> dict:
+	batch_size = batch_size or int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+	max_attempts = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+	lease = timedelta(seconds=int(os.getenv("OUTBOX_LEASE_SECONDS", "300")))
+	counts = {"done": 0, "retried": 0, "failed": 0}
+
+	due = db.session.execute(
+		select(OutboxMessage.id, OutboxMessage.next_attempt_at)
+		.where(
+			# Processing messages whose lease ran out belong to a crashed worker
+			or_(OutboxMessage.status == "pending", OutboxMessage.status == "processing"),
+			OutboxMessage.next_attempt_at <= datetime.utcnow(),
+		)
+		.order_by(OutboxMessage.id.asc())
+		.limit(batch_size)
+	).all()
+
+	for message_id, next_attempt_at in due:
+		if not _claim(message_id, next_attempt_at, lease):
+			continue
+		message = db.session.get(OutboxMessage, message_id)
+		try:
+			_handlers[message.kind](json.loads(message.payload))
+		except Exception as exc:
+			db.session.rollback()
+			message = db.session.get(OutboxMessage, message_id)
+			message.last_error = str(exc)[:2000]
+			if message.attempts >= max_attempts:
+				message.status = "failed"
+				counts["failed"] += 1
+				logger.error("Outbox message %s (%s) failed permanently: %s", message.id, message.kind, exc)
+			else:
+				message.status = "pending"
+				message.next_attempt_at = datetime.utcnow() + _backoff(message.attempts)
+				counts["retried"] += 1
+				logger.warning("Outbox message %s (%s) failed, will retry: %s", message.id, message.kind, exc)
+		else:
+			message.status = "done"
+			message.last_error = None
+			message.processed_at = datetime.utcnow()
+			counts["done"] += 1
+		db.session.commit()
+	return counts
+
+
+@handler("payadvantage.create_schedule")
+def _create_direct_debit_schedule(payload: dict) -> None:
+	schedule = db.session.get(PaymentSchedule, payload["schedule_id"])
+	if schedule is None:
+		return
+	booking = schedule.booking
+	# The request and its key come only from the terms saved with this message,
+	# so a later edit (queued as its own message) never mixes into it. Same
+	# terms (e.g. a re-submitted form or a retry) -> same key
+	key = idempotency.make_key(
+		"payadvantage-schedule",
+		booking.id,
+		schedule.id,
+		payload["recurring_amount_cents"],
+		payload["frequency"],
+		payload["recurring_date_start"],
+		payload["reminder_days"],
+		payload["upfront_amount_cents"],
+		payload["description"],
+	)
+	response = PayAdvantageClient().create_direct_debit_schedule(
+		customer_name=booking.customer_name,
+		email=booking.email,
+		phone=booking.phone,
+		recurring_amount_cents=payload["recurring_amount_cents"],
+		frequency=payload["frequency"],
+		description=payload["description"],
+		recurring_date_start=date.fromisoformat(payload["recurring_date_start"]),
+		reminder_days=payload["reminder_days"],
+		upfront_amount_cents=payload["upfront_amount_cents"],
+		idempotency_key=key,
+	)
+	schedule.provider_schedule_id = response.get("schedule_id")
+
+
+@handler("xero.create_invoice")
+def _create_invoice(payload: dict) -> None:
+	payment = db.session.get(Payment, payload["payment_id"])
+	if payment is None or payment.invoice_id:
+		return
+	booking = payment.booking
+	invoice = XeroClient().create_invoice(
+		contact_name=booking.customer_name,
+		email=booking.email,
+		amount_cents=payment.scheduled_amount_cents,
+		due_date=payment.scheduled_date,
+		description=payload["description"],
+		idempotency_key=idempotency.invoice_key(payment.id),
+	)
+	payment.invoice_id = invoice.get("invoice_id")
@@ -1,12 +1,53 @@
 import os
-import uuid
 import logging
 from datetime import date
+from typing import Optional
 import requests
-from requests.auth import HTTPBasicAuth
+from . import idempotency, resilience
+from .transport import get_session, get_timeout
 
 
-class PayAdvantageClient:
+def direct_debit_payload(
+	customer_name: str,
+	email: str,
+	phone: str,
+	recurring_amount_cents: int,
+	frequency: str,
+	description: str,
+	recurring_date_start: date,
+	reminder_days: int,
+	upfront_amount_cents: int = 0,
+) -> dict:
+	# Convert cents to dollars as per v3 API
+	recurring_amount = round(recurring_amount_cents / 100.0, 2)
+	upfront_amount = round(upfront_amount_cents / 100.0, 2) if upfront_amount_cents and upfront_amount_cents > 0 else None
+
+	payload = {
+		"Customer": {"Name": customer_name, "Email": email, "Mobile": phone},
+		"Description": description,
+		"RecurringAmount": recurring_amount,
+		"RecurringDateStart": recurring_date_start.isoformat(),
+		"Frequency": frequency,
+		"ReminderDays": int(reminder_days),
+	}
+	if upfront_amount is not None:
+		payload["UpfrontAmount"] = upfront_amount
+	return payload
+
+
+def error_message(response) -> str:
+	# Try to surface provider error message (works for requests and httpx responses)
+	try:
+		body_obj = response.json()
+	except Exception:
+		body_obj = response.text
+	if isinstance(body_obj, dict):
+		return body_obj.get("message") or body_obj.get("error") or str(body_obj)
+	return str(body_obj)
+
+
+class PayAdvantageSettings:
+	# Configuration and request parts shared by the sync and async clients
 	def __init__(self):
 		# Default to production AU domain; override via PAYADVANTAGE_BASE_URL
 		# For test, use https://api.test.payadvantage.com.au
@@ -15,19 +56,9 @@ class PayAdvantageClient:
 		self.username = os.getenv("PAYADVANTAGE_USERNAME")
 		self.password = os.getenv("PAYADVANTAGE_PASSWORD")
 		self.logger = logging.getLogger(__name__)
+		self.timeout = get_timeout("payadvantage")
 
-	def create_direct_debit_schedule(
-		self,
-		customer_name: str,
-		email: str,
-		phone: str,
-		recurring_amount_cents: int,
-		frequency: str,
-		description: str,
-		recurring_date_start: date,
-		reminder_days: int,
-		upfront_amount_cents: int = 0,
-	) -> dict:
+	def _request_parts(self, idempotency_key: Optional[str]) -> tuple[dict, Optional[tuple[str, str]]]:
 		# Determine authentication strategy: API key or basic auth with username/password
 		if not self.api_key and not (self.username and self.password):
 			raise RuntimeError(
@@ -40,10 +71,12 @@ class PayAdvantageClient:
 		}
 		if self.api_key:
 			headers["Authorization"] = f"Bearer {self.api_key}"
+		if idempotency_key:
+			headers[idempotency.HEADER] = idempotency_key
 
 		auth = None
 		if not self.api_key and self.username and self.password:
-			auth = HTTPBasicAuth(self.username, self.password)
+			auth = (self.username, self.password)
 
 		# Log which auth path is used (without secrets)
 		auth_mode = "api_key" if self.api_key else ("basic" if auth else "none")
@@ -52,46 +85,62 @@ class PayAdvantageClient:
 			f"{self.base_url}/v3/direct_debits",
 			auth_mode,
 		)
+		return headers, auth
 
-		# Convert cents to dollars as per v3 API
-		recurring_amount = round(recurring_amount_cents / 100.0, 2)
-		upfront_amount = round(upfront_amount_cents / 100.0, 2) if upfront_amount_cents and upfront_amount_cents > 0 else None
-
-		payload = {
-			"Customer": {"Name": customer_name, "Email": email, "Mobile": phone},
-			"Description": description,
-			"RecurringAmount": recurring_amount,
-			"RecurringDateStart": recurring_date_start.isoformat(),
-			"Frequency": frequency,
-			"ReminderDays": int(reminder_days),
-		}
-		if upfront_amount is not None:
-			payload["UpfrontAmount"] = upfront_amount
+	def _log_error(self, response) -> str:
+		message = error_message(response)
+		self.logger.error(
+			"PayAdvantage error: status=%s body=%s",
+			response.status_code,
+			message,
+		)
+		return f"PayAdvantage {response.status_code}: {message}"
 
-		response = requests.post(
-			f"{self.base_url}/v3/direct_debits",
-			headers=headers,
-			auth=auth,
-			json=payload,
-			timeout=30,
+
+class PayAdvantageClient(PayAdvantageSettings):
+	def __init__(self):
+		super().__init__()
+		self.session = get_session("payadvantage")
+
+	def create_direct_debit_schedule(
+		self,
+		customer_name: str,
+		email: str,
+		phone: str,
+		recurring_amount_cents: int,
+		frequency: str,
+		description: str,
+		recurring_date_start: date,
+		reminder_days: int,
+		upfront_amount_cents: int = 0,
+		idempotency_key: Optional[str] = None,
+	) -> dict:
+		if idempotency_key:
+			stored = idempotency.lookup(idempotency_key)
+			if stored:
+				return stored
+
+		headers, auth = self._request_parts(idempotency_key)
+		payload = direct_debit_payload(
+			customer_name, email, phone, recurring_amount_cents, frequency,
+			description, recurring_date_start, reminder_days, upfront_amount_cents,
 		)
-		if not response.ok:
-			# Try to surface provider error message
-			try:
-				body_obj = response.json()
-			except Exception:
-				body_obj = response.text
-			self.logger.error(
-				"PayAdvantage error: status=%s body=%s",
-				response.status_code,
-				body_obj,
-			)
-			message = None
-			if isinstance(body_obj, dict):
-				message = body_obj.get("message") or body_obj.get("error") or str(body_obj)
-			else:
-				message = str(body_obj)
-			raise requests.HTTPError(
-				f"PayAdvantage {response.status_code}: {message}", response=response
+
+		def send():
+			response = self.session.post(
+				f"{self.base_url}/v3/direct_debits",
+				headers=headers,
+				auth=auth,
+				json=payload,
+				timeout=self.timeout,
 			)
-		return response.json()
\ No newline at end of file
+			if not response.ok:
+				raise requests.HTTPError(self._log_error(response), response=response)
+			return response
+
+		# Not treated as idempotent for retries: only retried when the request
+		# never reached PayAdvantage
+		result = resilience.call("payadvantage", send).json()
+		if idempotency_key:
+			idempotency.store("payadvantage", "create_direct_debit_schedule", idempotency_key, result)
+		return result
\ No newline at end of file
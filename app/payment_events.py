@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import date
+from types import SimpleNamespace
+from sqlalchemy import bindparam, select, update
+from . import db, rollups
+from .models import Payment
+
+# PayAdvantage payment events, shared by the webhook inbox consumer and any
+# other path that applies provider payment updates. An event is a dict with
+# payment_id and optional event_id, sequence, status, paid_amount_cents and
+# paid_date.
+
+
+class RecentEvents:
+	# Process-local set of recently seen event ids. Entries are kept in
+	# insertion order, so expired ones are evicted from the front in O(1) each.
+	def __init__(self, ttl_seconds: float, max_size: int):
+		self.ttl = ttl_seconds
+		self.max_size = max_size
+		self._entries: OrderedDict[str, float] = OrderedDict()
+		self._lock = threading.Lock()
+
+	def _evict(self, now: float) -> None:
+		while self._entries:
+			seen_at = next(iter(self._entries.values()))
+			if seen_at > now - self.ttl and len(self._entries) <= self.max_size:
+				break
+			self._entries.popitem(last=False)
+
+	def __contains__(self, key: str) -> bool:
+		with self._lock:
+			self._evict(time.monotonic())
+			return key in self._entries
+
+	def add(self, key: str) -> None:
+		with self._lock:
+			self._entries[key] = time.monotonic()
+			self._entries.move_to_end(key)
+			self._evict(time.monotonic())
+
+
+recent_events = RecentEvents(
+	ttl_seconds=float(os.getenv("WEBHOOK_DEDUP_CACHE_SECONDS", "600")),
+	max_size=int(os.getenv("WEBHOOK_DEDUP_CACHE_SIZE", "100000")),
+)
+
+
+def _event_id(body: dict) -> str:
+	if body.get("event_id"):
+		return str(body["event_id"])
+	# Providers resend the same body on retry, so its hash identifies the delivery
+	canonical = json.dumps(body, sort_keys=True, separators=(",", ":"))
+	return "sha256:" + hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def parse_event(body) -> dict:
+	# Normalizes a raw event (JSON text or an already-decoded dict) so that
+	# applying it cannot fail on bad input
+	if isinstance(body, (str, bytes)):
+		try:
+			body = json.loads(body)
+		except ValueError:
+			raise ValueError("invalid JSON")
+	if not isinstance(body, dict) or not body.get("payment_id"):
+		raise ValueError("missing payment_id")
+	event = {
+		"event_id": _event_id(body),
+		"payment_id": str(body["payment_id"]),
+		"status": body.get("status") or None,
+	}
+	if event["status"] and event["status"] not in Payment.STATUS_TRANSITIONS:
+		raise ValueError(f"unknown status {event['status']}")
+	try:
+		sequence = body.get("sequence")
+		event["sequence"] = int(sequence) if sequence is not None else None
+	except (TypeError, ValueError):
+		raise ValueError("invalid sequence")
+	try:
+		amount = body.get("paid_amount_cents")
+		event["paid_amount_cents"] = int(amount) if amount is not None else None
+	except (TypeError, ValueError):
+		raise ValueError("invalid paid_amount_cents")
+	try:
+		event["paid_date"] = date.fromisoformat(body["paid_date"]) if body.get("paid_date") else None
+	except (TypeError, ValueError):
+		# Matches the old webhook: an unparseable date is ignored
+		event["paid_date"] = None
+	return event
+
+
+def _apply(payment, event: dict, force: bool = False) -> str:
+	# payment is a Payment or a plain row stand-in with the same attributes.
+	# force skips the ordering checks (rebuilding state from the event log).
+	sequence = event["sequence"]
+	status = event["status"]
+	if not force:
+		if sequence is not None and payment.last_event_sequence is not None and sequence <= payment.last_event_sequence:
+			return "out of order"
+		if status and status != payment.status and status not in Payment.STATUS_TRANSITIONS.get(payment.status, set()):
+			return f"invalid transition {payment.status} -> {status}"
+	changes = {}
+	if status and status != payment.status:
+		changes["status"] = status
+	if event["paid_amount_cents"] is not None and event["paid_amount_cents"] != payment.paid_amount_cents:
+		changes["paid_amount_cents"] = event["paid_amount_cents"]
+	if event["paid_date"] and event["paid_date"] != payment.paid_date:
+		changes["paid_date"] = event["paid_date"]
+	if not changes:
+		# Leave the row untouched
+		return "no change"
+	for name, value in changes.items():
+		setattr(payment, name, value)
+	if sequence is not None:
+		payment.last_event_sequence = sequence
+	return "applied"
+
+
+def apply_events(events: list[dict]) -> list[str]:
+	# Applies parsed events in order inside the caller's transaction, loading
+	# every referenced payment with one IN query. Returns one outcome per event:
+	# "applied", or why it was skipped. Rollups follow through the ORM flush.
+	provider_ids = {event["payment_id"] for event in events}
+	if not provider_ids:
+		return []
+	payments = {
+		payment.provider_payment_id: payment
+		for payment in db.session.scalars(
+			select(Payment).where(Payment.provider_payment_id.in_(provider_ids))
+		)
+	}
+	outcomes = []
+	for event in events:
+		payment = payments.get(event["payment_id"])
+		if payment is None:
+			outcomes.append("payment not found")
+			continue
+		outcomes.append(_apply(payment, event))
+	return outcomes
+
+
+# Payment columns the bulk path reads; the last four are the ones events change
+_BULK_COLUMNS = (
+	Payment.id,
+	Payment.provider_payment_id,
+	Payment.scheduled_date,
+	Payment.scheduled_amount_cents,
+	Payment.status,
+	Payment.paid_amount_cents,
+	Payment.paid_date,
+	Payment.last_event_sequence,
+)
+_LOOKUP_CHUNK = 5000
+
+
+def apply_events_bulk(events: list[dict], force: bool = False) -> list[str]:
+	# Same outcomes as apply_events, for large batches: payments are read as
+	# plain rows, final states are written with one executemany UPDATE and the
+	# rollups are adjusted explicitly. Runs in the caller's transaction.
+	provider_ids = list({event["payment_id"] for event in events})
+	states: dict[str, SimpleNamespace] = {}
+	# One IN query, split only to stay under the database's bound-parameter limit
+	for start in range(0, len(provider_ids), _LOOKUP_CHUNK):
+		rows = db.session.execute(
+			select(*_BULK_COLUMNS).where(Payment.provider_payment_id.in_(provider_ids[start:start + _LOOKUP_CHUNK]))
+		)
+		for row in rows:
+			states[row.provider_payment_id] = SimpleNamespace(**row._asdict())
+	originals = {key: dict(vars(state)) for key, state in states.items()}
+
+	outcomes = []
+	for event in events:
+		state = states.get(event["payment_id"])
+		if state is None:
+			outcomes.append("payment not found")
+			continue
+		outcomes.append(_apply(state, event, force))
+
+	changed = [(originals[key], vars(state)) for key, state in states.items() if vars(state) != originals[key]]
+	if changed:
+		table = Payment.__table__
+		conn = db.session.connection()
+		# Core executemany: the ORM bulk path costs several times more per row
+		conn.execute(
+			update(table)
+			.where(table.c.id == bindparam("row_id"))
+			.values(
+				status=bindparam("status"),
+				paid_amount_cents=bindparam("paid_amount_cents"),
+				paid_date=bindparam("paid_date"),
+				last_event_sequence=bindparam("last_event_sequence"),
+			),
+			[
+				{
+					"row_id": new["id"],
+					"status": new["status"],
+					"paid_amount_cents": new["paid_amount_cents"],
+					"paid_date": new["paid_date"],
+					"last_event_sequence": new["last_event_sequence"],
+				}
+				for _, new in changed
+			],
+		)
+		rollups.record_updates(conn, changed)
+	return outcomes
\ No newline at end of file
@@ -0,0 +1,49 @@
+import logging
+from contextvars import ContextVar
+from functools import wraps
+from typing import Optional
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+_counter: ContextVar[Optional[list[int]]] = ContextVar("query_budget_counter", default=None)
+
+
+class QueryBudgetExceeded(RuntimeError):
+	pass
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany) -> None:
+	counter = _counter.get()
+	if counter is not None:
+		counter[0] += 1
+
+
+def init_query_counter(engine: Engine) -> None:
+	if not event.contains(engine, "before_cursor_execute", _count_query):
+		event.listen(engine, "before_cursor_execute", _count_query)
+
+
+def query_budget(limit: int):
+	# Guards a view against N+1 regressions: the view (template rendering
+	# included) may issue at most `limit` SQL statements. Over budget logs a
+	# warning, or raises when QUERY_BUDGET_STRICT is enabled.
+	def decorator(view):
+		@wraps(view)
+		def wrapped(*args, **kwargs):
+			counter = [0]
+			token = _counter.set(counter)
+			try:
+				response = view(*args, **kwargs)
+			finally:
+				_counter.reset(token)
+			if counter[0] > limit:
+				message = f"{view.__name__} issued {counter[0]} queries (budget {limit})"
+				if current_app.config.get("QUERY_BUDGET_STRICT"):
+					raise QueryBudgetExceeded(message)
+				logger.warning(message)
+			return response
+		return wrapped
+	return decorator
@@ -0,0 +1,208 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Callable, Optional, TypeVar
+import httpx
+import requests
+from .transport import _setting
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(requests.RequestException):
+	# A RequestException so callers that already handle provider failures
+	# (outbox retries, invoice dispatch) treat a short-circuited call the same way
+	pass
+
+
+class CircuitBreaker:
+	# closed: calls pass, consecutive failures are counted. open: calls fail
+	# immediately until reset_timeout has passed. half_open: one trial call is
+	# let through; its success closes the breaker, its failure re-opens it.
+	def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+		self.name = name
+		self.failure_threshold = failure_threshold
+		self.reset_timeout = reset_timeout
+		self.state = "closed"
+		self.failures = 0
+		self.opened_at = 0.0
+		self.trial_in_flight = False
+		self.rejected = 0
+		self._lock = threading.Lock()
+
+	def before_call(self) -> None:
+		with self._lock:
+			if self.state == "closed":
+				return
+			if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+				self.state = "half_open"
+				self.trial_in_flight = False
+			if self.state == "half_open" and not self.trial_in_flight:
+				self.trial_in_flight = True
+				return
+			self.rejected += 1
+			raise CircuitOpenError(f"{self.name} circuit is open; failing fast")
+
+	def record_success(self) -> None:
+		with self._lock:
+			if self.state != "closed":
+				logger.info("%s circuit closed", self.name)
+			self.state = "closed"
+			self.failures = 0
+			self.trial_in_flight = False
+
+	def record_failure(self) -> None:
+		with self._lock:
+			self.failures += 1
+			if self.state == "half_open" or self.failures >= self.failure_threshold:
+				if self.state != "open":
+					logger.warning("%s circuit opened after %s consecutive failures", self.name, self.failures)
+				self.state = "open"
+				self.opened_at = time.monotonic()
+				self.trial_in_flight = False
+
+	def snapshot(self) -> dict:
+		with self._lock:
+			retry_in = None
+			if self.state == "open":
+				retry_in = round(max(self.reset_timeout - (time.monotonic() - self.opened_at), 0), 1)
+			return {
+				"state": self.state,
+				"consecutive_failures": self.failures,
+				"rejected_calls": self.rejected,
+				"retry_in_seconds": retry_in,
+			}
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider: str) -> CircuitBreaker:
+	breaker = _breakers.get(provider)
+	if breaker is not None:
+		return breaker
+	with _breakers_lock:
+		breaker = _breakers.get(provider)
+		if breaker is None:
+			breaker = CircuitBreaker(
+				provider,
+				failure_threshold=int(_setting(provider, "BREAKER_FAILURES", "5")),
+				reset_timeout=float(_setting(provider, "BREAKER_RESET_SECONDS", "30")),
+			)
+			_breakers[provider] = breaker
+	return breaker
+
+
+def breaker_states() -> dict:
+	with _breakers_lock:
+		breakers = dict(_breakers)
+	return {provider: breaker.snapshot() for provider, breaker in breakers.items()}
+
+
+def _status(exc: Exception) -> Optional[int]:
+	response = getattr(exc, "response", None)
+	return response.status_code if response is not None else None
+
+
+def _is_outage(exc: Exception) -> bool:
+	# What counts against the breaker: the provider is unreachable or erroring,
+	# not rejecting our request
+	if isinstance(exc, (requests.ConnectionError, requests.Timeout, httpx.TransportError)):
+		return True
+	status = _status(exc)
+	return status is not None and status >= 500
+
+
+def _is_retryable(exc: Exception, idempotent: bool) -> bool:
+	# Never reached the provider, or it explicitly asked us to come back
+	if isinstance(exc, (requests.ConnectTimeout, httpx.ConnectTimeout, httpx.ConnectError)) or _status(exc) == 429:
+		return True
+	# The provider may have acted on the request: only safe to repeat when
+	# repeating cannot create a second resource
+	return idempotent and _is_outage(exc)
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+	response = getattr(exc, "response", None)
+	value = response.headers.get("Retry-After") if response is not None else None
+	try:
+		return float(value) if value else None
+	except ValueError:
+		return None
+
+
+def _settings(provider: str) -> tuple[int, float, float]:
+	return (
+		int(_setting(provider, "RETRY_ATTEMPTS", "3")),
+		float(_setting(provider, "RETRY_BASE_SECONDS", "0.5")),
+		float(_setting(provider, "RETRY_MAX_SECONDS", "10")),
+	)
+
+
+def _after_failure(provider: str, breaker: CircuitBreaker, exc: Exception, attempt: int, idempotent: bool) -> Optional[float]:
+	# Returns how long to wait before retrying, or None when the error should
+	# be raised. The breaker sees one result per call, once retries are over;
+	# a half-open trial call is not retried
+	attempts, base, cap = _settings(provider)
+	if attempt >= attempts or not _is_retryable(exc, idempotent) or breaker.state != "closed":
+		if _is_outage(exc):
+			breaker.record_failure()
+		else:
+			breaker.record_success()
+		return None
+	delay = _retry_after(exc) or random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+	logger.info("%s call failed (%s); retrying in %.2fs", provider, exc, delay)
+	return min(delay, cap)
+
+
+def call(provider: str, func: Callable[[], T], idempotent: bool = False) -> T:
+	# Runs func (one provider request that raises requests exceptions, including
+	# HTTPError from raise_for_status) behind the provider's circuit breaker,
+	# retrying with full-jitter exponential backoff where that is safe
+	breaker = get_breaker(provider)
+	attempt = 0
+	while True:
+		attempt += 1
+		breaker.before_call()
+		try:
+			result = func()
+		except requests.RequestException as exc:
+			delay = _after_failure(provider, breaker, exc, attempt, idempotent)
+			if delay is None:
+				raise
+			time.sleep(delay)
+			continue
+		except Exception:
+			# The provider answered; the caller failed on what it sent back
+			breaker.record_success()
+			raise
+		breaker.record_success()
+		return result
+
+
+async def call_async(provider: str, func: Callable[[], Awaitable[T]], idempotent: bool = False) -> T:
+	# call() for the async clients: func is a coroutine function making one
+	# httpx request; shares the provider's breaker with the sync clients
+	breaker = get_breaker(provider)
+	attempt = 0
+	while True:
+		attempt += 1
+		breaker.before_call()
+		try:
+			result = await func()
+		except httpx.HTTPError as exc:
+			delay = _after_failure(provider, breaker, exc, attempt, idempotent)
+			if delay is None:
+				raise
+			await asyncio.sleep(delay)
+			continue
+		except Exception:
+			breaker.record_success()
+			raise
+		breaker.record_success()
+		return result
\ No newline at end of file
@@ -0,0 +1,234 @@
+import logging
+from collections import defaultdict
+from datetime import date
+from typing import Iterable, Optional
+from flask_sqlalchemy.session import Session
+from sqlalchemy import delete, event, func, inspect, select, update
+from sqlalchemy.engine import Connection
+from . import db
+from .models import Booking, BookingRollup, Payment, PaymentRollup
+from .upserts import upsert_add
+
+logger = logging.getLogger(__name__)
+
+# (status, day) -> [payment_count, scheduled_amount_cents, paid_amount_cents]
+Deltas = dict[tuple[str, date], list[int]]
+
+_TRACKED = ("status", "scheduled_date", "scheduled_amount_cents", "paid_amount_cents")
+
+
+def _add(deltas: Deltas, status: str, day: date, count: int, scheduled: int, paid: Optional[int]) -> None:
+	totals = deltas[(status, day)]
+	totals[0] += count
+	totals[1] += scheduled
+	totals[2] += paid or 0
+
+
+def apply_deltas(conn: Connection, deltas: Deltas) -> None:
+	rows = [
+		{
+			"status": status,
+			"day": day,
+			"payment_count": count,
+			"scheduled_amount_cents": scheduled,
+			"paid_amount_cents": paid,
+		}
+		for (status, day), (count, scheduled, paid) in deltas.items()
+		if count or scheduled or paid
+	]
+	table = PaymentRollup.__table__
+	for row in rows:
+		upsert_add(conn, table, row, ["status", "day"], ["payment_count", "scheduled_amount_cents", "paid_amount_cents"])
+
+
+def apply_booking_deltas(conn: Connection, deltas: dict[str, int]) -> None:
+	# deltas: status -> change in booking count
+	table = BookingRollup.__table__
+	for status, count in deltas.items():
+		if count:
+			upsert_add(conn, table, {"status": status, "booking_count": count}, ["status"], ["booking_count"])
+
+
+def _old_values(payment: Payment) -> tuple:
+	state = inspect(payment)
+	values = []
+	for name in _TRACKED:
+		history = state.attrs[name].history
+		if history.deleted:
+			values.append(history.deleted[0])
+		elif history.unchanged:
+			values.append(history.unchanged[0])
+		else:
+			values.append(getattr(payment, name))
+	return tuple(values)
+
+
+def _new_values(payment: Payment) -> tuple:
+	return tuple(getattr(payment, name) for name in _TRACKED)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_orm_changes(session, flush_context) -> None:
+	# ORM writes (webhook, edit_booking, outbox handlers) are picked up here;
+	# bulk UPDATE/INSERT statements report their changes via record_* helpers
+	deltas: Deltas = defaultdict(lambda: [0, 0, 0])
+	for obj in session.new:
+		if isinstance(obj, Payment):
+			status, day, scheduled, paid = _new_values(obj)
+			_add(deltas, status, day, 1, scheduled, paid)
+	for obj in session.deleted:
+		if isinstance(obj, Payment):
+			status, day, scheduled, paid = _old_values(obj)
+			_add(deltas, status, day, -1, -scheduled, -(paid or 0))
+	for obj in session.dirty:
+		if isinstance(obj, Payment) and session.is_modified(obj, include_collections=False):
+			old = _old_values(obj)
+			new = _new_values(obj)
+			if old != new:
+				_add(deltas, old[0], old[1], -1, -old[2], -(old[3] or 0))
+				_add(deltas, new[0], new[1], 1, new[2], new[3])
+	if deltas:
+		apply_deltas(session.connection(), deltas)
+
+	booking_deltas: dict[str, int] = defaultdict(int)
+	for obj in session.new:
+		if isinstance(obj, Booking):
+			booking_deltas[obj.status] += 1
+	for obj in session.deleted:
+		if isinstance(obj, Booking):
+			history = inspect(obj).attrs.status.history
+			booking_deltas[(history.deleted or history.unchanged or [obj.status])[0]] -= 1
+	for obj in session.dirty:
+		if isinstance(obj, Booking):
+			history = inspect(obj).attrs.status.history
+			if history.deleted and history.deleted[0] != obj.status:
+				booking_deltas[history.deleted[0]] -= 1
+				booking_deltas[obj.status] += 1
+	if any(booking_deltas.values()):
+		apply_booking_deltas(session.connection(), booking_deltas)
+
+
+def record_status_change(conn: Connection, old_status: str, new_status: str, rows: Iterable[tuple]) -> None:
+	# rows: (day, count, scheduled_amount_cents, paid_amount_cents) moved between statuses
+	deltas: Deltas = defaultdict(lambda: [0, 0, 0])
+	for day, count, scheduled, paid in rows:
+		_add(deltas, old_status, day, -count, -(scheduled or 0), -(paid or 0))
+		_add(deltas, new_status, day, count, scheduled or 0, paid)
+	apply_deltas(conn, deltas)
+
+
+def record_inserts(conn: Connection, rows: Iterable[dict]) -> None:
+	# rows: Payment column dicts inserted with a bulk INSERT
+	deltas: Deltas = defaultdict(lambda: [0, 0, 0])
+	for row in rows:
+		_add(
+			deltas,
+			row.get("status", "pending"),
+			row["scheduled_date"],
+			1,
+			row["scheduled_amount_cents"],
+			row.get("paid_amount_cents"),
+		)
+	apply_deltas(conn, deltas)
+
+
+def record_booking_inserts(conn: Connection, rows: Iterable[dict]) -> None:
+	# rows: Booking column dicts inserted with a bulk INSERT
+	deltas: dict[str, int] = defaultdict(int)
+	for row in rows:
+		deltas[row.get("status", "active")] += 1
+	apply_booking_deltas(conn, deltas)
+
+
+def active_bookings() -> int:
+	count = db.session.execute(
+		select(BookingRollup.booking_count).where(BookingRollup.status == "active")
+	).scalar()
+	return count or 0
+
+
+def summary_by_status() -> dict:
+	rows = db.session.execute(
+		select(
+			PaymentRollup.status,
+			func.sum(PaymentRollup.payment_count),
+			func.sum(PaymentRollup.scheduled_amount_cents),
+			func.sum(PaymentRollup.paid_amount_cents),
+		).group_by(PaymentRollup.status)
+	).all()
+	return {
+		status: {"count": count, "scheduled_sum": scheduled, "paid_sum": paid}
+		for status, count, scheduled, paid in rows
+		if count
+	}
+
+
+def reconcile(conn: Connection) -> int:
+	# Recomputes the rollups from payments and repairs any drift; returns the
+	# number of (status, day) buckets that had to be corrected
+	actual = {
+		(status, day): (count, scheduled or 0, paid or 0)
+		for status, day, count, scheduled, paid in conn.execute(
+			select(
+				Payment.status,
+				Payment.scheduled_date,
+				func.count(Payment.id),
+				func.sum(Payment.scheduled_amount_cents),
+				func.sum(func.coalesce(Payment.paid_amount_cents, 0)),
+			).group_by(Payment.status, Payment.scheduled_date)
+		)
+	}
+	table = PaymentRollup.__table__
+	stored = {
+		(status, day): (count, scheduled, paid)
+		for status, day, count, scheduled, paid in conn.execute(
+			select(table.c.status, table.c.day, table.c.payment_count, table.c.scheduled_amount_cents, table.c.paid_amount_cents)
+		)
+	}
+	corrected = 0
+	for key, values in actual.items():
+		if stored.get(key) == values:
+			continue
+		corrected += 1
+		status, day = key
+		columns = {"payment_count": values[0], "scheduled_amount_cents": values[1], "paid_amount_cents": values[2]}
+		if key in stored:
+			conn.execute(update(table).where(table.c.status == status, table.c.day == day).values(**columns))
+		else:
+			conn.execute(table.insert().values(status=status, day=day, **columns))
+	for status, day in set(stored) - set(actual):
+		if stored[(status, day)] != (0, 0, 0):
+			corrected += 1
+		conn.execute(delete(table).where(table.c.status == status, table.c.day == day))
+	if corrected:
+		logger.warning("Payment rollups drifted: corrected %s buckets", corrected)
+	return corrected
+
+
+def reconcile_bookings(conn: Connection) -> int:
+	# reconcile() for the booking counts; returns the number of statuses corrected
+	actual = dict(conn.execute(select(Booking.status, func.count(Booking.id)).group_by(Booking.status)).all())
+	table = BookingRollup.__table__
+	stored = dict(conn.execute(select(table.c.status, table.c.booking_count)).all())
+	corrected = 0
+	for status in set(actual) | set(stored):
+		count = actual.get(status, 0)
+		if stored.get(status, 0) == count:
+			continue
+		corrected += 1
+		if status in stored:
+			conn.execute(update(table).where(table.c.status == status).values(booking_count=count))
+		else:
+			conn.execute(table.insert().values(status=status, booking_count=count))
+	if corrected:
+		logger.warning("Booking rollups drifted: corrected %s statuses", corrected)
+	return corrected
+
+
+def record_updates(conn: Connection, rows: Iterable[tuple[dict, dict]]) -> None:
+	# rows: (old, new) Payment column dicts for rows changed with a bulk UPDATE
+	deltas: Deltas = defaultdict(lambda: [0, 0, 0])
+	for old, new in rows:
+		_add(deltas, old["status"], old["scheduled_date"], -1, -old["scheduled_amount_cents"], -(old["paid_amount_cents"] or 0))
+		_add(deltas, new["status"], new["scheduled_date"], 1, new["scheduled_amount_cents"], new["paid_amount_cents"])
+	apply_deltas(conn, deltas)
\ No newline at end of file
@@ -1,9 +1,22 @@
-from datetime import date, timedelta
+import os
+import json
+import logging
+import threading
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
 from flask import Flask
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.schedulers.base import BaseScheduler
-from . import db
-from .models import Payment, PaymentSchedule
+from sqlalchemy import and_, func, inspect, or_, select, text, update
+from . import db, dispatch, idempotency, job_runs, leader, rollups
+from .models import Booking, JobCheckpoint, Payment
 from .xero_client import XeroClient
+from .async_clients import AsyncXeroClient
+from .outbox import drain_outbox
+from .inbox import drain_inbox, evict_processed
+from .expansion import expand_schedules
+
+logger = logging.getLogger(__name__)
 
 
 def _currency(amount_cents: int) -> float:
@@ -11,61 +24,423 @@ def _currency(amount_cents: int) -> float:
 
 
 def schedule_jobs(scheduler: BaseScheduler, app: Flask) -> None:
-	# Runs daily at 01:00 UTC to create invoices 2 days before debit
+	# Runs daily at 00:30 UTC to materialize upcoming recurring payments
+	scheduler.add_job(
+		func=run_scheduled_job,
+		trigger="cron",
+		hour=0,
+		minute=30,
+		args=["expand_payment_schedules"],
+		id="expand_payment_schedules",
+		replace_existing=True,
+	)
+	# Runs daily at 01:00 UTC to invoice payments due within INVOICE_HORIZON_DAYS
+	# (default 2), catching up on any earlier days that were missed
 	scheduler.add_job(
-		func=_create_invoices_for_upcoming_payments,
+		func=run_scheduled_job,
 		trigger="cron",
 		hour=1,
 		minute=0,
-		args=[app],
+		args=["create_invoices_2_days_prior"],
 		id="create_invoices_2_days_prior",
 		replace_existing=True,
 	)
 	# Runs daily at 02:00 UTC to mark overdue payments
 	scheduler.add_job(
-		func=_mark_overdue_payments,
+		func=run_scheduled_job,
 		trigger="cron",
 		hour=2,
 		minute=0,
-		args=[app],
+		args=["mark_overdue_payments"],
 		id="mark_overdue_payments",
 		replace_existing=True,
 	)
+	# Runs daily at 03:00 UTC to re-verify the report rollups against payments
+	scheduler.add_job(
+		func=run_scheduled_job,
+		trigger="cron",
+		hour=3,
+		minute=0,
+		args=["reconcile_payment_rollups"],
+		id="reconcile_payment_rollups",
+		replace_existing=True,
+	)
+	# Sends queued PayAdvantage/Xero requests written by the admin forms
+	scheduler.add_job(
+		func=run_scheduled_job,
+		trigger="interval",
+		seconds=int(os.getenv("OUTBOX_POLL_SECONDS", "10")),
+		args=["drain_outbox"],
+		id="drain_outbox",
+		replace_existing=True,
+	)
+	# Applies PayAdvantage webhook events queued by /webhooks/payadvantage
+	scheduler.add_job(
+		func=run_scheduled_job,
+		trigger="interval",
+		seconds=int(os.getenv("WEBHOOK_POLL_SECONDS", "2")),
+		args=["apply_webhook_events"],
+		id="apply_webhook_events",
+		replace_existing=True,
+	)
+	# Runs daily at 03:30 UTC to drop processed webhook events past the dedup window
+	scheduler.add_job(
+		func=run_scheduled_job,
+		trigger="cron",
+		hour=3,
+		minute=30,
+		args=["evict_webhook_events"],
+		id="evict_webhook_events",
+		replace_existing=True,
+	)
+	# Runs daily at 03:45 UTC to drop job run history past JOB_RUNS_RETENTION_DAYS
+	scheduler.add_job(
+		func=run_scheduled_job,
+		trigger="cron",
+		hour=3,
+		minute=45,
+		args=["prune_job_runs"],
+		id="prune_job_runs",
+		replace_existing=True,
+	)
+	# Renews the Xero access token ahead of expiry so request paths never wait on it
+	scheduler.add_job(
+		func=run_scheduled_job,
+		trigger="interval",
+		minutes=5,
+		args=["refresh_xero_token"],
+		id="refresh_xero_token",
+		replace_existing=True,
+	)
+
+
+def _get_checkpoint(name: str) -> dict:
+	checkpoint = db.session.get(JobCheckpoint, name)
+	return json.loads(checkpoint.value) if checkpoint else {}
+
+
+def _set_checkpoint(name: str, value: dict) -> None:
+	checkpoint = db.session.get(JobCheckpoint, name) or JobCheckpoint(name=name)
+	checkpoint.value = json.dumps(value)
+	db.session.add(checkpoint)
+
+
+def _uninvoiced_chunks(window: tuple, batch_size: int, stop: threading.Event):
+	# Streams the backlog as plain rows in provider-batch-sized chunks,
+	# keyset-ordered on (scheduled_date, id)
+	last_key = None
+	while not stop.is_set():
+		query = (
+			select(
+				Payment.id,
+				Payment.scheduled_date,
+				Payment.scheduled_amount_cents,
+				Booking.id.label("booking_id"),
+				Booking.customer_name,
+				Booking.email,
+			)
+			.join(Booking, Payment.booking_id == Booking.id)
+			.where(*window)
+		)
+		if last_key:
+			query = query.where(
+				or_(
+					Payment.scheduled_date > last_key[0],
+					and_(Payment.scheduled_date == last_key[0], Payment.id > last_key[1]),
+				)
+			)
+		chunk = db.session.execute(
+			query.order_by(Payment.scheduled_date.asc(), Payment.id.asc()).limit(batch_size)
+		).all()
+		if not chunk:
+			return
+		last_key = (chunk[-1].scheduled_date, chunk[-1].id)
+		yield chunk
+		if len(chunk) < batch_size:
+			return
 
 
-def _create_invoices_for_upcoming_payments(app: Flask):
+def _create_invoices_for_upcoming_payments(
+	app: Flask,
+	horizon_days: Optional[int] = None,
+	lookback_days: Optional[int] = None,
+) -> int:
 	with app.app_context():
 		client = XeroClient()
 		today = date.today()
-		not_before = today + timedelta(days=2)
-		pending = (
-			Payment.query.filter(
-				Payment.status == "pending",
-				Payment.scheduled_date == not_before,
-				Payment.invoice_id.is_(None),
-			)
-			.all()
+		horizon_days = horizon_days if horizon_days is not None else int(os.getenv("INVOICE_HORIZON_DAYS", "2"))
+		lookback_days = lookback_days if lookback_days is not None else int(os.getenv("INVOICE_MAX_LOOKBACK_DAYS", "7"))
+		through = today + timedelta(days=horizon_days)
+		since = today - timedelta(days=lookback_days)
+		checkpoint_name = "create_invoices_2_days_prior"
+		previous = _get_checkpoint(checkpoint_name).get("completed_through")
+		if previous and date.fromisoformat(previous) < through - timedelta(days=1):
+			logger.warning("Invoicing last completed through %s; catching up to %s", previous, through.isoformat())
+			if date.fromisoformat(previous) < since:
+				logger.warning("Payments due before %s are past the catch-up window and are not invoiced", since.isoformat())
+
+		# Days missed while the job wasn't running are caught up, but only back
+		# to the lookback: older pending rows are left to the overdue sweep
+		window = (
+			Payment.status == "pending",
+			Payment.scheduled_date >= since,
+			Payment.scheduled_date <= through,
+			Payment.invoice_id.is_(None),
 		)
-		for payment in pending:
-			booking = payment.booking
-			invoice = client.create_invoice(
-				contact_name=booking.customer_name,
-				email=booking.email,
-				amount_cents=payment.scheduled_amount_cents,
-				due_date=payment.scheduled_date,
-				description=f"Recurring debit for booking #{booking.id} on {payment.scheduled_date.isoformat()} ({_currency(payment.scheduled_amount_cents)})",
-			)
-			payment.invoice_id = invoice.get("invoice_id")
+
+		def invoice_items(chunk) -> list[dict]:
+			return [
+				{
+					"contact_name": row.customer_name,
+					"email": row.email,
+					"amount_cents": row.scheduled_amount_cents,
+					"due_date": row.scheduled_date,
+					"description": f"Recurring debit for booking #{row.booking_id} on {row.scheduled_date.isoformat()} ({_currency(row.scheduled_amount_cents)})",
+					"idempotency_key": idempotency.invoice_key(row.id),
+				}
+				for row in chunk
+			]
+
+		def send(chunk) -> list[dict] | Exception:
+			# Network only: runs on dispatch workers, which must not share the
+			# main thread's session, so it gets a fresh app context. Errors are
+			# returned rather than raised so batches still in flight get recorded.
+			with app.app_context():
+				try:
+					return client.create_invoices_batch(invoice_items(chunk))
+				except Exception as exc:
+					return exc
+
+		stop = threading.Event()
+		chunks = _uninvoiced_chunks(window, client.batch_size, stop)
+		mode = os.getenv("INVOICE_DISPATCH_MODE", "concurrent")
+		if mode == "async":
+			async_client = AsyncXeroClient()
+
+			async def send_async(chunk) -> list[dict] | Exception:
+				# Each task gets its own app context, like the thread workers.
+				# Errors are returned like send()'s, e.g. CircuitOpenError,
+				# which is a requests exception rather than an httpx one.
+				with app.app_context():
+					try:
+						return await async_client.create_invoices_batch(invoice_items(chunk))
+					except Exception as exc:
+						return exc
+
+			concurrency = int(os.getenv("INVOICE_DISPATCH_CONCURRENCY", "50"))
+			results = dispatch.run_ordered_async(chunks, send_async, concurrency, finalize=async_client.aclose)
+		elif mode == "concurrent":
+			workers = int(os.getenv("INVOICE_DISPATCH_WORKERS", "5"))
+			results = dispatch.run_ordered(chunks, send, workers)
+		else:
+			results = ((chunk, send(chunk)) for chunk in chunks)
+
+		created = 0
+		seen = 0
+		failure = None
+		# Results arrive in keyset order; each chunk's invoice ids and the
+		# high-water mark are committed before the next is handled
+		for chunk, invoices in results:
+			if isinstance(invoices, Exception):
+				# Stop queueing new batches but keep recording the ones already
+				# in flight, so no created invoice goes unrecorded
+				failure = failure or invoices
+				stop.set()
+				continue
+			seen += len(chunk)
+			updates = []
+			for row, invoice in zip(chunk, invoices):
+				if invoice["invoice_id"]:
+					updates.append({"id": row.id, "invoice_id": invoice["invoice_id"]})
+				else:
+					logger.warning("Xero rejected invoice for payment %s: %s", row.id, invoice["errors"])
+					job_runs.note_errors()
+			if updates:
+				db.session.execute(update(Payment), updates)
+			created += len(updates)
+			_set_checkpoint(checkpoint_name, {
+				"completed_through": previous,
+				"run_through": through.isoformat(),
+				"last_scheduled_date": chunk[-1].scheduled_date.isoformat(),
+				"last_payment_id": chunk[-1].id,
+			})
+			db.session.commit()
+		if failure:
+			raise failure
+		_set_checkpoint(checkpoint_name, {"completed_through": through.isoformat()})
 		db.session.commit()
+		logger.info("Created %s of %s invoices through %s", created, seen, through.isoformat())
+		return created
 
 
-def _mark_overdue_payments(app: Flask):
+def _mark_overdue_payments(app: Flask, batch_size: Optional[int] = None) -> int:
 	with app.app_context():
+		batch_size = batch_size or int(os.getenv("OVERDUE_BATCH_SIZE", "1000"))
 		today = date.today()
-		to_overdue = Payment.query.filter(
-			Payment.status == "pending",
-			Payment.scheduled_date < today,
-		).all()
-		for payment in to_overdue:
-			payment.status = "overdue"
-		db.session.commit()
\ No newline at end of file
+		total = 0
+		# Flip statuses in bounded chunks so no ORM rows are loaded and each
+		# write transaction (and SQLite write lock) stays short
+		while True:
+			due = (Payment.status == "pending", Payment.scheduled_date < today)
+			chunk_ids = db.session.execute(select(Payment.id).where(*due).limit(batch_size)).scalars().all()
+			if not chunk_ids:
+				break
+			in_chunk = (Payment.id.in_(chunk_ids), Payment.status == "pending")
+			moved = db.session.execute(
+				select(
+					Payment.scheduled_date,
+					func.count(Payment.id),
+					func.sum(Payment.scheduled_amount_cents),
+					func.sum(func.coalesce(Payment.paid_amount_cents, 0)),
+				)
+				.where(*in_chunk)
+				.group_by(Payment.scheduled_date)
+			).all()
+			result = db.session.execute(
+				update(Payment)
+				.where(*in_chunk)
+				.values(status="overdue")
+				.execution_options(synchronize_session=False)
+			)
+			rollups.record_status_change(db.session.connection(), "pending", "overdue", moved)
+			db.session.commit()
+			total += result.rowcount
+			if len(chunk_ids) < batch_size:
+				break
+		logger.info("Marked %s payments overdue", total)
+		return total
+
+
+def _refresh_xero_token(app: Flask) -> bool:
+	with app.app_context():
+		try:
+			return XeroClient().refresh_if_expiring()
+		except RuntimeError:
+			# Xero not connected yet
+			return False
+
+
+def _drain_outbox(app: Flask) -> dict:
+	with app.app_context():
+		counts = drain_outbox()
+		job_runs.note_errors(counts["retried"] + counts["failed"])
+		return counts
+
+
+def _apply_webhook_events(app: Flask) -> dict:
+	with app.app_context():
+		counts = drain_inbox()
+		job_runs.note_errors(counts["ignored"])
+		return counts
+
+
+def _evict_webhook_events(app: Flask) -> int:
+	with app.app_context():
+		return evict_processed()
+
+
+def _prune_job_runs(app: Flask) -> int:
+	with app.app_context():
+		return job_runs.prune()
+
+
+def _reconcile_payment_rollups(app: Flask) -> int:
+	with app.app_context():
+		with db.engine.begin() as conn:
+			return rollups.reconcile(conn) + rollups.reconcile_bookings(conn)
+
+
+def _expand_payment_schedules(app: Flask) -> int:
+	with app.app_context():
+		return expand_schedules()
+
+
+# Job id -> (function, minimum gap between two runs). Every process that runs
+# a scheduler fires each job, but only the one that takes the lease executes
+# it; the gap (about half the job's period) turns the lease into
+# once-per-tick even with clock skew between hosts.
+_JOBS = {
+	"expand_payment_schedules": (_expand_payment_schedules, timedelta(hours=12)),
+	"create_invoices_2_days_prior": (_create_invoices_for_upcoming_payments, timedelta(hours=12)),
+	"mark_overdue_payments": (_mark_overdue_payments, timedelta(hours=12)),
+	"reconcile_payment_rollups": (_reconcile_payment_rollups, timedelta(hours=12)),
+	"drain_outbox": (_drain_outbox, timedelta(seconds=int(os.getenv("OUTBOX_POLL_SECONDS", "10")) / 2)),
+	"apply_webhook_events": (_apply_webhook_events, timedelta(seconds=int(os.getenv("WEBHOOK_POLL_SECONDS", "2")) / 2)),
+	"evict_webhook_events": (_evict_webhook_events, timedelta(hours=12)),
+	"prune_job_runs": (_prune_job_runs, timedelta(hours=12)),
+	"refresh_xero_token": (_refresh_xero_token, timedelta(minutes=2)),
+}
+
+
+def run_exclusive(app: Flask, job_id: str):
+	func, min_gap = _JOBS[job_id]
+	with app.app_context():
+		if not leader.try_acquire(job_id, min_gap):
+			logger.debug("Skipping %s: another process holds the lease or ran it recently", job_id)
+			return None
+		try:
+			with job_runs.track_run(job_id) as stats:
+				result = func(app)
+				stats.set_result(result)
+			return result
+		finally:
+			leader.release(job_id)
+
+
+# The app the scheduler in this process runs jobs against. Jobs are persisted
+# in the SQLAlchemy job store, so their args must be picklable: they carry
+# only the job id and find the app here.
+_app: Optional[Flask] = None
+
+
+def run_scheduled_job(job_id: str):
+	if _app is None:
+		raise RuntimeError("Scheduler app is not initialised; call start_scheduler first")
+	return run_exclusive(_app, job_id)
+
+
+_JOBSTORE_TABLE = "apscheduler_jobs"
+
+
+def _persisted_next_run_times(app: Flask) -> dict:
+	with app.app_context():
+		if not inspect(db.engine).has_table(_JOBSTORE_TABLE):
+			return {}
+		with db.engine.connect() as conn:
+			rows = conn.execute(text(f"SELECT id, next_run_time FROM {_JOBSTORE_TABLE}")).all()
+	return {
+		job_id: datetime.fromtimestamp(next_run_time, timezone.utc)
+		for job_id, next_run_time in rows
+		if next_run_time is not None
+	}
+
+
+def start_scheduler(app: Flask, scheduler: BaseScheduler) -> BaseScheduler:
+	global _app
+	_app = app
+	jobstores = {}
+	persisted = {}
+	if os.getenv("SCHEDULER_JOBSTORE", "sqlalchemy") == "sqlalchemy":
+		# Persists next run times across restarts so missed runs are caught up
+		jobstores["default"] = SQLAlchemyJobStore(
+			url=app.config["SQLALCHEMY_DATABASE_URI"],
+			tablename=_JOBSTORE_TABLE,
+		)
+		persisted = _persisted_next_run_times(app)
+	scheduler.configure(
+		jobstores=jobstores,
+		job_defaults={
+			# Run a missed job once on startup rather than once per missed tick
+			"coalesce": True,
+			"misfire_grace_time": int(os.getenv("SCHEDULER_MISFIRE_GRACE_SECONDS", "3600")),
+			"max_instances": 1,
+		},
+	)
+	schedule_jobs(scheduler, app)
+	# replace_existing would otherwise reset next_run_time to the next future
+	# fire time and silently drop a run missed while the process was down
+	for job_id, next_run_time in persisted.items():
+		if scheduler.get_job(job_id):
+			scheduler.modify_job(job_id, next_run_time=next_run_time)
+	scheduler.start()
+	return scheduler
\ No newline at end of file
@@ -0,0 +1,102 @@
+from sqlalchemy import and_, literal_column, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import joinedload
+from . import db
+from .models import Booking
+
+# Customer search over bookings.customer_name, email and phone.
+# SQLite: an external-content FTS5 table with the trigram tokenizer (substring
+# matches, SQLite >= 3.34), kept in sync by triggers on bookings.
+# Postgres: a pg_trgm GIN expression index queried with ILIKE.
+
+_SQLITE_DDL = [
+	"""
+	CREATE VIRTUAL TABLE IF NOT EXISTS bookings_search USING fts5(
+		customer_name, email, phone,
+		content='bookings', content_rowid='id', tokenize='trigram'
+	)
+	""",
+	"""
+	CREATE TRIGGER IF NOT EXISTS bookings_search_ai AFTER INSERT ON bookings BEGIN
+		INSERT INTO bookings_search(rowid, customer_name, email, phone)
+		VALUES (new.id, new.customer_name, new.email, new.phone);
+	END
+	""",
+	"""
+	CREATE TRIGGER IF NOT EXISTS bookings_search_ad AFTER DELETE ON bookings BEGIN
+		INSERT INTO bookings_search(bookings_search, rowid, customer_name, email, phone)
+		VALUES ('delete', old.id, old.customer_name, old.email, old.phone);
+	END
+	""",
+	"""
+	CREATE TRIGGER IF NOT EXISTS bookings_search_au AFTER UPDATE OF customer_name, email, phone ON bookings BEGIN
+		INSERT INTO bookings_search(bookings_search, rowid, customer_name, email, phone)
+		VALUES ('delete', old.id, old.customer_name, old.email, old.phone);
+		INSERT INTO bookings_search(rowid, customer_name, email, phone)
+		VALUES (new.id, new.customer_name, new.email, new.phone);
+	END
+	""",
+	# Index bookings that existed before the search table
+	"INSERT INTO bookings_search(bookings_search) VALUES ('rebuild')",
+]
+
+_POSTGRES_SEARCH_EXPR = "(customer_name || ' ' || email || ' ' || phone)"
+
+_POSTGRES_DDL = [
+	"CREATE EXTENSION IF NOT EXISTS pg_trgm",
+	f"CREATE INDEX IF NOT EXISTS ix_bookings_search_trgm ON bookings USING gin ({_POSTGRES_SEARCH_EXPR} gin_trgm_ops)",
+]
+
+# Trigram matching needs at least three characters per term
+MIN_TERM_LENGTH = 3
+
+
+def install_search_index(conn: Connection) -> None:
+	if conn.dialect.name == "sqlite":
+		statements = _SQLITE_DDL
+	elif conn.dialect.name == "postgresql":
+		statements = _POSTGRES_DDL
+	else:
+		return
+	for statement in statements:
+		conn.execute(text(statement))
+
+
+def _terms(query: str) -> list[str]:
+	return [term for term in query.split() if len(term) >= MIN_TERM_LENGTH]
+
+
+def _escape_like(term: str) -> str:
+	return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_bookings(query: str, limit: int = 50) -> list[Booking]:
+	terms = _terms(query)
+	if not terms:
+		return []
+	dialect = db.engine.dialect.name
+
+	if dialect == "sqlite":
+		# Quote each term so FTS5 treats it literally; space-separated terms are ANDed
+		match = " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+		ids = db.session.execute(
+			text("SELECT rowid FROM bookings_search WHERE bookings_search MATCH :match ORDER BY rank LIMIT :limit"),
+			{"match": match, "limit": limit},
+		).scalars().all()
+		if not ids:
+			return []
+		bookings = Booking.query.options(joinedload(Booking.payment_schedule)).filter(Booking.id.in_(ids)).all()
+		by_id = {booking.id: booking for booking in bookings}
+		return [by_id[booking_id] for booking_id in ids if booking_id in by_id]
+
+	# Same expression as the Postgres GIN index so the planner can use it
+	space = literal_column("' '")
+	haystack = Booking.customer_name.concat(space).concat(Booking.email).concat(space).concat(Booking.phone)
+	conditions = [haystack.ilike(f"%{_escape_like(term)}%", escape="\\") for term in terms]
+	return (
+		Booking.query.options(joinedload(Booking.payment_schedule))
+		.filter(and_(*conditions))
+		.order_by(Booking.created_at.desc(), Booking.id.desc())
+		.limit(limit)
+		.all()
+	)
@@ -0,0 +1,32 @@
+import hmac
+import hashlib
+from typing import Optional
+
+
+class SignatureVerifier:
+	# HMAC-SHA256 over the raw request body, hex encoded (optionally prefixed
+	# "sha256="). The key is absorbed once here; each request copies that
+	# keyed state instead of re-deriving the padded key.
+	def __init__(self, secret: bytes, chunk_size: int = 64 * 1024):
+		self._keyed = hmac.new(secret, digestmod=hashlib.sha256)
+		self.chunk_size = chunk_size
+
+	def read_verified(self, stream, signature: Optional[str]) -> Optional[bytes]:
+		# Hashes the body while reading it, so it is read exactly once and
+		# never parsed before it is trusted. Returns the body, or None if the
+		# signature is missing or wrong.
+		mac = self._keyed.copy()
+		chunks = []
+		while True:
+			chunk = stream.read(self.chunk_size)
+			if not chunk:
+				break
+			mac.update(chunk)
+			chunks.append(chunk)
+		if not signature:
+			return None
+		expected = mac.hexdigest().encode()
+		provided = signature.strip().removeprefix("sha256=").lower().encode("utf-8", "replace")
+		if not hmac.compare_digest(expected, provided):
+			return None
+		return chunks[0] if len(chunks) == 1 else b"".join(chunks)
\ No newline at end of file
@@ -0,0 +1,69 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from .job_runs import note_api_call
+
+# One pooled, keep-alive session per provider, shared by every client in the process
+_sessions: dict[str, requests.Session] = {}
+_adapters: dict[str, HTTPAdapter] = {}
+_lock = threading.Lock()
+
+
+def _setting(provider: str, name: str, default: str) -> str:
+	# Provider-specific override (e.g. XERO_POOL_SIZE) falls back to HTTP_<name>
+	return os.getenv(f"{provider.upper()}_{name}") or os.getenv(f"HTTP_{name}", default)
+
+
+def _count_api_call(response, *args, **kwargs):
+	note_api_call()
+	return response
+
+
+def get_session(provider: str) -> requests.Session:
+	session = _sessions.get(provider)
+	if session is not None:
+		return session
+	with _lock:
+		session = _sessions.get(provider)
+		if session is None:
+			pool_size = int(_setting(provider, "POOL_SIZE", "10"))
+			adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+			session = requests.Session()
+			# Attributes provider calls to the scheduler job run in progress, if any
+			session.hooks["response"].append(_count_api_call)
+			session.mount("https://", adapter)
+			session.mount("http://", adapter)
+			_adapters[provider] = adapter
+			_sessions[provider] = session
+	return session
+
+
+def get_timeout(provider: str) -> tuple[float, float]:
+	return (
+		float(_setting(provider, "CONNECT_TIMEOUT", "5")),
+		float(_setting(provider, "READ_TIMEOUT", "30")),
+	)
+
+
+def transport_stats() -> dict:
+	stats = {}
+	with _lock:
+		adapters = dict(_adapters)
+	for provider, adapter in adapters.items():
+		pools = adapter.poolmanager.pools
+		requests_sent = 0
+		new_connections = 0
+		for key in pools.keys():
+			pool = pools.get(key)
+			if pool is None:
+				continue
+			requests_sent += pool.num_requests
+			new_connections += pool.num_connections
+		stats[provider] = {
+			"pool_size": adapter._pool_maxsize,
+			"requests": requests_sent,
+			"new_connections": new_connections,
+			"pool_hits": max(requests_sent - new_connections, 0),
+		}
+	return stats
@@ -0,0 +1,65 @@
+from typing import Optional, Sequence, Union
+from sqlalchemy import Table, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import IntegrityError
+
+# Conflict-tolerant writes. SQLite and Postgres get native ON CONFLICT
+# statements; other databases fall back to a savepoint (or UPDATE then
+# INSERT) per row.
+
+
+def _native_insert(conn: Connection):
+	dialect = conn.dialect.name
+	if dialect == "sqlite":
+		return sqlite.insert
+	if dialect == "postgresql":
+		return postgresql.insert
+	return None
+
+
+def insert_ignore(conn: Connection, table: Table, values: Union[dict, list[dict]], index_elements: Sequence[str]) -> Optional[int]:
+	# Inserts rows, skipping any that conflict on index_elements. For a single
+	# row (a dict), returns its new primary key, or None when it already existed
+	if not values:
+		return None
+	single = isinstance(values, dict)
+	insert = _native_insert(conn)
+	if insert is not None:
+		stmt = insert(table).on_conflict_do_nothing(index_elements=list(index_elements))
+		if single:
+			result = conn.execute(stmt.values(**values))
+			return result.inserted_primary_key[0] if result.rowcount == 1 else None
+		conn.execute(stmt, values)
+		return None
+	for row in [values] if single else values:
+		try:
+			with conn.begin_nested():
+				result = conn.execute(table.insert().values(**row))
+		except IntegrityError:
+			if single:
+				return None
+			continue
+		if single:
+			return result.inserted_primary_key[0]
+	return None
+
+
+def upsert_add(conn: Connection, table: Table, row: dict, index_elements: Sequence[str], counters: Sequence[str]) -> None:
+	# Inserts row, or adds its counter columns onto the existing row with the
+	# same index_elements
+	insert = _native_insert(conn)
+	if insert is not None:
+		stmt = insert(table).values(**row)
+		conn.execute(stmt.on_conflict_do_update(
+			index_elements=list(index_elements),
+			set_={name: table.c[name] + stmt.excluded[name] for name in counters},
+		))
+		return
+	result = conn.execute(
+		update(table)
+		.where(*(table.c[name] == row[name] for name in index_elements))
+		.values({name: table.c[name] + row[name] for name in counters})
+	)
+	if result.rowcount == 0:
+		conn.execute(table.insert().values(**row))
\ No newline at end of file
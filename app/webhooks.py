@@ -1,35 +1,126 @@
-from flask import Blueprint, request, jsonify
-from datetime import date
-from . import db
-from .models import Payment
+import os
+import json
+from typing import Optional
+from flask import Blueprint, current_app, request, jsonify
+from . import db, event_log, inbox
+from .payment_events import apply_events_bulk, parse_event, recent_events
 
 webhooks_bp = Blueprint("webhooks", __name__)
 
 
+def _read_body() -> Optional[str]:
+	# Returns the raw body, or None when the signature check fails
+	verifier = current_app.extensions.get("payadvantage_webhook_verifier")
+	if verifier is None:
+		data = request.get_data()
+	else:
+		data = verifier.read_verified(
+			request.stream,
+			request.headers.get(current_app.config["PAYADVANTAGE_WEBHOOK_SIGNATURE_HEADER"]),
+		)
+		if data is None:
+			return None
+	try:
+		return data.decode("utf-8")
+	except UnicodeDecodeError:
+		raise ValueError("body is not UTF-8")
+
+
 @webhooks_bp.route("/payadvantage", methods=["POST"])
 def payadvantage_webhook():
-	payload = request.get_json(silent=True) or {}
-	provider_payment_id = payload.get("payment_id")
-	status = payload.get("status")  # expected: pending, complete, overdue
-	paid_amount_cents = payload.get("paid_amount_cents")
-	paid_date_str = payload.get("paid_date")  # YYYY-MM-DD
-
-	if not provider_payment_id:
-		return jsonify({"error": "missing payment_id"}), 400
-
-	payment = Payment.query.filter_by(provider_payment_id=provider_payment_id).first()
-	if not payment:
-		return jsonify({"error": "payment not found"}), 404
-
-	if status:
-		payment.status = status
-	if paid_amount_cents is not None:
-		payment.paid_amount_cents = int(paid_amount_cents)
-	if paid_date_str:
+	# Stores the raw event and returns; the apply_webhook_events job applies it
+	try:
+		body = _read_body()
+		if body is None:
+			return jsonify({"error": "invalid signature"}), 401
+		event = parse_event(body)
+	except ValueError as exc:
+		return jsonify({"error": str(exc)}), 400
+
+	# Redeliveries are acknowledged without a write: first from this process's
+	# recent-events cache, then from the inbox's unique (provider, event_id)
+	if event["event_id"] in recent_events:
+		return jsonify({"ok": True, "duplicate": True})
+	row_id = inbox.append("payadvantage", event["event_id"], body)
+	if row_id is not None:
+		# Logged before the commit so the log is never behind the inbox
+		event_log.append("payadvantage", [body])
+	db.session.commit()
+	recent_events.add(event["event_id"])
+	if row_id is None:
+		return jsonify({"ok": True, "duplicate": True})
+	return jsonify({"ok": True, "event_id": row_id}), 202
+
+
+def _split_batch(body: str) -> list:
+	# A JSON array of events, or NDJSON with one event per line. NDJSON lines
+	# stay raw so a bad line fails only its own event.
+	if body.lstrip().startswith("["):
 		try:
-			payment.paid_date = date.fromisoformat(paid_date_str)
+			events = json.loads(body)
 		except ValueError:
-			pass
+			raise ValueError("invalid JSON")
+		if not isinstance(events, list):
+			raise ValueError("expected a JSON array")
+		return events
+	return [line for line in body.splitlines() if line.strip()]
 
+
+@webhooks_bp.route("/payadvantage/batch", methods=["POST"])
+def payadvantage_webhook_batch():
+	# Applies the events synchronously, in order, in one transaction and
+	# reports an outcome per event
+	try:
+		body = _read_body()
+		if body is None:
+			return jsonify({"error": "invalid signature"}), 401
+		raw_events = _split_batch(body)
+	except ValueError as exc:
+		return jsonify({"error": str(exc)}), 400
+	max_events = int(os.getenv("WEBHOOK_BATCH_MAX_EVENTS", "100000"))
+	if len(raw_events) > max_events:
+		return jsonify({"error": f"batch exceeds {max_events} events"}), 413
+
+	results: list[dict] = []
+	parsed: list[tuple[dict, dict, str]] = []
+	for index, raw in enumerate(raw_events):
+		try:
+			event = parse_event(raw)
+		except ValueError as exc:
+			results.append({"index": index, "outcome": "invalid", "error": str(exc)})
+			continue
+		result = {"index": index, "event_id": event["event_id"], "payment_id": event["payment_id"]}
+		results.append(result)
+		parsed.append((result, event, raw if isinstance(raw, str) else json.dumps(raw)))
+
+	# Same dedup as the single-event endpoint: this process's recent-events
+	# cache, then the inbox's unique (provider, event_id)
+	stored = inbox.existing_event_ids(
+		"payadvantage", {event["event_id"] for _, event, _ in parsed if event["event_id"] not in recent_events}
+	)
+	pending: list[tuple[dict, dict, str]] = []
+	seen: set[str] = set()
+	for result, event, body in parsed:
+		event_id = event["event_id"]
+		if event_id in seen or event_id in recent_events or event_id in stored:
+			result["outcome"] = "duplicate"
+			continue
+		seen.add(event_id)
+		pending.append((result, event, body))
+
+	outcomes = apply_events_bulk([event for _, event, _ in pending])
+	# Stored as processed inbox rows in the same transaction as the payment updates
+	inbox.record_processed(
+		"payadvantage", [(event["event_id"], body, outcome) for (_, event, body), outcome in zip(pending, outcomes)]
+	)
+	event_log.append("payadvantage", [body for _, _, body in pending])
 	db.session.commit()
-	return jsonify({"ok": True})
\ No newline at end of file
+	for (result, _, _), outcome in zip(pending, outcomes):
+		result["outcome"] = outcome
+	for event_id in seen:
+		recent_events.add(event_id)
+
+	counts: dict[str, int] = {}
+	for result in results:
+		counts[result["outcome"]] = counts.get(result["outcome"], 0) + 1
+	return jsonify({"ok": True, "counts": counts, "results": results})
\ No newline at end of file
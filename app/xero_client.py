@@ -1,95 +1,340 @@
 import os
+import time
 import uuid
+import threading
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-import requests
-from . import db
+from typing import Optional
+from sqlalchemy import select, text, update
+from . import db, idempotency, leader, resilience
 from .models import XeroAuth
+from .dispatch import get_throttle
+from .transport import get_session, get_timeout
+
+
+# Process-wide access token cache keyed by tenant id; entries expire at the
+# token's access_token_expires_at
+_token_cache: dict[str, tuple[str, datetime]] = {}
+_active_tenant: Optional[str] = None
+# Single-flight guard so only one thread per process talks to the identity endpoint
+_refresh_lock = threading.Lock()
+# Cross-process guard: a Postgres advisory lock, or a job_leases row on SQLite
+_REFRESH_ADVISORY_LOCK_ID = 7_302_011
+_REFRESH_LEASE = "xero_token_refresh"
+
+
+def reset_token_cache() -> None:
+	global _active_tenant
+	with _refresh_lock:
+		_token_cache.clear()
+		_active_tenant = None
+
+
+@contextmanager
+def _cross_process_lock():
+	# Yields whether this process may refresh. Neither lock holds a transaction
+	# open while the identity call runs
+	if db.engine.dialect.name == "postgresql":
+		with db.engine.connect() as conn:
+			conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+			acquired = conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": _REFRESH_ADVISORY_LOCK_ID}).scalar()
+			try:
+				yield acquired
+			finally:
+				if acquired:
+					conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": _REFRESH_ADVISORY_LOCK_ID})
+		return
+	# The lease expires on its own if the holder dies mid-refresh
+	acquired = leader.try_acquire(_REFRESH_LEASE, min_gap=timedelta(0), ttl=timedelta(seconds=60))
+	try:
+		yield acquired
+	finally:
+		if acquired:
+			leader.release(_REFRESH_LEASE)
 
 
 class XeroClient:
 	def __init__(self):
-		self.identity_url = "https://identity.xero.com/connect/token"
+		self.identity_url = os.getenv("XERO_IDENTITY_URL", "https://identity.xero.com/connect/token")
 		self.api_base = os.getenv("XERO_API_BASE", "https://api.xero.com/api.xro/2.0")
 		self.client_id = os.getenv("XERO_CLIENT_ID")
 		self.client_secret = os.getenv("XERO_CLIENT_SECRET")
 		self.sales_account_code = os.getenv("XERO_SALES_ACCOUNT_CODE", "200")
+		self.session = get_session("xero")
+		self.timeout = get_timeout("xero")
+		# Per-minute and concurrent-call limits shared by every caller in the process
+		self.throttle = get_throttle("xero")
+		# Xero accepts up to 50 invoices per POST /Invoices
+		self.batch_size = min(int(os.getenv("XERO_INVOICE_BATCH_SIZE", "50")), 50)
+		# Background refresh renews tokens this many seconds before they expire
+		self.refresh_margin = int(os.getenv("XERO_TOKEN_REFRESH_MARGIN", "600"))
 
-	def _get_auth_row(self) -> XeroAuth:
-		xero_auth = XeroAuth.query.first()
-		if not xero_auth or not xero_auth.refresh_token or not xero_auth.tenant_id:
-			raise RuntimeError("Xero is not connected. Please connect in Admin.")
-		return xero_auth
+	def _cached_token(self, margin: int = 0) -> Optional[tuple[str, str]]:
+		tenant_id = _active_tenant
+		cached = _token_cache.get(tenant_id) if tenant_id else None
+		if cached and cached[1] - timedelta(seconds=margin) > datetime.utcnow():
+			return cached[0], tenant_id
+		return None
 
 	def _ensure_access_token(self) -> tuple[str, str]:
-		xero_auth = self._get_auth_row()
-		# If token missing or expired, refresh
-		if (
-			not xero_auth.access_token
-			or not xero_auth.access_token_expires_at
-			or xero_auth.access_token_expires_at <= datetime.utcnow()
-		):
-			resp = requests.post(
-				self.identity_url,
-				data={
-					"grant_type": "refresh_token",
-					"refresh_token": xero_auth.refresh_token,
-					"client_id": self.client_id,
-					"client_secret": self.client_secret,
-				},
-				timeout=30,
+		token = self._cached_token()
+		if token:
+			return token
+		with _refresh_lock:
+			# Another thread may have refreshed while we waited
+			return self._cached_token() or self._load_or_refresh()
+
+	def refresh_if_expiring(self) -> bool:
+		if self._cached_token(margin=self.refresh_margin):
+			return False
+		with _refresh_lock:
+			if self._cached_token(margin=self.refresh_margin):
+				return False
+			self._load_or_refresh(margin=self.refresh_margin)
+			return True
+
+	def _read_auth_row(self, conn):
+		row = conn.execute(select(XeroAuth.__table__).limit(1)).mappings().first()
+		if not row or not row["refresh_token"] or not row["tenant_id"]:
+			raise RuntimeError("Xero is not connected. Please connect in Admin.")
+		return row
+
+	def _load_or_refresh(self, margin: int = 0) -> tuple[str, str]:
+		global _active_tenant
+		with db.engine.connect() as conn:
+			row = self._read_auth_row(conn)
+		deadline = time.monotonic() + float(os.getenv("XERO_TOKEN_REFRESH_WAIT_SECONDS", "15"))
+		while not self._is_fresh(row, margin):
+			with _cross_process_lock() as acquired:
+				if acquired:
+					# Re-read under the lock: another process may have refreshed already
+					row = self._refresh_and_store(margin)
+					break
+			# Another process is refreshing; wait for its tokens rather than
+			# spending (and invalidating) the same refresh token
+			if time.monotonic() > deadline:
+				raise RuntimeError("Timed out waiting for another process to refresh the Xero token")
+			time.sleep(0.2)
+			with db.engine.connect() as conn:
+				row = self._read_auth_row(conn)
+		_token_cache[row["tenant_id"]] = (row["access_token"], row["access_token_expires_at"])
+		_active_tenant = row["tenant_id"]
+		return row["access_token"], row["tenant_id"]
+
+	def _refresh_and_store(self, margin: int):
+		with db.engine.connect() as conn:
+			row = self._read_auth_row(conn)
+		if self._is_fresh(row, margin):
+			return row
+		# The identity call runs outside any transaction so it never holds a
+		# database lock; the compare-and-set on refresh_token is a last guard
+		# against a writer that does not take the refresh lock (e.g. a reconnect)
+		values = self._refresh(row)
+		table = XeroAuth.__table__
+		with db.engine.begin() as conn:
+			stored = conn.execute(
+				update(table)
+				.where(table.c.id == row["id"], table.c.refresh_token == row["refresh_token"])
+				.values(**values)
 			)
-			resp.raise_for_status()
-			data = resp.json()
-			xero_auth.access_token = data.get("access_token")
-			xero_auth.refresh_token = data.get("refresh_token", xero_auth.refresh_token)
-			expires_in = int(data.get("expires_in", 1800))
-			xero_auth.access_token_expires_at = datetime.utcnow() + timedelta(seconds=expires_in - 60)
-			xero_auth.scope = data.get("scope", xero_auth.scope)
-			db.session.commit()
-		return xero_auth.access_token, xero_auth.tenant_id
-
-	def create_invoice(self, contact_name: str, email: str, amount_cents: int, due_date, description: str) -> dict:
-		access_token, tenant_id = self._ensure_access_token()
-		amount = round(amount_cents / 100.0, 2)
-		payload = {
-			"Type": "ACCREC",
-			"Contact": {
-				"Name": contact_name,
-				"EmailAddress": email,
-			},
-			"Date": datetime.utcnow().date().isoformat(),
-			"DueDate": due_date.isoformat(),
-			"LineAmountTypes": "Exclusive",
-			"LineItems": [
-				{
-					"Description": description,
-					"Quantity": 1.0,
-					"UnitAmount": amount,
-					"AccountCode": self.sales_account_code,
-				}
-			],
-			"Status": "DRAFT",
-		}
-		resp = requests.post(
-			f"{self.api_base}/Invoices",
-			headers={
-				"Authorization": f"Bearer {access_token}",
-				"Xero-tenant-id": tenant_id,
-				"Accept": "application/json",
-				"Content-Type": "application/json",
+			if stored.rowcount == 1:
+				return {**row, **values}
+			return self._read_auth_row(conn)
+
+	def _is_fresh(self, row, margin: int) -> bool:
+		return bool(
+			row["access_token"]
+			and row["access_token_expires_at"]
+			and row["access_token_expires_at"] - timedelta(seconds=margin) > datetime.utcnow()
+		)
+
+	def _refresh(self, row) -> dict:
+		# Refresh tokens rotate, so a refresh is only retried if it never reached Xero
+		resp = self._post(
+			self.identity_url,
+			throttled=False,
+			data={
+				"grant_type": "refresh_token",
+				"refresh_token": row["refresh_token"],
+				"client_id": self.client_id,
+				"client_secret": self.client_secret,
 			},
-			json={"Invoices": [payload]},
-			timeout=30,
 		)
-		resp.raise_for_status()
 		data = resp.json()
-		invoice = (data.get("Invoices") or [{}])[0]
-		invoice_id = invoice.get("InvoiceID") or str(uuid.uuid4())
+		expires_in = int(data.get("expires_in", 1800))
 		return {
-			"invoice_id": invoice_id,
+			"access_token": data.get("access_token"),
+			"refresh_token": data.get("refresh_token", row["refresh_token"]),
+			"access_token_expires_at": datetime.utcnow() + timedelta(seconds=expires_in - 60),
+			"scope": data.get("scope", row["scope"]),
+		}
+
+	def _post(self, url: str, idempotent: bool = False, throttled: bool = True, **kwargs):
+		# One POST behind the Xero circuit breaker and retry policy; API calls
+		# (not identity calls) also take a rate-limiter slot per attempt
+		def send():
+			if throttled:
+				with self.throttle.slot():
+					resp = self.session.post(url, timeout=self.timeout, **kwargs)
+			else:
+				resp = self.session.post(url, timeout=self.timeout, **kwargs)
+			resp.raise_for_status()
+			return resp
+		return resilience.call("xero", send, idempotent=idempotent)
+
+	def create_invoice(
+		self,
+		contact_name: str,
+		email: str,
+		amount_cents: int,
+		due_date,
+		description: str,
+		idempotency_key: Optional[str] = None,
+	) -> dict:
+		if idempotency_key:
+			stored = idempotency.lookup(idempotency_key)
+			if stored:
+				return stored
+		access_token, tenant_id = self._ensure_access_token()
+		resp = self._post(
+			f"{self.api_base}/Invoices",
+			# Xero replays the original response for a repeated key
+			idempotent=bool(idempotency_key),
+			headers=api_headers(access_token, tenant_id, idempotency_key),
+			json={"Invoices": [invoice_payload(contact_name, email, amount_cents, due_date, description, self.sales_account_code)]},
+		)
+		result = single_invoice_result(resp.json(), contact_name, email, amount_cents, due_date, description)
+		if idempotency_key:
+			idempotency.store("xero", "create_invoice", idempotency_key, result)
+		return result
+
+	def create_invoices_batch(self, invoices: list[dict]) -> list[dict]:
+		# Each item takes the same keyword arguments as create_invoice. Results are
+		# returned in input order; invoices Xero rejected have invoice_id None and
+		# their validation messages under "errors". Items whose idempotency_key
+		# already has a stored result are answered without a request.
+		results, to_send = split_cached(invoices)
+		for start in range(0, len(to_send), self.batch_size):
+			indexes = to_send[start:start + self.batch_size]
+			chunk = [invoices[index] for index in indexes]
+			access_token, tenant_id = self._ensure_access_token()
+			batch_key = batch_idempotency_key(chunk)
+			resp = self._post(
+				f"{self.api_base}/Invoices",
+				idempotent=bool(batch_key),
+				# Report validation errors per invoice instead of failing the whole batch
+				params={"summarizeErrors": "false"},
+				headers=api_headers(access_token, tenant_id, batch_key),
+				json={"Invoices": [invoice_payload(**_payload_args(item), account_code=self.sales_account_code) for item in chunk]},
+			)
+			chunk_results, created = batch_results(chunk, resp.json())
+			for index, result in zip(indexes, chunk_results):
+				results[index] = result
+			idempotency.store_many("xero", "create_invoice", created)
+		return results
+
+
+# Request and response handling shared by XeroClient and AsyncXeroClient
+
+def api_headers(access_token: str, tenant_id: str, idempotency_key: Optional[str] = None) -> dict:
+	headers = {
+		"Authorization": f"Bearer {access_token}",
+		"Xero-tenant-id": tenant_id,
+		"Accept": "application/json",
+		"Content-Type": "application/json",
+	}
+	if idempotency_key:
+		headers[idempotency.HEADER] = idempotency_key
+	return headers
+
+
+def invoice_payload(contact_name: str, email: str, amount_cents: int, due_date, description: str, account_code: str) -> dict:
+	amount = round(amount_cents / 100.0, 2)
+	return {
+		"Type": "ACCREC",
+		"Contact": {
+			"Name": contact_name,
+			"EmailAddress": email,
+		},
+		"Date": datetime.utcnow().date().isoformat(),
+		"DueDate": due_date.isoformat(),
+		"LineAmountTypes": "Exclusive",
+		"LineItems": [
+			{
+				"Description": description,
+				"Quantity": 1.0,
+				"UnitAmount": amount,
+				"AccountCode": account_code,
+			}
+		],
+		"Status": "DRAFT",
+	}
+
+
+def _payload_args(item: dict) -> dict:
+	return {name: item[name] for name in ("contact_name", "email", "amount_cents", "due_date", "description")}
+
+
+def single_invoice_result(data: dict, contact_name: str, email: str, amount_cents: int, due_date, description: str) -> dict:
+	invoice = (data.get("Invoices") or [{}])[0]
+	invoice_id = invoice.get("InvoiceID") or str(uuid.uuid4())
+	return {
+		"invoice_id": invoice_id,
+		"status": invoice.get("Status", "DRAFT"),
+		"amount_cents": amount_cents,
+		"due_date": due_date.isoformat(),
+		"description": description,
+		"to": {"name": contact_name, "email": email},
+	}
+
+
+def split_cached(invoices: list[dict]) -> tuple[list[Optional[dict]], list[int]]:
+	# Fills in stored results for items whose idempotency key has one; returns
+	# the results so far and the indexes that still need a request
+	results: list[Optional[dict]] = [None] * len(invoices)
+	stored = idempotency.lookup_many(
+		item["idempotency_key"] for item in invoices if item.get("idempotency_key")
+	)
+	to_send = []
+	for index, item in enumerate(invoices):
+		cached = stored.get(item.get("idempotency_key"))
+		if cached:
+			results[index] = cached
+		else:
+			to_send.append(index)
+	return results, to_send
+
+
+def batch_idempotency_key(chunk: list[dict]) -> Optional[str]:
+	# A rerun sends the same remaining payments in the same chunks, so the
+	# batch key repeats with them
+	keys = [item.get("idempotency_key") for item in chunk]
+	return idempotency.make_key("xero-invoice-batch", *keys) if all(keys) else None
+
+
+def batch_results(chunk: list[dict], data: dict) -> tuple[list[dict], dict[str, dict]]:
+	# Returns the chunk's results and the successful ones by idempotency key
+	returned = data.get("Invoices") or []
+	if len(returned) != len(chunk):
+		raise RuntimeError(
+			f"Xero returned {len(returned)} invoices for a batch of {len(chunk)}"
+		)
+	results = []
+	created = {}
+	# Xero preserves request order, so results map back to inputs by position
+	for item, invoice in zip(chunk, returned):
+		errors = [e.get("Message") for e in invoice.get("ValidationErrors") or []]
+		failed = bool(errors) or invoice.get("StatusAttributeString") == "ERROR"
+		result = {
+			"invoice_id": None if failed else invoice.get("InvoiceID"),
 			"status": invoice.get("Status", "DRAFT"),
-			"amount_cents": amount_cents,
-			"due_date": due_date.isoformat(),
-			"description": description,
-			"to": {"name": contact_name, "email": email},
-		}
\ No newline at end of file
+			"amount_cents": item["amount_cents"],
+			"due_date": item["due_date"].isoformat(),
+			"description": item["description"],
+			"to": {"name": item["contact_name"], "email": item["email"]},
+			"errors": errors,
+		}
+		results.append(result)
+		if result["invoice_id"] and item.get("idempotency_key"):
+			created[item["idempotency_key"]] = result
+	return results, created
\ No newline at end of file
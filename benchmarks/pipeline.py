@@ -0,0 +1,323 @@
+"""End-to-end benchmarks for the booking-to-payment pipeline.
+
+Run from the repository root:
+
+    python -m benchmarks.pipeline --scale 10k --scale 100k --output results.json
+    python -m benchmarks.pipeline --scale 10k --baseline benchmarks/baseline.json
+
+Each scale seeds a fresh SQLite database with that many payments (see
+benchmarks/seed.py). It then measures the booking form, the admin pages,
+webhook ingest and both scheduler jobs. Provider calls go to an in-process
+simulator (benchmarks/simulators.py) with the latency set by SIM_* settings;
+the default is lognormal:40,0.3 for both providers.
+
+Each scale is run --repeat times (default 3), each time on a freshly seeded
+database. Results are JSON. For each metric, ms_per_op is the median request
+time, or the total time per row for ingest and jobs. The best of the runs is
+kept, which filters out one-off stalls. The fixed event and row counts do not
+depend on --requests.
+
+With --baseline, a metric slower than its baseline by more than --tolerance
+is reported as a regression and the exit status is 1. The benchmark
+parameters are recorded with the results: --requests, --repeat, and the
+SIM_*, XERO_* and INVOICE_* settings. A baseline recorded with different
+parameters is refused. --update-baseline writes the results as the new
+baseline. Baselines are only comparable on the same machine.
+"""
+import os
+import sys
+import hmac
+import json
+import time
+import random
+import shutil
+import hashlib
+import argparse
+import platform
+import sqlite3
+import tempfile
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from statistics import mean, median
+from typing import Callable
+
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+# Fixed so that per-row metrics amortise the same fixed costs on every run
+WEBHOOK_EVENTS = 500
+WEBHOOK_BATCHES = 5
+WEBHOOK_BATCH_EVENTS = 1000
+# Environment settings that change what is measured
+PARAMETER_PREFIXES = ("SIM_", "XERO_CALLS_PER_MINUTE", "XERO_MAX_CONCURRENT_CALLS", "XERO_INVOICE_BATCH_SIZE", "INVOICE_")
+WEBHOOK_SECRET = "benchmark-webhook-secret"
+# Settings for the app under test; anything already in the environment wins
+DEFAULT_ENV = {
+	"SCHEDULER_MODE": "external",
+	"PAYADVANTAGE_API_KEY": "benchmark",
+	"PAYADVANTAGE_WEBHOOK_SECRET": WEBHOOK_SECRET,
+	"XERO_CLIENT_ID": "benchmark",
+	"XERO_CLIENT_SECRET": "benchmark",
+	# Measure the app, not Xero's 60 calls a minute
+	"XERO_CALLS_PER_MINUTE": "100000",
+	"SIM_LATENCY": "lognormal:40,0.3",
+	"SIM_SEED": "1",
+}
+
+
+def _percentile(samples: list[float], fraction: float) -> float:
+	ordered = sorted(samples)
+	return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def _timed_requests(name: str, count: int, send: Callable[[int], object], warmup: int = 5) -> dict:
+	for n in range(warmup):
+		send(n)
+	samples = []
+	for n in range(count):
+		started = time.perf_counter()
+		response = send(warmup + n)
+		samples.append((time.perf_counter() - started) * 1000)
+		if response.status_code >= 400:
+			raise RuntimeError(f"{name}: HTTP {response.status_code}")
+	return {
+		"ms_per_op": round(median(samples), 3),
+		"p95_ms": round(_percentile(samples, 0.95), 3),
+		"mean_ms": round(mean(samples), 3),
+		"ops": count,
+	}
+
+
+def _timed_rows(func: Callable[[], int]) -> dict:
+	started = time.perf_counter()
+	rows = func()
+	seconds = time.perf_counter() - started
+	return {
+		"ms_per_op": round(seconds * 1000 / rows, 4) if rows else None,
+		"seconds": round(seconds, 3),
+		"ops": rows,
+		"per_second": round(rows / seconds, 1) if seconds else None,
+	}
+
+
+def _signature(body: bytes) -> str:
+	return hmac.new(WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+
+
+def _event(rng: random.Random, label: str, number: int, payment_ids: int) -> bytes:
+	payment_id = rng.randint(1, payment_ids)
+	return json.dumps({
+		"event_id": f"bench-{label}-{number}",
+		"payment_id": f"pmt_{payment_id}",
+		"status": "complete",
+		"sequence": number,
+		"paid_amount_cents": 10_000,
+		"paid_date": date.today().isoformat(),
+	}).encode()
+
+
+def run_scale(label: str, payments: int, workdir: Path, requests_per_metric: int, run: int = 1) -> dict:
+	from app import create_app, db
+	from app.inbox import drain_inbox
+	from app.models import XeroAuth
+	from app.scheduler import _create_invoices_for_upcoming_payments, _mark_overdue_payments
+	from app.xero_client import reset_token_cache
+	from benchmarks.seed import seed
+	from benchmarks.simulators import BackgroundSimulator
+
+	# Each run gets its own database and event ids
+	label = f"{label}-run{run}"
+	database = workdir / f"{label}.db"
+	os.environ["DATABASE_URL"] = f"sqlite:///{database.as_posix()}"
+	os.environ["WEBHOOK_LOG_DIR"] = str(workdir / f"{label}-webhook-log")
+	rng = random.Random(1)
+	results = {}
+
+	with BackgroundSimulator() as simulator:
+		os.environ.update(simulator.environment())
+		app = create_app()
+		app.config["WTF_CSRF_ENABLED"] = False
+		rows = seed(app, payments)
+		with app.app_context():
+			db.session.add(XeroAuth(
+				tenant_id="simulated-tenant",
+				access_token="benchmark",
+				refresh_token="benchmark",
+				access_token_expires_at=datetime.utcnow() + timedelta(days=1),
+			))
+			db.session.commit()
+		reset_token_cache()
+		booking_ids = rows["bookings"]
+		client = app.test_client()
+		signature_header = app.config["PAYADVANTAGE_WEBHOOK_SIGNATURE_HEADER"]
+
+		results["booking_post"] = _timed_requests("booking_post", requests_per_metric, lambda n: client.post("/", data={
+			"customer_name": f"Bench Customer {n}",
+			"email": f"bench.{n}@example.com",
+			"phone": "0400000000",
+			"start_date": date.today().isoformat(),
+			"end_date": (date.today() + timedelta(days=30)).isoformat(),
+		}))
+		results["admin_bookings"] = _timed_requests(
+			"admin_bookings", requests_per_metric, lambda n: client.get("/admin/bookings?limit=50")
+		)
+		results["admin_bookings_filtered"] = _timed_requests(
+			"admin_bookings_filtered", requests_per_metric,
+			lambda n: client.get("/admin/bookings?frequency=weekly&schedule=set&limit=50"),
+		)
+		results["admin_report"] = _timed_requests(
+			"admin_report", requests_per_metric, lambda n: client.get("/admin/report")
+		)
+		results["booking_payments"] = _timed_requests(
+			"booking_payments", requests_per_metric,
+			lambda n: client.get(f"/admin/bookings/{rng.randint(1, booking_ids)}/payments"),
+		)
+
+		def post_event(n: int):
+			body = _event(rng, label, n, rows["payments"])
+			return client.post("/webhooks/payadvantage", data=body, content_type="application/json", headers={signature_header: _signature(body)})
+
+		results["webhook_post"] = _timed_requests("webhook_post", WEBHOOK_EVENTS, post_event)
+		results["webhook_apply"] = _timed_rows(lambda: _drain(app, drain_inbox))
+
+		def post_batches() -> int:
+			sent = 0
+			for batch in range(WEBHOOK_BATCHES):
+				bodies = [_event(rng, f"{label}-batch{batch}", n, rows["payments"]) for n in range(WEBHOOK_BATCH_EVENTS)]
+				body = b"\n".join(bodies)
+				response = client.post("/webhooks/payadvantage/batch", data=body, content_type="application/x-ndjson", headers={signature_header: _signature(body)})
+				if response.status_code >= 400:
+					raise RuntimeError(f"webhook_batch: HTTP {response.status_code}")
+				sent += len(bodies)
+			return sent
+
+		results["webhook_batch"] = _timed_rows(post_batches)
+		results["job_create_invoices"] = _timed_rows(lambda: _create_invoices_for_upcoming_payments(app))
+		results["job_mark_overdue"] = _timed_rows(lambda: _mark_overdue_payments(app))
+		provider_calls = simulator.stats()
+
+	return {
+		"rows": rows,
+		"metrics": results,
+		"provider_calls": provider_calls,
+	}
+
+
+def best_of(runs: list[dict]) -> dict:
+	# Per metric, the run with the lowest ms_per_op, plus every run's value
+	merged = dict(runs[0])
+	merged["metrics"] = {}
+	for metric in runs[0]["metrics"]:
+		values = [run["metrics"][metric] for run in runs]
+		timed = [value for value in values if value["ms_per_op"] is not None]
+		best = dict(min(timed, key=lambda value: value["ms_per_op"]) if timed else values[0])
+		best["runs_ms_per_op"] = [value["ms_per_op"] for value in values]
+		merged["metrics"][metric] = best
+	return merged
+
+
+def parameters(options) -> dict:
+	return {
+		"requests": options.requests,
+		"repeat": options.repeat,
+		"webhook_events": WEBHOOK_EVENTS,
+		"webhook_batch_events": WEBHOOK_BATCHES * WEBHOOK_BATCH_EVENTS,
+		"settings": {
+			name: value for name, value in sorted(os.environ.items()) if name.startswith(PARAMETER_PREFIXES)
+		},
+	}
+
+
+def _drain(app, drain_inbox) -> int:
+	total = 0
+	with app.app_context():
+		while True:
+			counts = drain_inbox()
+			handled = sum(counts.values())
+			if not handled:
+				return total
+			total += handled
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+	if baseline.get("parameters") != results["parameters"]:
+		raise SystemExit(
+			"Baseline was recorded with different parameters; rerun with them or update the baseline.\n"
+			f"  baseline: {json.dumps(baseline.get('parameters'), sort_keys=True)}\n"
+			f"  current:  {json.dumps(results['parameters'], sort_keys=True)}"
+		)
+	regressions = []
+	for label, scale in results["scales"].items():
+		expected = baseline.get("scales", {}).get(label)
+		if not expected:
+			continue
+		for metric, values in scale["metrics"].items():
+			before = expected["metrics"].get(metric, {}).get("ms_per_op")
+			after = values.get("ms_per_op")
+			if before and after and after > before * (1 + tolerance):
+				regressions.append(f"{label} {metric}: {after} ms/op vs baseline {before} ({after / before - 1:+.0%})")
+	return regressions
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="Benchmark the booking-to-payment pipeline.")
+	parser.add_argument("--scale", action="append", choices=sorted(SCALES), help="Payments to seed; repeatable (default 10k).")
+	parser.add_argument("--requests", type=int, default=100, help="Timed requests per HTTP metric.")
+	parser.add_argument("--repeat", type=int, default=3, help="Runs per scale; the best run of each metric is kept.")
+	parser.add_argument("--output", help="Write JSON results here instead of stdout.")
+	parser.add_argument("--baseline", help="Baseline JSON to compare against.")
+	parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before flagging a regression.")
+	parser.add_argument("--update-baseline", action="store_true", help="Write the results to --baseline.")
+	parser.add_argument("--workdir", help="Keep databases and webhook logs here (default: a temporary directory).")
+	options = parser.parse_args()
+
+	for name, value in DEFAULT_ENV.items():
+		os.environ.setdefault(name, value)
+	workdir = Path(options.workdir or tempfile.mkdtemp(prefix="rental-bench-"))
+	workdir.mkdir(parents=True, exist_ok=True)
+
+	results = {
+		"python": platform.python_version(),
+		"sqlite": sqlite3.sqlite_version,
+		"machine": platform.machine(),
+		"parameters": parameters(options),
+		"scales": {},
+	}
+	try:
+		for label in options.scale or ["10k"]:
+			runs = []
+			for run in range(1, options.repeat + 1):
+				print(f"Running {label} ({run}/{options.repeat})...", file=sys.stderr)
+				runs.append(run_scale(label, SCALES[label], workdir, options.requests, run))
+			results["scales"][label] = best_of(runs)
+			for metric, values in results["scales"][label]["metrics"].items():
+				print(f"  {metric:<24} {values['ms_per_op']} ms/op  (runs: {values['runs_ms_per_op']})", file=sys.stderr)
+	finally:
+		if not options.workdir:
+			shutil.rmtree(workdir, ignore_errors=True)
+
+	output = json.dumps(results, indent=2)
+	if options.output:
+		Path(options.output).write_text(output)
+	else:
+		print(output)
+
+	if options.baseline and options.update_baseline:
+		path = Path(options.baseline)
+		baseline = json.loads(path.read_text()) if path.exists() else {"scales": {}}
+		if baseline.get("parameters") != results["parameters"]:
+			# Scales recorded with other parameters are no longer comparable
+			baseline = {"scales": {}}
+		baseline.update({key: value for key, value in results.items() if key != "scales"})
+		baseline["scales"].update(results["scales"])
+		path.write_text(json.dumps(baseline, indent=2))
+		print(f"Updated baseline {path}", file=sys.stderr)
+	elif options.baseline:
+		regressions = compare(results, json.loads(Path(options.baseline).read_text()), options.tolerance)
+		for regression in regressions:
+			print(f"REGRESSION {regression}", file=sys.stderr)
+		if regressions:
+			sys.exit(1)
+		print("No regressions against baseline", file=sys.stderr)
+
+
+if __name__ == "__main__":
+	main()
\ No newline at end of file
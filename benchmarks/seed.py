@@ -0,0 +1,97 @@
+"""Synthetic bookings, payment schedules and payments for benchmarks.
+
+Each booking has a weekly schedule of ten payments, so a scale of N payments
+seeds N / 10 bookings. Payment dates spread from about six months ago to
+four months ahead. Past payments are mostly complete and all invoiced, and a
+few are still pending, ready for the overdue sweep. Payments in the invoice
+horizon have no invoice yet. The rows depend only on the seed and today's date.
+
+    from benchmarks.seed import seed
+    seed(app, 100_000)
+"""
+import time
+import random
+from datetime import date, datetime, timedelta
+from sqlalchemy import insert
+from app import db, rollups
+from app.models import Booking, Payment, PaymentSchedule
+
+PAYMENTS_PER_BOOKING = 10
+CHUNK = 20_000
+FIRST_NAMES = ("Ava", "Liam", "Mia", "Noah", "Isla", "Jack", "Zoe", "Oliver", "Ruby", "Leo", "Chloe", "Henry")
+LAST_NAMES = ("Smith", "Nguyen", "Brown", "Wilson", "Taylor", "Martin", "Kelly", "Patel", "Walker", "Young")
+
+
+def provider_payment_id(payment_id: int) -> str:
+	return f"pmt_{payment_id}"
+
+
+def _booking_rows(rng: random.Random, first_id: int, count: int, today: date) -> tuple[list[dict], list[dict], list[dict]]:
+	bookings, schedules, payments = [], [], []
+	for booking_id in range(first_id, first_id + count):
+		start = today + timedelta(days=rng.randint(-180, 60))
+		name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+		amount = rng.randrange(5_000, 50_000, 100)
+		bookings.append({
+			"id": booking_id,
+			"customer_name": name,
+			"email": f"{name.replace(' ', '.').lower()}.{booking_id}@example.com",
+			"phone": f"04{rng.randrange(10**8):08d}",
+			"start_date": start,
+			"end_date": start + timedelta(weeks=PAYMENTS_PER_BOOKING),
+			"status": "active",
+			"created_at": datetime.combine(start, datetime.min.time()) - timedelta(days=7, seconds=rng.randrange(86400)),
+		})
+		schedules.append({
+			"id": booking_id,
+			"booking_id": booking_id,
+			"upfront_amount_cents": 0,
+			"recurring_amount_cents": amount,
+			"frequency": "weekly",
+			"provider_schedule_id": f"DD{booking_id:010d}",
+			"recurring_start_date": start,
+			"next_debit_date": start + timedelta(weeks=PAYMENTS_PER_BOOKING),
+			"status": "active",
+			"created_at": bookings[-1]["created_at"],
+		})
+		for n in range(PAYMENTS_PER_BOOKING):
+			payment_id = (booking_id - 1) * PAYMENTS_PER_BOOKING + n + 1
+			scheduled = start + timedelta(weeks=n)
+			past = scheduled < today
+			complete = past and rng.random() < 0.95
+			payments.append({
+				"id": payment_id,
+				"booking_id": booking_id,
+				"scheduled_date": scheduled,
+				"scheduled_amount_cents": amount,
+				"paid_amount_cents": amount if complete else None,
+				"paid_date": scheduled if complete else None,
+				"status": "complete" if complete else "pending",
+				"provider_payment_id": provider_payment_id(payment_id),
+				"invoice_id": f"INV-{payment_id}" if past else None,
+				"created_at": bookings[-1]["created_at"],
+			})
+	return bookings, schedules, payments
+
+
+def seed(app, payments: int, seed_value: int = 1) -> dict:
+	# Bulk inserts in chunks, keeping payment_rollups in step. Returns row counts
+	rng = random.Random(seed_value)
+	today = date.today()
+	booking_count = max(payments // PAYMENTS_PER_BOOKING, 1)
+	per_chunk = CHUNK // PAYMENTS_PER_BOOKING
+	started = time.monotonic()
+	with app.app_context():
+		for first in range(1, booking_count + 1, per_chunk):
+			bookings, schedules, payment_rows = _booking_rows(rng, first, min(per_chunk, booking_count - first + 1), today)
+			with db.engine.begin() as conn:
+				conn.execute(insert(Booking), bookings)
+				conn.execute(insert(PaymentSchedule), schedules)
+				conn.execute(insert(Payment), payment_rows)
+				rollups.record_inserts(conn, payment_rows)
+				rollups.record_booking_inserts(conn, bookings)
+	return {
+		"bookings": booking_count,
+		"payments": booking_count * PAYMENTS_PER_BOOKING,
+		"seconds": round(time.monotonic() - started, 3),
+	}
\ No newline at end of file
@@ -0,0 +1,359 @@
+"""Local stand-ins for the PayAdvantage and Xero APIs, for load tests with no network.
+
+Run from the repository root:
+
+    python -m benchmarks.simulators --port 8090
+
+and point the app at it with the environment variables it prints. One server
+serves both providers:
+
+    /payadvantage/v3/direct_debits       POST
+    /xero/api.xro/2.0/Invoices           POST (up to 50 invoices, summarizeErrors)
+    /xero/connections                    GET
+    /xero/connect/token                  POST (authorization_code, refresh_token)
+    /xero/identity/connect/authorize     GET (redirects straight back with a code)
+    /_sim/stats, /_sim/reset             request counts per endpoint and status
+
+Behaviour is configured per provider with SIM_<PROVIDER>_<SETTING>, falling
+back to SIM_<SETTING>:
+
+    LATENCY            fixed:MS | uniform:LO,HI | normal:MEAN,SD | lognormal:MEDIAN,SIGMA
+                       | pareto:MIN,ALPHA (milliseconds; default fixed:0)
+    ERROR_RATE         fraction of requests answered 503 (default 0)
+    THROTTLE_RATE      fraction of requests answered 429 at random (default 0)
+    RATE_LIMIT         calls per rolling minute before answering 429 (default 0, off)
+    MAX_CONCURRENT     in-flight calls before answering 429 (default 0, off)
+    RETRY_AFTER        Retry-After seconds sent with 429s (default 1)
+    INVALID_RATE       fraction of invoices rejected with ValidationErrors (Xero only)
+
+SIM_SEED makes the random draws repeatable. Repeated Idempotency-Keys are
+answered with the original response, like the real services.
+"""
+import os
+import time
+import uuid
+import random
+import argparse
+import threading
+from collections import Counter, deque
+from typing import Callable, Optional
+from flask import Flask, jsonify, redirect, request
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+PROVIDERS = ("payadvantage", "xero")
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+	# Returns a sampler of seconds for a distribution spec in milliseconds
+	kind, _, args = spec.partition(":")
+	values = [float(value) for value in args.split(",") if value]
+	samplers = {
+		"fixed": lambda rng, ms: ms,
+		"uniform": lambda rng, lo, hi: rng.uniform(lo, hi),
+		"normal": lambda rng, mean, sd: rng.gauss(mean, sd),
+		"lognormal": lambda rng, median, sigma: median * rng.lognormvariate(0, sigma),
+		"pareto": lambda rng, minimum, alpha: minimum * rng.paretovariate(alpha),
+	}
+	if kind not in samplers:
+		raise ValueError(f"Unknown latency distribution {kind!r}")
+	sampler = samplers[kind]
+	try:
+		sampler(random.Random(0), *values)
+	except TypeError:
+		raise ValueError(f"Wrong number of parameters in latency {spec!r}") from None
+	return lambda rng: max(sampler(rng, *values), 0.0) / 1000.0
+
+
+class ProviderBehaviour:
+	def __init__(
+		self,
+		latency: str = "fixed:0",
+		error_rate: float = 0.0,
+		throttle_rate: float = 0.0,
+		rate_limit: int = 0,
+		max_concurrent: int = 0,
+		retry_after: float = 1.0,
+		invalid_rate: float = 0.0,
+	):
+		self.latency_spec = latency
+		self.latency = parse_latency(latency)
+		self.error_rate = error_rate
+		self.throttle_rate = throttle_rate
+		self.rate_limit = rate_limit
+		self.max_concurrent = max_concurrent
+		self.retry_after = retry_after
+		self.invalid_rate = invalid_rate
+
+	@classmethod
+	def from_env(cls, provider: str) -> "ProviderBehaviour":
+		def setting(name: str, default: str) -> str:
+			return os.getenv(f"SIM_{provider.upper()}_{name}") or os.getenv(f"SIM_{name}", default)
+
+		return cls(
+			latency=setting("LATENCY", "fixed:0"),
+			error_rate=float(setting("ERROR_RATE", "0")),
+			throttle_rate=float(setting("THROTTLE_RATE", "0")),
+			rate_limit=int(setting("RATE_LIMIT", "0")),
+			max_concurrent=int(setting("MAX_CONCURRENT", "0")),
+			retry_after=float(setting("RETRY_AFTER", "1")),
+			invalid_rate=float(setting("INVALID_RATE", "0")),
+		)
+
+
+class ProviderState:
+	# Counters, rate-limit window and idempotency replay cache for one provider
+	def __init__(self, behaviour: ProviderBehaviour, rng: random.Random):
+		self.behaviour = behaviour
+		self.rng = rng
+		self.in_flight = 0
+		self.window: deque[float] = deque()
+		self.replies: dict[str, tuple[dict, int]] = {}
+		self.counts: Counter = Counter()
+		self.replays = 0
+		self.latency_total = 0.0
+		self._lock = threading.Lock()
+
+	def admit(self) -> tuple[Optional[int], float]:
+		# Decides up front how this call ends: (error status or None, latency)
+		behaviour = self.behaviour
+		now = time.monotonic()
+		with self._lock:
+			latency = behaviour.latency(self.rng)
+			draw = self.rng.random()
+			while self.window and now - self.window[0] >= 60:
+				self.window.popleft()
+			if behaviour.rate_limit and len(self.window) >= behaviour.rate_limit:
+				return 429, latency
+			if behaviour.max_concurrent and self.in_flight >= behaviour.max_concurrent:
+				return 429, latency
+			self.window.append(now)
+			if draw < behaviour.throttle_rate:
+				return 429, latency
+			if draw < behaviour.throttle_rate + behaviour.error_rate:
+				return 503, latency
+			self.in_flight += 1
+			return None, latency
+
+	def release(self) -> None:
+		with self._lock:
+			self.in_flight -= 1
+
+	def record(self, endpoint: str, status: int, latency: float) -> None:
+		with self._lock:
+			self.counts[f"{endpoint} {status}"] += 1
+			self.latency_total += latency
+
+	def reply(self, key: Optional[str], handler: Callable[[], tuple[dict, int]]) -> tuple[dict, int]:
+		if key:
+			with self._lock:
+				if key in self.replies:
+					self.replays += 1
+					return self.replies[key]
+		body, status = handler()
+		if key and status < 400:
+			with self._lock:
+				self.replies.setdefault(key, (body, status))
+		return body, status
+
+	def invalid(self) -> bool:
+		with self._lock:
+			return self.rng.random() < self.behaviour.invalid_rate
+
+	def snapshot(self) -> dict:
+		with self._lock:
+			calls = sum(self.counts.values())
+			return {
+				"latency": self.behaviour.latency_spec,
+				"calls": calls,
+				"by_status": dict(self.counts),
+				"mean_latency_ms": round(self.latency_total / calls * 1000, 2) if calls else 0.0,
+				"idempotent_replays": self.replays,
+			}
+
+
+def create_simulator(behaviours: Optional[dict[str, ProviderBehaviour]] = None, seed: Optional[int] = None) -> Flask:
+	behaviours = behaviours or {provider: ProviderBehaviour.from_env(provider) for provider in PROVIDERS}
+	if seed is None and os.getenv("SIM_SEED"):
+		seed = int(os.getenv("SIM_SEED"))
+	rng = random.Random(seed)
+	states = {provider: ProviderState(behaviours[provider], rng) for provider in PROVIDERS}
+	app = Flask(__name__)
+	app.config["SIMULATOR_STATES"] = states
+
+	def simulate(provider: str, endpoint: str, handler: Callable[[], tuple[dict, int]]):
+		state = states[provider]
+		error, latency = state.admit()
+		time.sleep(latency)
+		if error == 429:
+			state.record(endpoint, 429, latency)
+			response = jsonify({"message": "Rate limit exceeded"})
+			response.headers["Retry-After"] = str(state.behaviour.retry_after)
+			return response, 429
+		if error:
+			state.record(endpoint, error, latency)
+			return jsonify({"message": "Service unavailable"}), error
+		try:
+			body, status = state.reply(request.headers.get("Idempotency-Key"), handler)
+		finally:
+			state.release()
+		state.record(endpoint, status, latency)
+		return jsonify(body), status
+
+	def bearer() -> Optional[str]:
+		header = request.headers.get("Authorization", "")
+		return header[len("Bearer "):] if header.startswith("Bearer ") else None
+
+	@app.post("/payadvantage/v3/direct_debits")
+	def direct_debits():
+		def handle():
+			if not bearer() and not request.authorization:
+				return {"message": "Unauthorized"}, 401
+			body = request.get_json(silent=True) or {}
+			customer = body.get("Customer") or {}
+			if not customer.get("Name") or not body.get("RecurringAmount") or not body.get("Frequency"):
+				return {"message": "Customer.Name, RecurringAmount and Frequency are required"}, 400
+			code = f"DD{uuid.uuid4().hex[:10].upper()}"
+			# schedule_id is what the outbox stores as provider_schedule_id
+			return {
+				"schedule_id": code,
+				"Code": code,
+				"Status": "Active",
+				"Customer": customer,
+				"RecurringAmount": body["RecurringAmount"],
+				"UpfrontAmount": body.get("UpfrontAmount"),
+				"Frequency": body["Frequency"],
+				"RecurringDateStart": body.get("RecurringDateStart"),
+			}, 200
+		return simulate("payadvantage", "direct_debits", handle)
+
+	@app.post("/xero/api.xro/2.0/Invoices")
+	def invoices():
+		def handle():
+			if not bearer() or not request.headers.get("Xero-tenant-id"):
+				return {"Title": "Unauthorized"}, 401
+			submitted = (request.get_json(silent=True) or {}).get("Invoices") or []
+			if not submitted or len(submitted) > 50:
+				return {"Message": "Send between 1 and 50 invoices"}, 400
+			returned = []
+			for invoice in submitted:
+				errors = []
+				if not (invoice.get("Contact") or {}).get("Name") or not invoice.get("LineItems"):
+					errors.append({"Message": "Contact name and line items are required"})
+				elif states["xero"].invalid():
+					errors.append({"Message": "Simulated validation error"})
+				returned.append({
+					**invoice,
+					"InvoiceID": None if errors else str(uuid.uuid4()),
+					"StatusAttributeString": "ERROR" if errors else "OK",
+					"ValidationErrors": errors,
+				})
+			if any(invoice["ValidationErrors"] for invoice in returned) and request.args.get("summarizeErrors") != "false":
+				return {"Message": "A validation exception occurred", "Elements": returned}, 400
+			return {"Invoices": returned}, 200
+		return simulate("xero", "invoices", handle)
+
+	@app.get("/xero/connections")
+	def connections():
+		def handle():
+			if not bearer():
+				return {"Title": "Unauthorized"}, 401
+			return [{"id": str(uuid.uuid4()), "tenantId": "simulated-tenant", "tenantType": "ORGANISATION", "tenantName": "Simulator"}], 200
+		return simulate("xero", "connections", handle)
+
+	@app.post("/xero/connect/token")
+	def token():
+		def handle():
+			grant = request.form.get("grant_type")
+			required = {"authorization_code": "code", "refresh_token": "refresh_token"}.get(grant)
+			if not required or not request.form.get(required):
+				return {"error": "invalid_grant"}, 400
+			# Refresh tokens rotate, as they do at Xero
+			return {
+				"access_token": uuid.uuid4().hex,
+				"refresh_token": uuid.uuid4().hex,
+				"expires_in": 1800,
+				"token_type": "Bearer",
+				"scope": "offline_access accounting.transactions accounting.contacts",
+			}, 200
+		return simulate("xero", "token", handle)
+
+	@app.get("/xero/identity/connect/authorize")
+	def authorize():
+		# No login page: consent is granted immediately
+		redirect_uri = request.args.get("redirect_uri", "")
+		return redirect(f"{redirect_uri}?code={uuid.uuid4().hex}&state={request.args.get('state', '')}")
+
+	@app.get("/_sim/stats")
+	def stats():
+		return jsonify({provider: state.snapshot() for provider, state in states.items()})
+
+	@app.post("/_sim/reset")
+	def reset():
+		for provider in PROVIDERS:
+			states[provider] = ProviderState(behaviours[provider], rng)
+		return jsonify({"ok": True})
+
+	return app
+
+
+def app_environment(base_url: str) -> dict[str, str]:
+	# Settings that point the booking app at a simulator
+	return {
+		"PAYADVANTAGE_BASE_URL": f"{base_url}/payadvantage",
+		"XERO_API_BASE": f"{base_url}/xero/api.xro/2.0",
+		"XERO_IDENTITY_URL": f"{base_url}/xero/connect/token",
+		"XERO_CONNECTIONS_URL": f"{base_url}/xero/connections",
+		"XERO_AUTHORIZE_URL": f"{base_url}/xero/identity/connect/authorize",
+	}
+
+
+class _QuietHandler(WSGIRequestHandler):
+	def log_request(self, *args, **kwargs) -> None:
+		pass
+
+
+class BackgroundSimulator:
+	# Serves a simulator from a daemon thread, for benchmarks in one process
+	def __init__(self, app: Optional[Flask] = None, host: str = "127.0.0.1", port: int = 0):
+		self.app = app or create_simulator()
+		self.server = make_server(host, port, self.app, threaded=True, request_handler=_QuietHandler)
+		self.base_url = f"http://{host}:{self.server.server_port}"
+		self.thread = threading.Thread(target=self.server.serve_forever, name="provider-simulator", daemon=True)
+
+	def __enter__(self) -> "BackgroundSimulator":
+		self.thread.start()
+		return self
+
+	def __exit__(self, *exc_info) -> None:
+		self.server.shutdown()
+		self.thread.join()
+
+	def environment(self) -> dict[str, str]:
+		return app_environment(self.base_url)
+
+	def stats(self) -> dict:
+		return {provider: state.snapshot() for provider, state in self.app.config["SIMULATOR_STATES"].items()}
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="Serve simulated PayAdvantage and Xero APIs.")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8090)
+	options = parser.parse_args()
+	app = create_simulator()
+	base_url = f"http://{options.host}:{options.port}"
+	for name, value in app_environment(base_url).items():
+		print(f"{name}={value}")
+	for provider, state in app.config["SIMULATOR_STATES"].items():
+		behaviour = state.behaviour
+		print(
+			f"# {provider}: latency={behaviour.latency_spec} error_rate={behaviour.error_rate} "
+			f"throttle_rate={behaviour.throttle_rate} rate_limit={behaviour.rate_limit}/min "
+			f"max_concurrent={behaviour.max_concurrent}",
+			flush=True,
+		)
+	make_server(options.host, options.port, app, threaded=True).serve_forever()
+
+
+if __name__ == "__main__":
+	main()
\ No newline at end of file
@@ -0,0 +1,59 @@
+"""Per-request cost of webhook signature verification.
+
+Run from the repository root:
+
+    python -m benchmarks.webhook_signature
+"""
+import io
+import hmac
+import json
+import hashlib
+import timeit
+from app.payment_events import parse_event
+from app.signatures import SignatureVerifier
+
+SECRET = b"benchmark-secret-" + b"x" * 48
+ROUNDS = 20000
+
+
+def _event_body(size: int) -> bytes:
+	event = {"event_id": "evt_1", "payment_id": "pmt_1", "status": "complete", "paid_amount_cents": 12500, "paid_date": "2026-01-01"}
+	body = json.dumps(event)
+	if len(body) < size:
+		event["note"] = "x" * (size - len(body))
+	return json.dumps(event).encode()
+
+
+def _per_call_us(func, rounds: int) -> float:
+	return min(timeit.repeat(func, number=rounds, repeat=3)) / rounds * 1e6
+
+
+def main() -> None:
+	verifier = SignatureVerifier(SECRET)
+	print(f"{'body':>9}  {'parse':>9}  {'verify+parse':>13}  {'overhead':>9}  {'naive hmac.new':>15}")
+	for size in (256, 4 * 1024, 64 * 1024, 1024 * 1024):
+		body = _event_body(size)
+		signature = hmac.new(SECRET, body, hashlib.sha256).hexdigest()
+		rounds = max(ROUNDS * 256 // size, 200)
+
+		def parse_only():
+			parse_event(io.BytesIO(body).read())
+
+		def verify_and_parse():
+			parse_event(verifier.read_verified(io.BytesIO(body), signature))
+
+		def naive():
+			# Re-keys on every request and compares with ==
+			stream = io.BytesIO(body)
+			data = stream.read()
+			if hmac.new(SECRET, data, hashlib.sha256).hexdigest() == signature:
+				parse_event(data)
+
+		parse_us = _per_call_us(parse_only, rounds)
+		verify_us = _per_call_us(verify_and_parse, rounds)
+		naive_us = _per_call_us(naive, rounds)
+		print(f"{len(body):>8}B  {parse_us:>7.1f}us  {verify_us:>11.1f}us  {verify_us - parse_us:>7.1f}us  {naive_us:>13.1f}us")
+
+
+if __name__ == "__main__":
+	main()
\ No newline at end of file
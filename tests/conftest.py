@@ -0,0 +1,41 @@
+import os
+import pytest
+from benchmarks.seed import seed
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+	# One seeded SQLite database for the session; jobs are left to the tests
+	os.environ["DATABASE_URL"] = f"sqlite:///{tmp_path_factory.mktemp('db') / 'test.db'}"
+	os.environ["SCHEDULER_MODE"] = "external"
+	from app import create_app
+
+	app = create_app()
+	app.config.update(TESTING=True, QUERY_BUDGET_STRICT=True, WTF_CSRF_ENABLED=False)
+	seed(app, 2_000)
+	return app
+
+
+@pytest.fixture
+def client(app):
+	return app.test_client()
+
+
+@pytest.fixture
+def booking(app):
+	from datetime import date, timedelta
+	from app import db
+	from app.models import Booking
+
+	with app.app_context():
+		number = Booking.query.count() + 1
+		booking = Booking(
+			customer_name="Test Customer",
+			email=f"test.customer.{number}@example.com",
+			phone="0400000000",
+			start_date=date.today(),
+			end_date=date.today() + timedelta(weeks=12),
+		)
+		db.session.add(booking)
+		db.session.commit()
+		return booking.id
\ No newline at end of file
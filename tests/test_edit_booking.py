@@ -0,0 +1,51 @@
+from datetime import date, timedelta
+from app.models import OutboxMessage, Payment
+
+
+def _schedule_form(**overrides) -> dict:
+	form = {
+		"upfront_amount": "150.00",
+		"recurring_amount": "80.00",
+		"frequency": "weekly",
+		"recurring_date_start": (date.today() + timedelta(days=14)).isoformat(),
+		"description": "Car rental",
+		"reminder_days": "1",
+	}
+	form.update(overrides)
+	return form
+
+
+def _upfront(app, booking):
+	with app.app_context():
+		payments = Payment.query.filter_by(booking_id=booking, scheduled_date=date.today()).all()
+		messages = OutboxMessage.query.filter_by(booking_id=booking, kind="xero.create_invoice").count()
+		return [payment.scheduled_amount_cents for payment in payments], messages
+
+
+def test_double_submit_queues_one_upfront_invoice(app, client, booking):
+	for _ in range(2):
+		response = client.post(f"/admin/bookings/{booking}/edit", data=_schedule_form())
+		assert response.status_code == 302
+	assert _upfront(app, booking) == ([15000], 1)
+
+
+def test_changed_upfront_amount_replaces_queued_payment(app, client, booking):
+	client.post(f"/admin/bookings/{booking}/edit", data=_schedule_form())
+	client.post(f"/admin/bookings/{booking}/edit", data=_schedule_form(upfront_amount="200.00"))
+	assert _upfront(app, booking) == ([20000], 2)
+
+
+def test_replacing_a_schedule_drops_its_pending_debits(app, client, booking):
+	client.post(f"/admin/bookings/{booking}/edit", data=_schedule_form(
+		recurring_amount="50.00",
+		recurring_date_start=(date.today() + timedelta(days=3)).isoformat(),
+	))
+	new_start = date.today() + timedelta(days=20)
+	client.post(f"/admin/bookings/{booking}/edit", data=_schedule_form(
+		recurring_amount="90.00",
+		frequency="monthly",
+		recurring_date_start=new_start.isoformat(),
+	))
+	with app.app_context():
+		recurring = Payment.query.filter(Payment.booking_id == booking, Payment.scheduled_date > date.today()).all()
+	assert [(payment.scheduled_date, payment.scheduled_amount_cents) for payment in recurring] == [(new_start, 9000)]
\ No newline at end of file
@@ -0,0 +1,43 @@
+import gzip
+import json
+from app import event_log
+
+
+def _write_segment(directory, name, stamps):
+	with gzip.open(directory / name, "wt") as segment:
+		for ts in stamps:
+			segment.write(json.dumps({"ts": ts, "provider": "payadvantage", "body": {"payment_id": f"p{ts}"}}) + "\n")
+
+
+def test_closed_segments_are_named_with_their_last_record(tmp_path, monkeypatch):
+	now = [0.0]
+	monkeypatch.setattr(event_log.time, "time", lambda: now[0])
+	writer = event_log.SegmentWriter(tmp_path, "payadvantage", max_bytes=10**6, max_age=10)
+	for now[0] in (1000.0, 1004.0, 1020.0):
+		writer.append(["{}"])
+	writer.close()
+	starts = event_log.segments(tmp_path, "payadvantage")
+	assert [start for start, _ in starts] == [1000.0, 1020.0]
+	assert list(event_log.segment_ends(starts).values()) == [1020.0, 1004.0]
+
+
+def test_replay_since_skips_segments_that_end_before_it(app, tmp_path, monkeypatch):
+	stamp = event_log._format_stamp
+	# A cleanly closed segment, a crashed one followed by the same pid's next
+	# segment, and one still being written
+	_write_segment(tmp_path, f"payadvantage-{stamp(1000)}-11.{stamp(1009)}.ndjson.gz", [1000, 1009])
+	_write_segment(tmp_path, f"payadvantage-{stamp(1010)}-12.ndjson.gz", [1010, 1019])
+	_write_segment(tmp_path, f"payadvantage-{stamp(1020)}-12.ndjson.gz", [1020, 1030])
+	_write_segment(tmp_path, f"payadvantage-{stamp(1025)}-13.ndjson.gz", [1025, 1040])
+	opened = []
+	read_segment = event_log.read_segment
+	monkeypatch.setattr(event_log, "read_segment", lambda path: opened.append(path.name) or read_segment(path))
+
+	with app.app_context():
+		counts = event_log.replay(tmp_path, since=1021)
+
+	assert sorted(name.split("-")[-1][:2] for name in opened) == ["12", "13"]
+	assert (counts["segments"], counts["segments_skipped"]) == (2, 2)
+	# Only 1025, 1030 and 1040 fall inside the window
+	assert counts["read"] == 3
+	assert counts["skipped"] == 3
\ No newline at end of file
@@ -0,0 +1,50 @@
+from datetime import date, timedelta
+import pytest
+from app import db
+from app.expansion import debit_dates, expand_schedules
+from app.models import Booking, Payment, PaymentSchedule
+
+
+@pytest.mark.parametrize("frequency, anchor, expected", [
+	("weekly", date(2026, 2, 26), [date(2026, 2, 26), date(2026, 3, 5), date(2026, 3, 12), date(2026, 3, 19), date(2026, 3, 26)]),
+	("fortnightly", date(2026, 1, 29), [date(2026, 1, 29), date(2026, 2, 12), date(2026, 2, 26), date(2026, 3, 12), date(2026, 3, 26)]),
+	# Month ends clamp to shorter months but keep the anchor's day afterwards
+	("monthly", date(2026, 1, 31), [date(2026, 1, 31), date(2026, 2, 28), date(2026, 3, 31)]),
+	("monthly", date(2028, 1, 31), [date(2028, 1, 31), date(2028, 2, 29), date(2028, 3, 31)]),
+	("monthly", date(2026, 1, 30), [date(2026, 1, 30), date(2026, 2, 28), date(2026, 3, 30)]),
+])
+def test_debit_dates(frequency, anchor, expected):
+	dates, following = debit_dates(frequency, anchor, anchor, date(anchor.year, 3, 31))
+	assert dates == expected
+	assert following > date(anchor.year, 3, 31)
+
+
+def test_debit_dates_from_a_later_start_stay_on_the_anchor():
+	dates, following = debit_dates("monthly", date(2026, 1, 31), date(2026, 3, 1), date(2026, 5, 31))
+	assert dates == [date(2026, 3, 31), date(2026, 4, 30), date(2026, 5, 31)]
+	assert following == date(2026, 6, 30)
+	dates, following = debit_dates("fortnightly", date(2026, 1, 1), date(2026, 1, 2), date(2026, 1, 29))
+	assert dates == [date(2026, 1, 15), date(2026, 1, 29)]
+	assert following == date(2026, 2, 12)
+
+
+def test_expansion_skips_debits_before_today(app, booking):
+	today = date(2026, 10, 18)
+	start = today - timedelta(weeks=4)
+	with app.app_context():
+		db.session.get(Booking, booking).end_date = today + timedelta(weeks=12)
+		schedule = PaymentSchedule(
+			booking_id=booking,
+			recurring_amount_cents=5000,
+			frequency="weekly",
+			recurring_start_date=start,
+			next_debit_date=start,
+		)
+		db.session.add(schedule)
+		db.session.commit()
+
+		expand_schedules(today=today, horizon_days=14, schedule_ids=[schedule.id])
+
+		dates = sorted(payment.scheduled_date for payment in Payment.query.filter_by(booking_id=booking))
+		assert dates == [today, today + timedelta(weeks=1), today + timedelta(weeks=2)]
+		assert db.session.get(PaymentSchedule, schedule.id).next_debit_date == today + timedelta(weeks=3)
\ No newline at end of file
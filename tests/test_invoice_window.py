@@ -0,0 +1,27 @@
+from datetime import date, timedelta
+from app import db
+from app.models import Payment
+from app.scheduler import _create_invoices_for_upcoming_payments
+from app.xero_client import XeroClient
+
+
+def test_catch_up_stops_at_the_lookback(app, booking, monkeypatch):
+	monkeypatch.setenv("INVOICE_DISPATCH_MODE", "serial")
+	monkeypatch.setattr(
+		XeroClient,
+		"create_invoices_batch",
+		lambda self, invoices: [{"invoice_id": f"INV-{item['idempotency_key']}", "errors": []} for item in invoices],
+	)
+	today = date.today()
+	with app.app_context():
+		payments = {
+			days: Payment(booking_id=booking, scheduled_date=today + timedelta(days=days), scheduled_amount_cents=5000)
+			for days in (-30, -8, -7, -1, 2, 3)
+		}
+		db.session.add_all(payments.values())
+		db.session.commit()
+
+		_create_invoices_for_upcoming_payments(app, horizon_days=2, lookback_days=7)
+
+		invoiced = {days for days, payment in payments.items() if db.session.get(Payment, payment.id).invoice_id}
+	assert invoiced == {-7, -1, 2}
\ No newline at end of file
@@ -0,0 +1,50 @@
+from datetime import date
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import IntegrityError
+from app import db, migrations
+from app.migrations import _add_hot_query_indexes, check_query_plans
+from app.models import SchemaMigration
+
+
+def test_hot_queries_use_indexes(app):
+	with app.app_context():
+		plans = check_query_plans()
+	assert plans
+	scans = [plan for plan in plans if plan["full_scan"]]
+	assert not scans, scans
+
+
+def test_duplicate_provider_payment_ids_stop_the_index_migration(tmp_path):
+	# A pre-index database whose payments share a provider id
+	engine = create_engine(f"sqlite:///{tmp_path / 'dirty.db'}")
+	with engine.begin() as conn:
+		conn.execute(text("CREATE TABLE bookings (id INTEGER PRIMARY KEY, status VARCHAR(20), created_at DATETIME)"))
+		conn.execute(text(
+			"CREATE TABLE payments (id INTEGER PRIMARY KEY, booking_id INTEGER, scheduled_date DATE, "
+			"status VARCHAR(20), provider_payment_id VARCHAR(100), invoice_id VARCHAR(100))"
+		))
+		conn.execute(
+			text("INSERT INTO payments (booking_id, scheduled_date, status, provider_payment_id) VALUES (1, :day, 'pending', :pid)"),
+			[{"day": date.today(), "pid": pid} for pid in ("pmt_1", "pmt_1", "pmt_2", None, None)],
+		)
+	with engine.begin() as conn:
+		with pytest.raises(RuntimeError, match=r"'pmt_1' \(2 rows\)"):
+			_add_hot_query_indexes(conn)
+
+
+def test_only_a_concurrently_recorded_version_is_skipped(app, monkeypatch):
+	def failing(conn):
+		raise IntegrityError("INSERT", {}, Exception("constraint failed"))
+
+	def applied_elsewhere(conn):
+		# Another process records the version while this one is migrating
+		with db.engine.begin() as other:
+			other.execute(SchemaMigration.__table__.insert().values(version=901, name="elsewhere"))
+
+	with app.app_context():
+		monkeypatch.setattr(migrations, "MIGRATIONS", [(900, "failing", failing)])
+		with pytest.raises(IntegrityError):
+			migrations.run_migrations()
+		monkeypatch.setattr(migrations, "MIGRATIONS", [(901, "applied elsewhere", applied_elsewhere)])
+		assert migrations.run_migrations() == []
\ No newline at end of file
@@ -0,0 +1,45 @@
+from datetime import date, timedelta
+from app import db, outbox
+from app.models import Booking, OutboxMessage, PaymentSchedule
+from app.pay_advantage import PayAdvantageClient
+
+
+def test_queued_schedule_edit_is_superseded_by_the_next(app, client, booking, monkeypatch):
+	with app.app_context():
+		email = db.session.get(Booking, booking).email
+	sent = []
+
+	def create_direct_debit_schedule(self, **request):
+		# Other tests' queued messages drain here too
+		if request["email"] == email:
+			sent.append(request)
+		return {"schedule_id": f"DD{len(sent)}"}
+
+	monkeypatch.setattr(PayAdvantageClient, "create_direct_debit_schedule", create_direct_debit_schedule)
+	first_start = date.today() + timedelta(days=7)
+	latest_start = date.today() + timedelta(days=21)
+	for amount, frequency, start in (("50.00", "weekly", first_start), ("80.00", "monthly", latest_start)):
+		client.post(f"/admin/bookings/{booking}/edit", data={
+			"upfront_amount": "10.00",
+			"recurring_amount": amount,
+			"frequency": frequency,
+			"recurring_date_start": start.isoformat(),
+			"description": f"{frequency} rental",
+			"reminder_days": "1",
+		})
+
+	with app.app_context():
+		outbox.drain_outbox()
+		statuses = [
+			message.status
+			for message in OutboxMessage.query.filter_by(booking_id=booking, kind="payadvantage.create_schedule").order_by(OutboxMessage.id)
+		]
+		provider_schedule_id = PaymentSchedule.query.filter_by(booking_id=booking).one().provider_schedule_id
+
+	assert statuses == ["superseded", "done"]
+	assert len(sent) == 1
+	assert sent[0]["recurring_amount_cents"] == 8000
+	assert sent[0]["frequency"] == "monthly"
+	assert sent[0]["recurring_date_start"] == latest_start
+	assert sent[0]["description"] == "monthly rental"
+	assert provider_schedule_id == "DD1"
\ No newline at end of file
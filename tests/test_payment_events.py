@@ -0,0 +1,73 @@
+from datetime import date
+import pytest
+from app import db, rollups
+from app.models import Payment
+from app.payment_events import apply_events, apply_events_bulk, parse_event
+
+
+@pytest.fixture
+def payment(app, booking):
+	with app.app_context():
+		payment = Payment(
+			booking_id=booking,
+			scheduled_date=date.today(),
+			scheduled_amount_cents=5000,
+			provider_payment_id=f"test-pmt-{booking}",
+		)
+		db.session.add(payment)
+		db.session.commit()
+		return payment.id, payment.provider_payment_id
+
+
+def _events(provider_id: str) -> list[dict]:
+	return [parse_event(body) for body in (
+		{"payment_id": provider_id, "sequence": 5, "status": "overdue"},
+		{"payment_id": provider_id, "sequence": 3, "status": "complete"},
+		{"payment_id": provider_id, "sequence": 6, "status": "pending"},
+		{"payment_id": provider_id, "sequence": 7, "status": "complete", "paid_amount_cents": 5000, "paid_date": "2026-10-20"},
+		{"payment_id": provider_id, "sequence": 8, "status": "complete"},
+		{"payment_id": "no-such-payment", "sequence": 1, "status": "complete"},
+	)]
+
+
+@pytest.mark.parametrize("apply", [apply_events, apply_events_bulk])
+def test_sequence_and_transition_rules(app, payment, apply):
+	payment_id, provider_id = payment
+	with app.app_context():
+		outcomes = apply(_events(provider_id))
+		db.session.commit()
+		stored = db.session.get(Payment, payment_id)
+		assert outcomes == [
+			"applied",
+			"out of order",
+			"invalid transition overdue -> pending",
+			"applied",
+			"no change",
+			"payment not found",
+		]
+		assert (stored.status, stored.paid_amount_cents, stored.paid_date, stored.last_event_sequence) == (
+			"complete", 5000, date(2026, 10, 20), 7,
+		)
+		with db.engine.begin() as conn:
+			assert rollups.reconcile(conn) == 0
+
+
+def test_forced_replay_skips_the_ordering_checks(app, payment):
+	payment_id, provider_id = payment
+	with app.app_context():
+		apply_events_bulk([parse_event({"payment_id": provider_id, "sequence": 9, "status": "complete"})])
+		outcomes = apply_events_bulk([parse_event({"payment_id": provider_id, "sequence": 2, "status": "overdue"})], force=True)
+		db.session.commit()
+		assert outcomes == ["applied"]
+		assert db.session.get(Payment, payment_id).status == "overdue"
+
+
+@pytest.mark.parametrize("body, error", [
+	("{not json", "invalid JSON"),
+	({"status": "complete"}, "missing payment_id"),
+	({"payment_id": "p", "status": "refunded"}, "unknown status refunded"),
+	({"payment_id": "p", "sequence": "x"}, "invalid sequence"),
+])
+def test_parse_event_rejects_bad_input(body, error):
+	with pytest.raises(ValueError, match=error):
+		parse_event(body)
\ No newline at end of file
@@ -0,0 +1,13 @@
+import pytest
+
+
+@pytest.mark.parametrize("path", [
+	"/admin/bookings",
+	"/admin/bookings?limit=200&schedule=set&frequency=weekly",
+	"/admin/bookings/search?q=Smith",
+	"/admin/bookings/7/payments",
+])
+def test_admin_views_stay_within_query_budget(client, path):
+	# QUERY_BUDGET_STRICT turns an over-budget view into an error
+	response = client.get(path)
+	assert response.status_code == 200
\ No newline at end of file
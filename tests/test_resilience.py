@@ -0,0 +1,86 @@
+import asyncio
+import time
+import httpx
+import pytest
+import requests
+from app import resilience
+
+
+@pytest.fixture
+def provider(monkeypatch, request):
+	# A fresh breaker per test: three failed calls open it, retries are immediate
+	monkeypatch.setenv("HTTP_BREAKER_FAILURES", "3")
+	monkeypatch.setenv("HTTP_BREAKER_RESET_SECONDS", "0.05")
+	monkeypatch.setenv("HTTP_RETRY_ATTEMPTS", "3")
+	monkeypatch.setenv("HTTP_RETRY_BASE_SECONDS", "0")
+	name = f"test-{request.node.name}"
+	yield name
+	resilience._breakers.pop(name, None)
+
+
+def _unreachable():
+	raise requests.ConnectTimeout("unreachable")
+
+
+def test_breaker_counts_calls_not_attempts(provider):
+	attempts = []
+
+	def send():
+		attempts.append(1)
+		_unreachable()
+
+	for _ in range(2):
+		with pytest.raises(requests.ConnectTimeout):
+			resilience.call(provider, send)
+	# Six attempts, but only two failed calls
+	assert len(attempts) == 6
+	assert resilience.get_breaker(provider).snapshot()["state"] == "closed"
+	with pytest.raises(requests.ConnectTimeout):
+		resilience.call(provider, send)
+	assert resilience.get_breaker(provider).snapshot()["state"] == "open"
+	with pytest.raises(resilience.CircuitOpenError):
+		resilience.call(provider, send)
+	assert len(attempts) == 9
+
+
+def test_half_open_trial_closes_or_reopens(provider):
+	for _ in range(3):
+		with pytest.raises(requests.ConnectTimeout):
+			resilience.call(provider, _unreachable)
+	breaker = resilience.get_breaker(provider)
+	time.sleep(0.06)
+	# A failed trial is not retried and re-opens the breaker with the original error
+	with pytest.raises(requests.ConnectTimeout):
+		resilience.call(provider, _unreachable)
+	assert breaker.snapshot()["state"] == "open"
+	time.sleep(0.06)
+	assert resilience.call(provider, lambda: "ok") == "ok"
+	assert breaker.snapshot() == {"state": "closed", "consecutive_failures": 0, "rejected_calls": 0, "retry_in_seconds": None}
+
+
+def test_rejections_do_not_count_against_the_breaker(provider):
+	response = requests.Response()
+	response.status_code = 400
+
+	def rejected():
+		raise requests.HTTPError("bad request", response=response)
+
+	for _ in range(5):
+		with pytest.raises(requests.HTTPError):
+			resilience.call(provider, rejected)
+	assert resilience.get_breaker(provider).snapshot()["state"] == "closed"
+
+
+def test_async_calls_share_the_breaker(provider):
+	async def unreachable():
+		raise httpx.ConnectError("unreachable")
+
+	async def run():
+		for _ in range(2):
+			with pytest.raises(httpx.ConnectError):
+				await resilience.call_async(provider, unreachable)
+
+	asyncio.run(run())
+	with pytest.raises(requests.ConnectTimeout):
+		resilience.call(provider, _unreachable)
+	assert resilience.get_breaker(provider).snapshot()["state"] == "open"
\ No newline at end of file
@@ -0,0 +1,28 @@
+from app import db, rollups
+from app.models import Booking
+
+
+def _active_count() -> int:
+	return Booking.query.filter_by(status="active").count()
+
+
+def test_booking_rollup_follows_orm_changes(app, booking):
+	with app.app_context():
+		assert rollups.active_bookings() == _active_count()
+		db.session.get(Booking, booking).status = "cancelled"
+		db.session.commit()
+		assert rollups.active_bookings() == _active_count()
+		db.session.delete(db.session.get(Booking, booking))
+		db.session.commit()
+		assert rollups.active_bookings() == _active_count()
+		with db.engine.begin() as conn:
+			assert rollups.reconcile_bookings(conn) == 0
+			assert rollups.reconcile(conn) == 0
+
+
+def test_report_reads_active_bookings_from_the_rollup(app, client):
+	with app.app_context():
+		expected = _active_count()
+	response = client.get("/admin/report")
+	assert response.status_code == 200
+	assert f"<strong>{expected}</strong>" in response.get_data(as_text=True)
\ No newline at end of file
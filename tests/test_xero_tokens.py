@@ -0,0 +1,65 @@
+import threading
+from datetime import datetime, timedelta
+import pytest
+from app import db, leader, xero_client
+from app.models import XeroAuth
+from app.xero_client import XeroClient, reset_token_cache
+
+
+@pytest.fixture
+def expired_auth(app, monkeypatch):
+	refreshes = []
+
+	def refresh(self, row):
+		refreshes.append(row["refresh_token"])
+		return {
+			"access_token": "refreshed",
+			"refresh_token": "rotated",
+			"access_token_expires_at": datetime.utcnow() + timedelta(minutes=29),
+			"scope": row["scope"],
+		}
+
+	monkeypatch.setattr(XeroClient, "_refresh", refresh)
+	with app.app_context():
+		XeroAuth.query.delete()
+		db.session.add(XeroAuth(
+			tenant_id="tenant",
+			access_token="expired",
+			refresh_token="original",
+			access_token_expires_at=datetime.utcnow() - timedelta(minutes=1),
+		))
+		db.session.commit()
+	reset_token_cache()
+	yield refreshes
+	reset_token_cache()
+
+
+def test_expired_token_is_refreshed_and_stored(app, expired_auth):
+	with app.app_context():
+		assert XeroClient()._ensure_access_token() == ("refreshed", "tenant")
+		assert XeroAuth.query.one().refresh_token == "rotated"
+	assert expired_auth == ["original"]
+
+
+def test_waits_for_another_process_refresh(app, expired_auth):
+	with app.app_context():
+		# Another process holds the refresh lock and stores its tokens shortly
+		assert leader.try_acquire(xero_client._REFRESH_LEASE, min_gap=timedelta(0))
+
+		def other_process():
+			with app.app_context():
+				XeroAuth.query.update({
+					"access_token": "from-other-process",
+					"refresh_token": "rotated-elsewhere",
+					"access_token_expires_at": datetime.utcnow() + timedelta(minutes=29),
+				})
+				db.session.commit()
+				leader.release(xero_client._REFRESH_LEASE)
+
+		timer = threading.Timer(0.3, other_process)
+		timer.start()
+		try:
+			assert XeroClient()._ensure_access_token() == ("from-other-process", "tenant")
+		finally:
+			timer.join()
+	assert expired_auth == []
\ No newline at end of file